@@ -0,0 +1,114 @@
+"""Benchmark parse time and peak RSS of the template loaders
+
+Usage:
+    python benchmarks/bench_loader.py [--sizes 1000 10000 100000]
+
+Templates are generated and every measurement runs in a fresh interpreter, since
+Linux carries peak RSS over from the parent process.  Peak RSS includes the
+interpreter itself (roughly 20 MB).
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from synapseformation.utils import iter_resources, read_config
+
+LOADERS = {
+    "yaml (pure python)": lambda path: yaml.load(open(path), Loader=yaml.SafeLoader),
+    "read_config": read_config,
+    "iter_resources": lambda path: sum(1 for _ in iter_resources(path)),
+}
+
+
+def generate_template(n_resources: int) -> dict:
+    """A template with one project, teams, nested folders and ACLs"""
+    resources = {"project": {"type": "project", "properties": {"name": "Benchmark"}}}
+    for i in range(n_resources - 1):
+        if i % 10 == 0:
+            resources[f"team{i}"] = {"type": "team", "properties": {"name": f"T{i}"}}
+        elif i % 10 == 1:
+            resources[f"acl{i}"] = {
+                "type": "acl",
+                "properties": {
+                    "resource": f"folder.folder{i - 2}" if i > 2 else "project.project",
+                    "grants": [
+                        {"principal": f"team.team{i - 1}", "access_type": ["READ"]}
+                    ],
+                },
+            }
+        else:
+            parent = f"folder.folder{i - 1}" if i % 10 > 2 else "project.project"
+            resources[f"folder{i}"] = {
+                "type": "folder",
+                "properties": {"name": f"Folder {i}", "parent": parent},
+            }
+    return {"version": 1, "name": "benchmark", "resources": resources}
+
+
+def write_templates(size: int, directory: str):
+    """Write a yaml and a json template with `size` resources"""
+    template = generate_template(size)
+    Path(directory, f"template{size}.yaml").write_text(
+        yaml.dump(template, Dumper=yaml.CSafeDumper)
+    )
+    Path(directory, f"template{size}.json").write_text(json.dumps(template))
+
+
+def measure(loader: str, path: str):
+    """Run a single loader and print its parse time and peak RSS as JSON"""
+    start = time.perf_counter()
+    LOADERS[loader](path)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "peak_rss_mb": peak_kb / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--generate", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+    if args.generate:
+        write_templates(int(args.generate[0]), args.generate[1])
+        return
+
+    print(
+        f"{'resources':>10} {'format':>6} {'loader':>20} {'seconds':>9} {'peak MB':>8}"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            subprocess.run(
+                [sys.executable, __file__, "--generate", str(size), tmpdir], check=True
+            )
+            paths = {
+                "yaml": Path(tmpdir) / f"template{size}.yaml",
+                "json": Path(tmpdir) / f"template{size}.json",
+            }
+            for fmt, path in paths.items():
+                for loader in LOADERS:
+                    result = subprocess.run(
+                        [sys.executable, __file__, "--measure", loader, str(path)],
+                        capture_output=True,
+                        check=True,
+                        text=True,
+                    )
+                    stats = json.loads(result.stdout)
+                    print(
+                        f"{size:>10} {fmt:>6} {loader:>20} "
+                        f"{stats['seconds']:>9.3f} {stats['peak_rss_mb']:>8.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark load, lookup and save costs of the state backends
+
+Usage:
+    python benchmarks/bench_state.py [--sizes 1000 10000 100000] [--lookups 1000]
+
+"load" opens an existing state, "lookup" resolves random logical names and Synapse
+IDs, "save one" records a single changed resource and "save all" writes a state with
+every resource.  Each backend runs in a fresh directory.
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from synapseformation.state import State
+from synapseformation.sqlite_state import SqliteState
+
+BACKENDS = {"json": ("state.json", State), "sqlite": ("state.db", SqliteState)}
+
+
+def generate_resources(n_resources: int) -> list:
+    """State entries for one project and nested folders"""
+    resources = [
+        {
+            "type": "project",
+            "name": "project",
+            "id": "syn0",
+            "properties": {"name": "Benchmark"},
+            "hash": "0" * 64,
+        }
+    ]
+    for i in range(1, n_resources):
+        resources.append(
+            {
+                "type": "folder",
+                "name": f"folder{i}",
+                "id": f"syn{i}",
+                "properties": {"name": f"Folder {i}", "parent": "project.project"},
+                "hash": f"{i:064x}",
+            }
+        )
+    return resources
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench(backend: str, size: int, lookups: int, directory: str) -> dict:
+    filename, state_class = BACKENDS[backend]
+    path = Path(directory, filename)
+    resources = generate_resources(size)
+
+    def save_all():
+        state = state_class(path)
+        state.resources = resources
+        if backend == "json":
+            state.save()
+
+    results = {"save all": timed(save_all)}
+    state = None
+
+    def load():
+        nonlocal state
+        state = state_class(path)
+        len(state.resources)
+
+    results["load"] = timed(load)
+    names = random.sample(range(size), min(lookups, size))
+
+    def lookup():
+        for i in names:
+            name = "project" if i == 0 else f"folder{i}"
+            state.get_id(name, "project" if i == 0 else "folder")
+            state.get_by_id(f"syn{i}")
+
+    results["lookup"] = timed(lookup) / len(names)
+    results["save one"] = timed(
+        lambda: state.update_properties("folder1", "folder", {"name": "Renamed"})
+    )
+    if backend == "sqlite":
+        # Opening the database without reading every row
+        state.close()
+        results["open"] = timed(lambda: state_class(path).close())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    columns = ["save all", "load", "open", "lookup", "save one"]
+    print(f"{'resources':>10} {'backend':>8} " + " ".join(f"{c:>10}" for c in columns))
+    for size in args.sizes:
+        for backend in BACKENDS:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                results = bench(backend, size, args.lookups, tmpdir)
+            cells = [
+                f"{results[c]:>10.6f}" if c in results else f"{'-':>10}"
+                for c in columns
+            ]
+            print(f"{size:>10} {backend:>8} " + " ".join(cells))
+    print("Times are in seconds; lookup is per name and ID lookup pair.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark the memory held by a loaded state
+
+Usage:
+    python benchmarks/bench_state_memory.py [--sizes 1000 10000 100000]
+
+Compares plain dictionaries indexed by (type, name) tuples and Synapse ID lists with
+the compact `Resource` records and indexes `State` keeps.  Memory is measured with
+tracemalloc in a fresh interpreter once the file is loaded.
+"""
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from synapseformation.state import State
+
+
+def generate_state(n_resources: int) -> dict:
+    """A state with one project, teams, nested folders and ACLs"""
+    resources = [
+        {
+            "type": "project",
+            "name": "project",
+            "id": "syn0",
+            "properties": {"name": "Benchmark"},
+            "hash": f"{0:064x}",
+        }
+    ]
+    for i in range(1, n_resources):
+        if i % 10 == 0:
+            resource = {
+                "type": "team",
+                "id": 3000000 + i,
+                "properties": {"name": f"T{i}"},
+            }
+            name = f"team{i}"
+        elif i % 10 == 1:
+            resource = {
+                "type": "acl",
+                "id": f"syn{i - 2}" if i > 2 else "syn0",
+                "properties": {
+                    "resource": f"folder.folder{i - 2}" if i > 2 else "project.project",
+                    "grants": [
+                        {"principal": f"team.team{i - 1}", "access_type": ["READ"]},
+                        {"principal": "team.admins", "access_type": ["READ", "UPDATE"]},
+                    ],
+                },
+            }
+            name = f"acl{i}"
+        else:
+            parent = f"folder.folder{i - 1}" if i % 10 > 2 else "project.project"
+            resource = {
+                "type": "folder",
+                "id": f"syn{i}",
+                "properties": {"name": f"Folder {i}", "parent": parent},
+            }
+            name = f"folder{i}"
+        resource["name"] = name
+        resource["hash"] = f"{i:064x}"
+        resources.append(resource)
+    return {"version": 1, "resources": resources}
+
+
+def load_indexed_dicts(path: str) -> tuple:
+    """The layout `State` used before `Resource`: dictionaries and tuple-keyed indexes"""
+    resources = json.loads(Path(path).read_text())["resources"]
+    by_name = {}
+    by_id = defaultdict(list)
+    for resource in resources:
+        by_name[(resource["type"], resource["name"])] = resource
+        by_id[resource["id"]].append(resource)
+    return resources, by_name, by_id
+
+
+LOADERS = {
+    "dicts": load_indexed_dicts,
+    "State": State,
+}
+
+
+def measure(loader: str, path: str):
+    """Load a state and print the memory it holds as JSON"""
+    gc.collect()
+    tracemalloc.start()
+    loaded = LOADERS[loader](path)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+    print(json.dumps({"current_mb": current / 2**20, "peak_mb": peak / 2**20}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    print(f"{'resources':>10} {'loader':>8} {'held MB':>9} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            path = Path(tmpdir) / f"state{size}.json"
+            path.write_text(json.dumps(generate_state(size)))
+            for loader in LOADERS:
+                result = subprocess.run(
+                    [sys.executable, __file__, "--measure", loader, str(path)],
+                    capture_output=True,
+                    check=True,
+                    text=True,
+                )
+                stats = json.loads(result.stdout)
+                print(
+                    f"{size:>10} {loader:>8} "
+                    f"{stats['current_mb']:>9.1f} {stats['peak_mb']:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
-"""synapseformation command line client"""
+"""synapseformation command line client
+
+Only click is imported up front.  synapseclient and the modules depending on it take
+most of a second to import, so each command imports what it needs when it runs and
+`--help` and `--version` stay fast.
+"""
 import click
-import synapseclient
 
 from . import __version__
-from .client import apply_config, plan_config, destroy_resources
-from .utils import read_config
+from .defaults import DEFAULT_PARALLELISM, DEFAULT_SQLITE_STATE, DEFAULT_STATE
+
+
+# Shared by every command that sends requests to Synapse
+rate_option = click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum number of Synapse requests started per second. Unlimited by "
+    "default, backing off when Synapse throttles requests",
+)
 
 
 @click.group()
@@ -20,24 +32,127 @@ def cli():
 
 @cli.command()
 @click.argument("template_path", type=click.Path(exists=True))
-def apply(template_path):
-    """Creates Synapse Resources given a yaml or json"""
-    my_agent = "synapseformation/0.0.0"
-    syn = synapseclient.Synapse(user_agent=my_agent)
-    syn.login()
-    config = read_config(template_path=template_path)
-    apply_config(config=config)
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLELISM,
+    show_default=True,
+    help="Maximum number of resources to create at once",
+)
+@click.option(
+    "--target",
+    "targets",
+    multiple=True,
+    metavar="TYPE.NAME",
+    help="Only apply this resource and the resources it depends on. Can be repeated",
+)
+@rate_option
+def apply(template_path, parallelism, targets, rate):
+    """Creates Synapse Resources given a yaml or json, or a plan saved by plan --out"""
+    from .client import apply_config, apply_plan
+    from .compiler import load_template
+    from .plan_file import is_plan_file, load_plan
+    from .session import Session
+
+    saved_plan = load_plan(template_path) if is_plan_file(template_path) else None
+    if saved_plan is not None and targets:
+        raise click.UsageError("--target is given to plan, not to apply a saved plan")
+    with Session(max_connections=parallelism, rate=rate) as session:
+        session.client()
+        if saved_plan is not None:
+            try:
+                apply_plan(saved_plan, parallelism=parallelism, session=session)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            return
+        config = load_template(template_path=template_path)
+        try:
+            apply_config(
+                config=config,
+                parallelism=parallelism,
+                session=session,
+                targets=list(targets) or None,
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
 
 
 @cli.command()
 @click.argument("template_path", type=click.Path(exists=True))
-def plan(template_path):
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLELISM,
+    show_default=True,
+    help="Maximum number of resources to check for drift at once",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Fetch every tracked resource instead of revalidating the local cache",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Only compare the template with the state file, without logging in to "
+    "Synapse or checking it for drift",
+)
+@click.option(
+    "--out",
+    "out_path",
+    type=click.Path(dir_okay=False),
+    help="Save the plan to this file so that apply executes exactly these changes",
+)
+@click.option(
+    "--target",
+    "targets",
+    multiple=True,
+    metavar="TYPE.NAME",
+    help="Only plan this resource and the resources it depends on. Can be repeated",
+)
+@rate_option
+def plan(template_path, parallelism, no_cache, offline, out_path, targets, rate):
     """Show the changes to Synapse resources by comparing the TEMPLATE_FILE.yaml with any existing state file"""
-    my_agent = "synapseformation/0.0.0"
-    syn = synapseclient.Synapse(user_agent=my_agent)
-    syn.login()
-    config = read_config(template_path=template_path)
-    changes = plan_config(config=config, syn=syn)
+    from .compiler import load_template
+
+    if offline and out_path:
+        # apply checks the etags a plan observed, and an offline plan observes none
+        raise click.UsageError("--out cannot be used with --offline")
+    session = None
+    remote_cache = None
+    if not offline:
+        from .cache import RemoteCache
+        from .session import Session
+
+        session = Session(max_connections=parallelism, rate=rate)
+        session.client()
+        remote_cache = None if no_cache else RemoteCache()
+    try:
+        config = load_template(template_path=template_path)
+        if offline:
+            # The planner does not import synapseclient, which takes most of a second
+            from .planner import plan_changes
+
+            changes, _ = plan_changes(config, targets=list(targets) or None)
+        else:
+            from .client import plan_config
+
+            changes = plan_config(
+                config=config,
+                parallelism=parallelism,
+                remote_cache=remote_cache,
+                session=session,
+                targets=list(targets) or None,
+            )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if session is not None:
+            session.close()
+    if out_path:
+        from .plan_file import save_plan
+
+        save_plan(changes, out_path)
     update = 0
     create = 0
     delete = 0
@@ -50,18 +165,148 @@ def plan(template_path):
         else:
             delete += 1
     print(f"There are {create} creations, {update} updates, and {delete} deletions")
+    if out_path:
+        print(f"Saved the plan to {out_path}, run apply {out_path} to execute it")
+    if offline:
+        print("Drift was not checked because --offline was given")
+        return
     for drifts in changes["drift"]:
         print(drifts)
     print(f"There are {len(changes['drift'])} drifts detected")
 
 
 @cli.command()
-def destroy():
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLELISM,
+    show_default=True,
+    help="Maximum number of resources to delete at once",
+)
+@rate_option
+def destroy(parallelism, rate):
     """Deletes all the Synapse resources tracked in the state file"""
-    my_agent = "synapseformation/0.0.0"
-    syn = synapseclient.Synapse(user_agent=my_agent)
-    syn.login()
-    destroy_resources(syn=syn)
+    from .client import destroy_resources
+    from .session import Session
+
+    with Session(max_connections=parallelism, rate=rate) as session:
+        session.client()
+        summary = destroy_resources(parallelism=parallelism, session=session)
+    for name, error in summary["failed"].items():
+        print(f"Failed to destroy {name}: {error}")
+    for name in summary["skipped"]:
+        print(f"Skipped {name}")
+    print(
+        f"{len(summary['destroyed'])} destroyed, {len(summary['failed'])} failed, "
+        f"and {len(summary['skipped'])} skipped"
+    )
+    if summary["failed"]:
+        raise click.exceptions.Exit(1)
+
+
+@cli.command("sync-drift")
+@click.argument("template_path", type=click.Path(exists=True))
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLELISM,
+    show_default=True,
+    help="Maximum number of resources to check for drift at once",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Fetch every tracked resource instead of revalidating the local cache",
+)
+@rate_option
+def sync_drift(template_path, parallelism, no_cache, rate):
+    """Updates the state file with what is on Synapse for resources that drifted, given a yaml or json, or a plan saved by plan --out"""
+    from .cache import RemoteCache
+    from .client import plan_config, sync_drift as sync_state
+    from .compiler import load_template
+    from .plan_file import is_plan_file, load_plan
+    from .session import Session
+
+    with Session(max_connections=parallelism, rate=rate) as session:
+        session.client()
+        if is_plan_file(template_path):
+            changes = load_plan(template_path)
+        else:
+            config = load_template(template_path=template_path)
+            changes = plan_config(
+                config=config,
+                parallelism=parallelism,
+                remote_cache=None if no_cache else RemoteCache(),
+                session=session,
+            )
+        # The plan already read the drifted resources, so they are not fetched again
+        synced = sync_state(changes, session=session)
+    for name in synced:
+        print(f"Synced {name}")
+    print(f"{len(synced)} state entries were updated")
+
+
+@cli.command()
+@click.argument("project_id")
+@click.argument("template_path", type=click.Path(dir_okay=False))
+@click.option(
+    "--state",
+    "state_path",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_STATE,
+    show_default=True,
+    help="New state to record the exported resources in, SQLite if it ends in .db",
+)
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PARALLELISM,
+    show_default=True,
+    help="Maximum number of folders to list at once",
+)
+@rate_option
+def export(project_id, template_path, state_path, parallelism, rate):
+    """Writes a template and state for the folders and sharing settings of PROJECT_ID"""
+    from .client import export as export_project
+    from .session import Session
+
+    with Session(max_connections=parallelism, rate=rate) as session:
+        session.client()
+        counts = export_project(
+            project_id=project_id,
+            template_path=template_path,
+            state_path=state_path,
+            parallelism=parallelism,
+            session=session,
+        )
+    print(
+        f"Exported {counts.get('project', 0)} project, {counts.get('folder', 0)} "
+        f"folders and {counts.get('acl', 0)} ACLs to {template_path}"
+    )
+
+
+@cli.command("migrate-state")
+@click.option(
+    "--source",
+    type=click.Path(exists=True, dir_okay=False),
+    default=DEFAULT_STATE,
+    show_default=True,
+    help="Version 1 JSON state file",
+)
+@click.option(
+    "--destination",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_SQLITE_STATE,
+    show_default=True,
+    help="SQLite state database, used by later commands once it exists",
+)
+def migrate_state(source, destination):
+    """Copies the JSON state file into a SQLite state database"""
+    from .sqlite_state import migrate_json_state
+
+    state = migrate_json_state(source, destination)
+    print(f"Migrated {len(state)} resources to {destination}")
+    state.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+"""On-disk cache of the Synapse resources tracked by synapseformation"""
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from synapseclient import Synapse
+from synapseclient.core.async_utils import wrap_async_to_sync
+
+from .scheduler import RequestScheduler
+from .utils import batches, write_json_atomic
+
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class RemoteCache:
+    """Caches the last seen Synapse representation of tracked resources
+
+    Entries are keyed by Synapse ID and store the resource's name, etag and modifiedOn.
+    Before a plan the cache is revalidated in bulk: entities through their entity
+    headers and teams through the team list, so that only entities that changed since
+    they were cached need to be fetched in full.  The least recently used entries are
+    evicted once the cache holds more than `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path=".synapseformation/cache.json",
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._fresh = set()
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self._entries.update(json.load(f).get("entries", {}))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, resource_id: str) -> dict:
+        """Get the cached representation of a resource
+
+        Args:
+            resource_id: The Synapse ID of the resource
+
+        Returns:
+            The cached entry, or None if the resource is not cached
+        """
+        resource_id = str(resource_id)
+        with self._lock:
+            entry = self._entries.get(resource_id)
+            if entry is not None:
+                self._entries.move_to_end(resource_id)
+            return entry
+
+    def put(self, resource_id: str, entry: dict, fresh: bool = True):
+        """Cache the representation of a resource
+
+        Args:
+            resource_id: The Synapse ID of the resource
+            entry: The "type", "name", "etag" and "modifiedOn" of the resource
+            fresh: Whether the entry was just read from Synapse
+        """
+        resource_id = str(resource_id)
+        with self._lock:
+            self._entries[resource_id] = entry
+            self._entries.move_to_end(resource_id)
+            if fresh:
+                self._fresh.add(resource_id)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._fresh.discard(evicted)
+
+    def is_fresh(self, resource_id: str) -> bool:
+        """Whether the cached entry is known to match Synapse"""
+        return str(resource_id) in self._fresh
+
+    async def revalidate_async(
+        self, syn: Synapse, resources: list, scheduler: RequestScheduler = None
+    ):
+        """Check in bulk which cached entries still match Synapse
+
+        Args:
+            syn: A logged in Synapse client
+            resources: Resources from the state file
+            scheduler: The scheduler Synapse requests are sent through
+        """
+        scheduler = scheduler or RequestScheduler()
+        entity_ids = list(
+            dict.fromkeys(
+                str(r["id"]) for r in resources if r["type"] in ("project", "folder")
+            )
+        )
+        team_ids = list(
+            dict.fromkeys(str(r["id"]) for r in resources if r["type"] == "team")
+        )
+
+        for batch in batches(entity_ids):
+            body = {"references": [{"targetId": entity_id} for entity_id in batch]}
+            headers = await scheduler.run(
+                lambda: syn.rest_post_async("/entity/header", json.dumps(body))
+            )
+            for header in headers.get("results", []):
+                cached = self._entries.get(header["id"])
+                if cached is not None and cached["modifiedOn"] == header.get(
+                    "modifiedOn"
+                ):
+                    self._fresh.add(header["id"])
+
+        # The team list already returns full teams, so cache them directly
+        for batch in batches(team_ids):
+            body = {"list": [int(team_id) for team_id in batch]}
+            teams = await scheduler.run(
+                lambda: syn.rest_post_async("/teamList", json.dumps(body))
+            )
+            for team in teams.get("list") or []:
+                self.put(
+                    team["id"],
+                    {
+                        "type": "team",
+                        "name": team["name"],
+                        "etag": team.get("etag"),
+                        "modifiedOn": team.get("modifiedOn"),
+                    },
+                )
+
+    def revalidate(self, syn: Synapse, resources: list):
+        """Synchronous version of `revalidate_async`"""
+        return wrap_async_to_sync(self.revalidate_async(syn, resources))
+
+    def save(self):
+        """Atomically write the cache file"""
+        with self._lock:
+            data = {"version": 1, "entries": dict(self._entries)}
+        write_json_atomic(self.path, data)
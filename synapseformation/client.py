@@ -1,103 +1,116 @@
 """Synapse Formation client"""
 import json
+import asyncio
+import re
 from pathlib import Path
-import yaml
 from collections import defaultdict, deque
 
 from synapseclient import Synapse
+from synapseclient.api import get_children
+from synapseclient.core.async_utils import wrap_async_to_sync
+from synapseclient.core.exceptions import SynapseHTTPError, SynapseNotFoundError
 from synapseclient.models import Project, Folder, Team
 
-
-class State:
-    """Saves the synapseformation state per configuration file"""
-
-    def __init__(self, path=".synapseformation/state.json"):
-        self.path = Path(path)
-        self.resources = []
-        if self.path.exists():
-            with open(self.path, "r") as f:
-                data = json.load(f)
-                self.resources = data.get("resources", [])
-        else:
-            self.resources = []
-
-    def save(self):
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        data = {"version": 1, "resources": self.resources}
-        with open(self.path, "w") as f:
-            json.dump(data, f, indent=2)
-
-    def get_id(self, logical_name: str, resource_type: str) -> str:
-        """Retrieve the Synapse resource ID for a given logical name and resource type.
-
-        Args:
-            logical_name (str): The logical name of the resource as defined in the configuration.
-            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
-
-        Returns:
-            str: The Synapse ID of the resource if found, otherwise None.
-        """
-        for r in self.resources:
-            if r["name"] == logical_name and r["type"] == resource_type:
-                return r["id"]
-        return None
-
-    def add(
-        self,
-        resource_type: str,
-        logical_name: str,
-        resource_id: str,
-        properties: dict = None,
-    ):
-        """
-        Adds a new resource to the internal resources list and saves the updated list.
-
-        Args:
-            resource_type (str): The type of the resource (e.g., 'database', 'storage').
-            logical_name (str): A unique logical name to identify the resource.
-            resource_id (str): The unique identifier of the resource.
-            properties (dict, optional): Additional properties for the resource. Defaults to an empty dictionary if not provided.
-        """
-        self.resources.append(
-            {
-                "type": resource_type,
-                "name": logical_name,
-                "id": resource_id,
-                "properties": properties or {},
-            }
-        )
-        self.save()
-
-    def update_properties(
-        self, logical_name: str, resource_type: str, properties: dict = None
-    ):
-        """
-        Updates the properties of a resource identified by logical name and resource type.
-
-        Args:
-            logical_name (str): The logical name of the resource as defined in the configuration.
-            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
-            properties (dict, optional): The new properties to set for the resource. Defaults to None.
-        """
-        for r in self.resources:
-            if r["name"] == logical_name and r["type"] == resource_type:
-                r["properties"] = properties
-                break
-        self.save()
-
-    def clear(self) -> str:
-        """Clear the state"""
-        self.resources = []
-        self.save()
-
-
-def apply_acl(acl: dict, state: State) -> str:
+from .cache import RemoteCache
+from .defaults import DEFAULT_PARALLELISM, DEFAULT_STATE
+from .planner import (
+    analyze_config,
+    analyze_resources,
+    build_dependency_graph,
+    clean_subtrees,
+    dependency_closure,
+    diff_properties,
+    get_container,
+    get_dependencies,
+    invert_graph,
+    plan_changes,
+    record_subtree_hashes,
+    subtree_hashes,
+    topological_sort,
+)
+from .scheduler import RequestScheduler
+from .session import Session
+from .state import Resource, State, open_state
+from .utils import (
+    batches,
+    dump_yaml,
+    expand_resources,
+    hash_resource,
+    open_atomic,
+)
+
+__all__ = [
+    "AclCache",
+    "ChildFolders",
+    "apply_acl",
+    "apply_acl_async",
+    "apply_acls",
+    "apply_acls_async",
+    "apply_config",
+    "apply_config_async",
+    "apply_folder",
+    "apply_folder_async",
+    "apply_plan",
+    "apply_plan_async",
+    "apply_project",
+    "apply_project_async",
+    "apply_team",
+    "apply_team_async",
+    "build_destroy_graph",
+    "destroy_resources",
+    "destroy_resources_async",
+    "export",
+    "export_async",
+    "get_resources",
+    "initialize",
+    "plan_config",
+    "plan_config_async",
+    "revoke_acls",
+    "revoke_acls_async",
+    "run_graph_async",
+    "sort_folders",
+    "sync_drift",
+    "sync_drift_async",
+    # The state and the planning code live in modules of their own so that
+    # `plan --offline` does not import synapseclient, and are re-exported from here
+    "Resource",
+    "State",
+    "open_state",
+    "analyze_resources",
+    "build_dependency_graph",
+    "dependency_closure",
+    "diff_properties",
+    "get_dependencies",
+    "hash_resource",
+    "subtree_hashes",
+    "topological_sort",
+]
+
+
+def _principal_id(principal, state: State):
+    """Resolve a `team.name` reference, or return a principal ID given directly"""
+    if isinstance(principal, str) and "." in principal:
+        # e.g. "team.data_scientists"
+        principal_type, logical_name = principal.split(".")
+        return state.get_id(logical_name, principal_type)
+    return principal
+
+
+async def apply_acl_async(
+    acl: dict,
+    state: State,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> str:
     """
     Applies an access control list (ACL) to a specified resource and updates the state accordingly.
 
     Args:
         acl (dict): A dictionary representing the ACL to apply. Must contain a "name" and "properties" with "resource" and "grants".
         state (State): The current state object used to resolve resource and principal IDs, and to track applied ACLs.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
 
     Raises:
         KeyError: If required keys are missing in the ACL or state.
@@ -109,113 +122,655 @@ def apply_acl(acl: dict, state: State) -> str:
     acl_applied = state.get_id(acl["name"], "acl")
     if acl_applied:
         return acl_applied
+    scheduler = scheduler or RequestScheduler()
     properties = acl["properties"]
 
     # Resolve resource
     res_ref = properties["resource"].split(".")  # e.g. "folder.raw_data"
     res_type, logical_name = res_ref[0], res_ref[1]
     res_id = state.get_id(logical_name, res_type)
+    model = Project if res_type == "project" else Folder
+    res = await scheduler.run(
+        lambda: model(id=res_id).get_async(synapse_client=synapse_client)
+    )
     for grant in properties["grants"]:
-        principal_ref = grant["principal"].split(".")  # e.g. "team.data_scientists"
-        principal_id = state.get_id(principal_ref[1], principal_ref[0])
+        principal_id = _principal_id(grant["principal"], state)
         access_type = grant["access_type"]
-        if res_type == "project":
-            res = Project(id=res_id).get()
-        elif res_type == "folder":
-            res = Folder(id=res_id).get()
-        res.set_permissions(principal_id=principal_id, access_type=access_type)
+        await scheduler.run(
+            lambda: res.set_permissions_async(
+                principal_id=principal_id,
+                access_type=access_type,
+                synapse_client=synapse_client,
+            )
+        )
         grant["principal"] = principal_id
     state.add("acl", acl["name"], res_id, properties)
     return res_id
 
 
-def apply_project(logical_name: str, props: dict, state: State) -> Project:
+def apply_acl(acl: dict, state: State) -> str:
+    """Synchronous version of `apply_acl_async`"""
+    return wrap_async_to_sync(apply_acl_async(acl=acl, state=state))
+
+
+async def _get_entity_acl(
+    syn: Synapse, entity_id: str, scheduler: RequestScheduler
+) -> tuple:
+    """
+    Get the access control list an entity currently uses.
+
+    Args:
+        syn (Synapse): A logged in Synapse client.
+        entity_id (str): The Synapse ID of the entity.
+        scheduler (RequestScheduler): The scheduler Synapse requests are sent through.
+
+    Returns:
+        tuple: The ACL and whether the entity has local sharing settings (is its own benefactor).
+    """
+    benefactor = await scheduler.run(
+        lambda: syn.rest_get_async(f"/entity/{entity_id}/benefactor")
+    )
+    acl = await scheduler.run(
+        lambda: syn.rest_get_async(f"/entity/{benefactor['id']}/acl")
+    )
+    return acl, benefactor["id"] == entity_id
+
+
+async def _store_entity_acl(
+    syn: Synapse,
+    entity_id: str,
+    acl: dict,
+    is_local: bool,
+    resource_access: dict,
+    scheduler: RequestScheduler,
+) -> dict:
+    """
+    Write an entity's access control list in a single request.
+
+    Args:
+        syn (Synapse): A logged in Synapse client.
+        entity_id (str): The Synapse ID of the entity.
+        acl (dict): The ACL returned by `_get_entity_acl`.
+        is_local (bool): Whether the ACL already belongs to the entity. If not, a local
+            ACL is created from the inherited one.
+        resource_access (dict): The desired access types keyed by principal ID. Principals
+            with no access types are removed.
+        scheduler (RequestScheduler): The scheduler Synapse requests are sent through.
+
+    Returns:
+        dict: The stored ACL.
+    """
+    entries = [
+        {"principalId": int(principal_id), "accessType": sorted(access_type)}
+        for principal_id, access_type in resource_access.items()
+        if access_type
+    ]
+    if is_local:
+        return await scheduler.run(
+            lambda: syn.rest_put_async(
+                f"/entity/{entity_id}/acl",
+                json.dumps({**acl, "resourceAccess": entries}),
+            )
+        )
+
+    async def find_local_acl():
+        # An earlier attempt may have created the ACL before its response was lost
+        current, created = await _get_entity_acl(syn, entity_id, scheduler)
+        return current if created else None
+
+    return await scheduler.run(
+        lambda: syn.rest_post_async(
+            f"/entity/{entity_id}/acl",
+            json.dumps({"id": entity_id, "resourceAccess": entries}),
+        ),
+        idempotent=False,
+        recover=find_local_acl,
+    )
+
+
+async def apply_acls_async(
+    acls: list,
+    state: State,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> dict:
+    """
+    Applies access control lists (ACLs) with a single ACL write per entity.
+
+    The grants of every ACL resource targeting the same entity are merged into one
+    desired ACL.  A principal granted access by more than one ACL resource receives the
+    union of the access types.  Principals that are not granted by any of the ACL
+    resources keep their existing access.
+
+    ACLs that are already tracked are only written again if their grants changed since
+    they were last applied.  Principals dropped from their grants then lose their
+    access, unless another ACL resource on the same entity still grants it.  An ACL
+    moved to another resource first has its grants revoked from the entity it was
+    applied to.
+
+    Args:
+        acls (list): ACLs to apply, each with a "name" and "properties" with "resource" and "grants".
+        state (State): The current state object used to resolve resource and principal IDs, and to track applied ACLs.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+
+    Returns:
+        dict: A dictionary mapping each ACL logical name to the ID of the resource it was applied to.
+    """
+    syn = Synapse.get_client(synapse_client=synapse_client)
+    scheduler = scheduler or RequestScheduler()
+    applied = {}
+    pending = defaultdict(list)
+    dropped = defaultdict(set)
+    moved = []
+    for acl in acls:
+        acl_applied = state.get_id(acl["name"], "acl")
+        entry = state.get(acl["name"], "acl")
+        fields = _changed_fields(entry, "acl", acl["properties"])
+        if acl_applied and not fields:
+            applied[acl["name"]] = acl_applied
+            continue
+        res_type, logical_name = acl["properties"]["resource"].split(".")
+        res_id = state.get_id(logical_name, res_type)
+        pending[res_id].append(acl)
+        if acl_applied == res_id:
+            dropped[res_id].update(
+                str(grant["principal"]) for grant in entry["properties"]["grants"]
+            )
+        elif acl_applied:
+            moved.append(entry)
+
+    if moved:
+        # Grants of the old entity's other ACL resources are kept
+        moved_names = {entry["name"] for entry in moved}
+        revoked = []
+        for entry in moved:
+            kept = {
+                str(grant["principal"])
+                for other in state.get_by_id(entry["id"])
+                if other["type"] == "acl" and other["name"] not in moved_names
+                for grant in other["properties"]["grants"]
+            }
+            grants = [
+                grant
+                for grant in entry["properties"]["grants"]
+                if str(grant["principal"]) not in kept
+            ]
+            revoked.append(
+                {
+                    "id": entry["id"],
+                    "properties": {**entry["properties"], "grants": grants},
+                }
+            )
+        await revoke_acls_async(
+            revoked, synapse_client=synapse_client, scheduler=scheduler
+        )
+
+    for res_id, entity_acls in pending.items():
+        resolved = []
+        desired = defaultdict(set)
+        if res_id in dropped:
+            # Grants of the entity's other ACL resources are kept
+            names = {acl["name"] for acl in entity_acls}
+            for entry in state.get_by_id(res_id):
+                if entry["type"] == "acl" and entry["name"] not in names:
+                    for grant in entry["properties"]["grants"]:
+                        desired[str(grant["principal"])].update(grant["access_type"])
+        for acl in entity_acls:
+            grants = []
+            for grant in acl["properties"]["grants"]:
+                principal_id = _principal_id(grant["principal"], state)
+                desired[str(principal_id)].update(grant["access_type"])
+                grants.append({**grant, "principal": principal_id})
+            resolved.append(
+                (
+                    acl["name"],
+                    {**acl["properties"], "grants": grants},
+                    hash_resource("acl", acl["properties"]),
+                )
+            )
+
+        current, is_local = await _get_entity_acl(syn, res_id, scheduler)
+        resource_access = {
+            str(access["principalId"]): set(access["accessType"])
+            for access in current.get("resourceAccess", [])
+        }
+        for principal_id in dropped.get(res_id, ()):
+            resource_access.pop(principal_id, None)
+        resource_access.update(desired)
+        await _store_entity_acl(
+            syn, res_id, current, is_local, resource_access, scheduler
+        )
+
+        for name, properties, content_hash in resolved:
+            acl_applied = state.get_id(name, "acl")
+            if acl_applied == res_id:
+                state.update_properties(name, "acl", properties, content_hash)
+            else:
+                if acl_applied:
+                    # The ACL moved to another resource, so its entry gets the new ID
+                    state.remove([("acl", name)])
+                state.add("acl", name, res_id, properties, content_hash=content_hash)
+            applied[name] = res_id
+    return applied
+
+
+def apply_acls(acls: list, state: State, syn: Synapse = None) -> dict:
+    """Synchronous version of `apply_acls_async`"""
+    return wrap_async_to_sync(
+        apply_acls_async(acls=acls, state=state, synapse_client=syn)
+    )
+
+
+async def revoke_acls_async(
+    acls: list,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> None:
+    """
+    Revokes the grants of ACL state resources with a single ACL write per entity.
+
+    Entities that no longer exist have nothing left to revoke.
+
+    Args:
+        acls (list): ACL resources from the state file.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+    """
+    syn = Synapse.get_client(synapse_client=synapse_client)
+    scheduler = scheduler or RequestScheduler()
+    principals = defaultdict(set)
+    for acl in acls:
+        for grant in acl["properties"]["grants"]:
+            principals[acl["id"]].add(str(grant["principal"]))
+
+    for entity_id, revoked in principals.items():
+        try:
+            current, is_local = await _get_entity_acl(syn, entity_id, scheduler)
+        except SynapseNotFoundError:
+            # The entity was deleted outside of synapseformation, taking its ACL along
+            continue
+        except SynapseHTTPError as e:
+            if getattr(e.response, "status_code", None) != 404:
+                raise
+            continue
+        if not is_local:
+            # The entity no longer has its own ACL, so there is nothing to revoke
+            continue
+        resource_access = {
+            str(access["principalId"]): set(access["accessType"])
+            for access in current.get("resourceAccess", [])
+        }
+        if not revoked.intersection(resource_access):
+            continue
+        for principal_id in revoked:
+            resource_access.pop(principal_id, None)
+        await _store_entity_acl(
+            syn, entity_id, current, is_local, resource_access, scheduler
+        )
+
+
+def revoke_acls(acls: list, syn: Synapse) -> None:
+    """Synchronous version of `revoke_acls_async`"""
+    return wrap_async_to_sync(revoke_acls_async(acls=acls, synapse_client=syn))
+
+
+# The Synapse fields that template properties are written to by an update.  Other
+# properties only live in the template and the state.
+ENTITY_FIELDS = {"name": "name", "description": "description", "parent": "parentId"}
+TEAM_FIELDS = {"name": "name", "description": "description"}
+
+
+def _changed_fields(state_resource: dict, resource_type: str, props: dict) -> dict:
+    """
+    The fields of a tracked resource that differ from the configuration.
+
+    State entries without recorded properties are treated as unchanged since what was
+    applied is unknown.
+    """
+    if not state_resource or not state_resource.get("properties"):
+        return {}
+    if state_resource.get("hash") == hash_resource(resource_type, props):
+        return {}
+    return diff_properties(state_resource["properties"], props)
+
+
+def _rest_fields(fields: dict, field_names: dict, state: State) -> dict:
+    """Translate changed properties into Synapse fields, resolving `type.name` parents"""
+    rest = {}
+    for key, value in fields.items():
+        if key not in field_names:
+            continue
+        if key == "parent" and isinstance(value, str) and "." in value:
+            parent_type, parent_name = value.split(".", 1)
+            value = state.get_id(parent_name, parent_type)
+        rest[field_names[key]] = value
+    return rest
+
+
+async def _update_async(
+    syn: Synapse,
+    uri: str,
+    fields: dict,
+    scheduler: RequestScheduler,
+    put_uri: str = None,
+) -> dict:
+    """
+    Write changed fields to a Synapse resource with an etag-conditional update.
+
+    Synapse only accepts whole resources, so the resource is read and written back
+    with just the changed fields replaced.  The etag read with it makes Synapse reject
+    the write if the resource changed in between.
+
+    Args:
+        syn (Synapse): A logged in Synapse client.
+        uri (str): The REST URI of the resource.
+        fields (dict): The new value of each changed Synapse field.
+        scheduler (RequestScheduler): The scheduler Synapse requests are sent through.
+        put_uri (str, optional): The URI updates are sent to, if it is not `uri`.
+
+    Returns:
+        dict: The updated resource.
+    """
+    current = await scheduler.run(lambda: syn.rest_get_async(uri))
+    if all(current.get(key) == value for key, value in fields.items()):
+        return current
+    body = json.dumps({**current, **fields})
+
+    async def find_updated():
+        # An earlier attempt may have been applied before its response was lost
+        latest = await syn.rest_get_async(uri)
+        if all(latest.get(key) == value for key, value in fields.items()):
+            return latest
+        return None
+
+    return await scheduler.run(
+        lambda: syn.rest_put_async(put_uri or uri, body),
+        idempotent=False,
+        recover=find_updated,
+    )
+
+
+async def _find_existing(model, synapse_client: Synapse = None):
+    """Get a resource by name, returning None if it does not exist"""
+    try:
+        return await model.get_async(synapse_client=synapse_client)
+    except SynapseNotFoundError:
+        return None
+    except SynapseHTTPError as e:
+        if getattr(e.response, "status_code", None) == 404:
+            return None
+        raise
+
+
+async def apply_project_async(
+    logical_name: str,
+    props: dict,
+    state: State,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> Project:
     """
     Ensures that a project with the given logical name and properties exists in Synapse.
 
-    If the project does not exist, it is created with the given properties. If it does exist, the existing project is returned.
+    If the project does not exist, it is created with the given properties. If it does exist, the existing project is returned,
+    after writing the properties that changed since they were last applied.
 
     Args:
         logical_name (str): The logical name of the project.
         props (dict): The properties of the project.
         state (State): The state object to store the created project.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
 
     Returns:
         Project: The created or existing Synapse project.
     """
+    scheduler = scheduler or RequestScheduler()
     project_id = state.get_id(logical_name, "project")
-    if project_id:
-        return Project(id=project_id).get()
+    fields = _changed_fields(state.get(logical_name, "project"), "project", props)
+    if project_id and fields:
+        syn = Synapse.get_client(synapse_client=synapse_client)
+        await _update_async(
+            syn,
+            f"/entity/{project_id}",
+            _rest_fields(fields, ENTITY_FIELDS, state),
+            scheduler,
+        )
+        state.update_properties(logical_name, "project", props)
+        return Project(id=project_id, name=props["name"])
+    elif project_id:
+        return await scheduler.run(
+            lambda: Project(id=project_id).get_async(synapse_client=synapse_client)
+        )
     else:
-        project = Project(name=props["name"]).store()
+        project = await scheduler.run(
+            lambda: Project(name=props["name"]).store_async(
+                synapse_client=synapse_client
+            ),
+            idempotent=False,
+            recover=lambda: _find_existing(Project(name=props["name"]), synapse_client),
+        )
         state.add("project", logical_name, project.id, props)
         return project
 
 
-def apply_folder(logical_name: str, props: dict, state: State) -> Folder:
+def apply_project(logical_name: str, props: dict, state: State) -> Project:
+    """Synchronous version of `apply_project_async`"""
+    return wrap_async_to_sync(
+        apply_project_async(logical_name=logical_name, props=props, state=state)
+    )
+
+
+class ChildFolders:
+    """
+    Lists the folders inside each parent at most once.
+
+    Concurrent lookups under the same parent wait on the first listing instead of
+    issuing their own.  Parents created during the run are registered as empty so
+    they are never listed.
+    """
+
+    def __init__(
+        self, synapse_client: Synapse = None, scheduler: RequestScheduler = None
+    ):
+        self.synapse_client = synapse_client
+        self.scheduler = scheduler or RequestScheduler()
+        self._listings = {}
+
+    async def get(self, parent_id: str) -> dict:
+        """
+        Get the folders inside a container.
+
+        Args:
+            parent_id (str): The Synapse ID of the project or folder.
+
+        Returns:
+            dict: A dictionary mapping each folder name to its Synapse ID.
+        """
+        if parent_id not in self._listings:
+            self._listings[parent_id] = asyncio.ensure_future(
+                self.scheduler.run(lambda: self._list(parent_id))
+            )
+        return await self._listings[parent_id]
+
+    async def _list(self, parent_id: str) -> dict:
+        return {
+            child["name"]: child["id"]
+            async for child in get_children(
+                parent=parent_id,
+                include_types=["folder"],
+                synapse_client=self.synapse_client,
+            )
+        }
+
+    def created(self, folder_id: str):
+        """Register a folder created during this run, which has no children yet"""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result({})
+        self._listings[folder_id] = future
+
+
+async def apply_folder_async(
+    logical_name: str,
+    props: dict,
+    state: State,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+    children: ChildFolders = None,
+) -> Folder:
     """
     Ensures that a folder with the given logical name and properties exists in Synapse under the given project.
 
-    If the folder does not exist, it is created with the given properties.  If it does exist, the existing folder is returned.
+    If the folder does not exist, it is created with the given properties.  If it does exist, the existing folder is returned,
+    after writing the properties that changed since they were last applied, such as
+    moving it to a new parent.
 
     Args:
         logical_name: The logical name of the folder
         props: The properties of the folder
         state: The state object to store the created folder
+        synapse_client: A logged in Synapse client. Defaults to the cached client.
+        scheduler: The scheduler Synapse requests are sent through.
+        children: When given, a folder missing from the state that already exists
+            under its parent with the same name is adopted instead of created.
 
     Returns:
         The created or existing Synapse folder
     """
+    scheduler = scheduler or RequestScheduler()
     folder_id = state.get_id(logical_name, "folder")
-    if folder_id:
-        return Folder(id=folder_id).get()
+    fields = _changed_fields(state.get(logical_name, "folder"), "folder", props)
+    if folder_id and fields:
+        syn = Synapse.get_client(synapse_client=synapse_client)
+        folder = await _update_async(
+            syn,
+            f"/entity/{folder_id}",
+            _rest_fields(fields, ENTITY_FIELDS, state),
+            scheduler,
+        )
+        state.update_properties(logical_name, "folder", props)
+        return Folder(id=folder_id, name=props["name"], parent_id=folder["parentId"])
+    elif folder_id:
+        return await scheduler.run(
+            lambda: Folder(id=folder_id).get_async(synapse_client=synapse_client)
+        )
     else:
         parent_id = state.get_id(
             props["parent"].split(".")[1], props["parent"].split(".")[0]
         )
-        folder = Folder(name=props["name"], parent_id=parent_id).store()
+        if children is not None:
+            existing_id = (await children.get(parent_id)).get(props["name"])
+            if existing_id:
+                state.add("folder", logical_name, existing_id, props)
+                return Folder(id=existing_id, name=props["name"], parent_id=parent_id)
+        folder = await scheduler.run(
+            lambda: Folder(name=props["name"], parent_id=parent_id).store_async(
+                synapse_client=synapse_client
+            ),
+            idempotent=False,
+            recover=lambda: _find_existing(
+                Folder(name=props["name"], parent_id=parent_id), synapse_client
+            ),
+        )
+        if children is not None:
+            children.created(folder.id)
         state.add("folder", logical_name, folder.id, props)
         return folder
 
 
-def apply_team(logical_name: str, props: dict, state: State) -> Team:
+def apply_folder(logical_name: str, props: dict, state: State) -> Folder:
+    """Synchronous version of `apply_folder_async`"""
+    return wrap_async_to_sync(
+        apply_folder_async(logical_name=logical_name, props=props, state=state)
+    )
+
+
+async def apply_team_async(
+    logical_name: str,
+    props: dict,
+    state: State,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> Team:
     """
     Creates or retrieves a Team object based on the provided logical name.
 
-    If a team with the given logical name exists in the state, retrieves and returns the corresponding Team object.
+    If a team with the given logical name exists in the state, retrieves and returns the corresponding Team object,
+    after writing the properties that changed since they were last applied.
     Otherwise, creates a new Team using the provided properties, adds it to the state, and returns the new Team object.
 
     Args:
         logical_name (str): The logical identifier for the team.
         props (dict): Properties used to create the team (must include 'name').
         state (State): The state object used to track created teams and their IDs.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
 
     Returns:
         Team: The retrieved or newly created Team object.
     """
+    scheduler = scheduler or RequestScheduler()
     team_id = state.get_id(logical_name, "team")
-    if team_id:
-        return Team(id=team_id).get()
+    fields = _changed_fields(state.get(logical_name, "team"), "team", props)
+    if team_id and fields:
+        syn = Synapse.get_client(synapse_client=synapse_client)
+        await _update_async(
+            syn,
+            f"/team/{team_id}",
+            _rest_fields(fields, TEAM_FIELDS, state),
+            scheduler,
+            put_uri="/team",
+        )
+        state.update_properties(logical_name, "team", props)
+        return Team(id=team_id, name=props["name"])
+    elif team_id:
+        return await scheduler.run(
+            lambda: Team(id=team_id).get_async(synapse_client=synapse_client)
+        )
     else:
-        team = Team(name=props["name"]).create()
+        team = await scheduler.run(
+            lambda: Team(name=props["name"]).create_async(
+                synapse_client=synapse_client
+            ),
+            idempotent=False,
+            recover=lambda: _find_existing(Team(name=props["name"]), synapse_client),
+        )
         state.add("team", logical_name, team.id, props)
         return team
 
 
+def apply_team(logical_name: str, props: dict, state: State) -> Team:
+    """Synchronous version of `apply_team_async`"""
+    return wrap_async_to_sync(
+        apply_team_async(logical_name=logical_name, props=props, state=state)
+    )
+
+
 def sort_folders(folders: list[dict]) -> list:
     """
     Perform a topological sort of folders based on parent references.
     Returns a list of folder logical names in the correct creation order.
+
+    `folders` can be any iterable, such as a generator; it is only read once.  This is
+    library API for the folders grouped by `get_resources`; the commands order every
+    resource with `topological_sort` instead.
     """
     # Build adjacency + in-degree
     graph = defaultdict(list)
-    in_degree = {folder["name"]: 0 for folder in folders}
+    in_degree = {}
 
     for folder in folders:
         name = folder["name"]
         properties = folder["properties"]
         parent_ref = properties["parent"]
         parent_type, parent_name = parent_ref.split(".")
+        in_degree.setdefault(name, 0)
         if parent_type == "folder":
             graph[parent_name].append(name)
             in_degree[name] += 1
@@ -232,24 +787,102 @@ def sort_folders(folders: list[dict]) -> list:
             if in_degree[child] == 0:
                 queue.append(child)
 
-    if len(order) != len(folders):
+    if len(order) != len(in_degree):
         raise ValueError("Cycle detected in folder hierarchy!")
 
     return order
 
 
-def get_resources(resource_config: dict) -> dict:
+async def run_graph_async(
+    graph: dict,
+    func,
+    parallelism: int = DEFAULT_PARALLELISM,
+    fail_fast: bool = True,
+) -> dict:
+    """
+    Awaits `func` on every node of a dependency graph with bounded concurrency.
+
+    A node is only started once all of its dependencies have completed, so independent
+    nodes run concurrently while dependencies are still respected.  If a node fails, no
+    new nodes are started and the first exception is raised once the running nodes finish.
+
+    Args:
+        graph (dict): A dictionary mapping every node to the set of nodes it depends on.
+        func (callable): A coroutine function called with each node.
+        parallelism (int): The maximum number of nodes to run at once.
+        fail_fast (bool): If False, a failure only stops the nodes that depend on the
+            failed node, and the failures are returned instead of raised.
+
+    Raises:
+        ValueError: If the graph contains a cycle.
+
+    Returns:
+        dict: The exception raised by each failed node. Nodes that were skipped because
+            one of their dependencies failed are not included.
+    """
+    # Fail before doing any work rather than partway through
+    order = topological_sort(graph)
+    dependents, in_degree = invert_graph(graph)
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def run_node(node):
+        async with semaphore:
+            await func(node)
+
+    tasks = {}
+
+    def start(node):
+        tasks[asyncio.ensure_future(run_node(node))] = node
+
+    for node in order:
+        if in_degree[node] == 0:
+            start(node)
+    errors = {}
+    running = set(tasks)
+    while running:
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            node = tasks.pop(task)
+            if task.exception() is not None:
+                errors[node] = task.exception()
+                continue
+            if fail_fast and errors:
+                continue
+            for child in dependents[node]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    start(child)
+        running = set(tasks)
+    if fail_fast and errors:
+        raise next(iter(errors.values()))
+    return errors
+
+
+def get_resources(
+    resource_config: dict, modules: dict = None, base_dir: str = "."
+) -> dict:
     """
     Given a configuration dictionary, returns a dictionary of resources organized by resource type and logical name.
 
+    Modules, `for_each` loops and includes are expanded lazily with
+    `utils.expand_resources`, so that library callers can group the resources of a
+    template without holding its expanded form.  The commands instead expand the
+    whole template with `compiler.load_template`, since validating it and building
+    its dependency graph need every resource.
+
     Args:
-        config (dict): A configuration dictionary
+        resource_config (dict): The resources of a configuration, or an iterable of
+            (logical name, resource) pairs such as `utils.iter_resources`.
+        modules (dict, optional): The "modules" mapping of the configuration.
+        base_dir (str, optional): The directory that includes are relative to.
 
     Returns:
         dict: A dictionary of resources organized by resource type and logical name
     """
+    if isinstance(resource_config, dict):
+        resource_config = expand_resources(resource_config, modules, base_dir)
     resources = defaultdict(list)
-    for name, res_dict in resource_config.items():
+    for name, res_dict in resource_config:
         resources[res_dict["type"]].append(
             {"name": name, "properties": res_dict["properties"]}
         )
@@ -261,9 +894,249 @@ def initialize():
     pass
 
 
-def plan_config(config: dict, syn: Synapse):
+class AclCache:
+    """
+    Fetches the access control list of entities at most once.
+
+    Every entity's ACL is read from its benefactor, so entities sharing a benefactor
+    also share a single fetch.  Concurrent requests for the same entity wait on the
+    first fetch instead of issuing their own.  The etag of every ACL fetched is kept
+    in `etags`, keyed by benefactor ID.
+    """
+
+    def __init__(self, syn: Synapse, scheduler: RequestScheduler = None):
+        self.syn = syn
+        self.scheduler = scheduler or RequestScheduler()
+        self.etags = {}
+        self._benefactors = {}
+        self._acls = {}
+
+    async def _fetch_once(self, cache: dict, key: str, fetch):
+        if key not in cache:
+            cache[key] = asyncio.ensure_future(fetch(key))
+        return await cache[key]
+
+    async def get(self, entity_id: str) -> dict:
+        """
+        Get the access control list that applies to an entity.
+
+        Args:
+            entity_id (str): The Synapse ID of the entity.
+
+        Returns:
+            dict: A dictionary mapping each principal ID (as a string) to its set of access types.
+        """
+        benefactor_id = await self._fetch_once(
+            self._benefactors, entity_id, self._fetch_benefactor
+        )
+        return await self._fetch_once(self._acls, benefactor_id, self._fetch_acl)
+
+    async def etag(self, entity_id: str) -> str:
+        """
+        Get the etag of the access control list that applies to an entity.
+
+        Args:
+            entity_id (str): The Synapse ID of the entity.
+
+        Returns:
+            str: The etag of the ACL of the entity's benefactor.
+        """
+        await self.get(entity_id)
+        return self.etags[await self._benefactors[entity_id]]
+
+    async def _fetch_benefactor(self, entity_id: str) -> str:
+        benefactor = await self.scheduler.run(
+            lambda: self.syn.rest_get_async(f"/entity/{entity_id}/benefactor")
+        )
+        return benefactor["id"]
+
+    async def _fetch_acl(self, benefactor_id: str) -> dict:
+        acl = await self.scheduler.run(
+            lambda: self.syn.rest_get_async(f"/entity/{benefactor_id}/acl")
+        )
+        self.etags[benefactor_id] = acl.get("etag")
+        return {
+            str(access["principalId"]): set(access["accessType"])
+            for access in acl.get("resourceAccess", [])
+        }
+
+
+def _etag_uri(state_resource: dict) -> str:
+    """
+    The REST URI whose etag a plan records for a resource tracked in the state file.
+
+    An ACL resource maps to the ACL that applies to its entity, which is read from the
+    entity's benefactor.
+    """
+    if state_resource["type"] == "team":
+        return f"/team/{state_resource['id']}"
+    elif state_resource["type"] == "acl":
+        return f"/entity/{state_resource['id']}/acl"
+    return f"/entity/{state_resource['id']}"
+
+
+async def _get_remote_name(
+    state_resource: dict,
+    syn: Synapse,
+    remote_cache: RemoteCache = None,
+    scheduler: RequestScheduler = None,
+    etags: dict = None,
+) -> str:
+    """
+    Get the name a team, project or folder currently has on Synapse.
+
+    Args:
+        state_resource (dict): The resource from the state file.
+        syn (Synapse): A logged in Synapse client.
+        remote_cache (RemoteCache, optional): If the cached entry for the resource was
+            revalidated it is used instead of fetching the resource.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+        etags (dict, optional): Records the etag of the resource under its `_etag_uri`.
+
+    Returns:
+        str: The name of the resource on Synapse.
+    """
+    resource_id = state_resource["id"]
+    if etags is None:
+        etags = {}
+    if remote_cache is not None and remote_cache.is_fresh(resource_id):
+        cached = remote_cache.get(resource_id)
+        etags[_etag_uri(state_resource)] = cached.get("etag")
+        return cached["name"]
+    scheduler = scheduler or RequestScheduler()
+    if state_resource["type"] == "team":
+        model = Team
+    elif state_resource["type"] == "project":
+        model = Project
+    else:
+        model = Folder
+    synapse_resource = await scheduler.run(
+        lambda: model(id=resource_id).get_async(synapse_client=syn)
+    )
+    etags[_etag_uri(state_resource)] = synapse_resource.etag
+    if remote_cache is not None:
+        remote_cache.put(
+            resource_id,
+            {
+                "type": state_resource["type"],
+                "name": synapse_resource.name,
+                "etag": synapse_resource.etag,
+                "modifiedOn": synapse_resource.modified_on,
+            },
+        )
+    return synapse_resource.name
+
+
+async def _detect_drift(
+    state_resource: dict,
+    acl_cache: AclCache,
+    remote_cache: RemoteCache = None,
+    etags: dict = None,
+) -> dict:
+    """
+    Compares a resource tracked in the state file with what is on Synapse.
+
+    ACL grants are compared with the principal's entry in the entity's access
+    control list.
+
+    Args:
+        state_resource (dict): The resource from the state file.
+        acl_cache (AclCache): The ACLs fetched so far during this plan.
+        remote_cache (RemoteCache, optional): The revalidated on-disk cache of Synapse resources.
+        etags (dict, optional): Records the etag that was compared under its `_etag_uri`.
+
+    Returns:
+        dict: The drift detected for the resource, or None if it has not drifted.
+    """
+    if state_resource["type"] == "acl":
+        acl = await acl_cache.get(state_resource["id"])
+        if etags is not None:
+            etags[_etag_uri(state_resource)] = await acl_cache.etag(
+                state_resource["id"]
+            )
+        acls_drifted = []
+        for grants in state_resource["properties"]["grants"]:
+            access_type = acl.get(str(grants["principal"]), set())
+            if access_type != set(grants["access_type"]):
+                acls_drifted.append(
+                    {
+                        "principal": grants["principal"],
+                        "access_type": sorted(access_type),
+                    }
+                )
+        if acls_drifted:
+            return {
+                "type": state_resource["type"],
+                "name": state_resource["name"],
+                "synapse_properties": acls_drifted,
+                "properties": state_resource["properties"],
+            }
+        return None
+    elif state_resource["type"] not in ("team", "project", "folder"):
+        return None
+    name = await _get_remote_name(
+        state_resource, acl_cache.syn, remote_cache, acl_cache.scheduler, etags
+    )
+    if name != state_resource["properties"]["name"]:
+        return {
+            "type": state_resource["type"],
+            "name": state_resource["name"],
+            "synapse_properties": {"name": name},
+            "properties": state_resource["properties"],
+        }
+    return None
+
+
+def _plan_etags(changes: list, state: State, observed: dict) -> dict:
+    """
+    The observed etags of the tracked resources a plan changes or depends on.
+
+    An ACL change also depends on the ACL currently applying to its entity.
+    """
+    etags = {}
+    for change in changes:
+        refs = [f"{change['type']}.{change['name']}", *get_dependencies(change)]
+        for ref in refs:
+            ref_type, ref_name = ref.split(".", 1)
+            state_resource = state.get(ref_name, ref_type)
+            if state_resource is None:
+                continue
+            uris = [_etag_uri(state_resource)]
+            if change["type"] == "acl" and ref_type in ("project", "folder"):
+                uris.append(_etag_uri({"type": "acl", "id": state_resource["id"]}))
+            for uri in uris:
+                if uri in observed:
+                    etags[uri] = observed[uri]
+    return etags
+
+
+async def plan_config_async(
+    config: dict,
+    parallelism: int = DEFAULT_PARALLELISM,
+    remote_cache: RemoteCache = None,
+    *,
+    remote: bool = True,
+    targets: list = None,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+):
     """Reads the configuration file and compares it to the state file to determine what changes need to be made to reconcile any drift.
 
+    Args:
+        config (dict): The configuration
+        parallelism (int): The maximum number of resources to check for drift at once.
+        remote_cache (RemoteCache, optional): An on-disk cache of Synapse resources. When given,
+            it is revalidated in bulk and only resources that changed since they were cached
+            are fetched. The cache is saved once the plan completes.
+        remote (bool): Whether to check the tracked resources for drift in Synapse. When False
+            no Synapse client is needed, no requests are sent and the drift list is empty.
+        targets (list, optional): `type.name` references of the resources to plan. Only they and
+            their `dependency_closure` are compared and checked for drift, and no deletions are
+            planned. Defaults to every resource.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+            Defaults to one allowing `parallelism` requests in flight.
+
     Returns:
         dict: A dictionary containing the changes that need to be made to reconcile any drift.
             The keys are the resource types and the values are lists of dictionaries containing the changes for each resource.
@@ -271,167 +1144,832 @@ def plan_config(config: dict, syn: Synapse):
                 - logical_name: The logical name of the resource.
                 - action: The action to take for the resource (create, update, delete).
                 - properties: The properties for the resource.
+                - fields: For updates, the properties that changed since they were applied.
+            What `apply_plan` needs to execute the changes without planning again is
+            also returned: the dependency "graph" between the created and updated
+            resources, the "subtree_hashes" to record for their projects and folders
+            once they are applied, the "subtrees" they are checked against the state
+            with, and the "etags" observed on Synapse for the resources the changes
+            touch.
     """
     # Read the state file
-    state = State()
-
-    # Get the resources from the state file
-    state_resources = state.resources
-
-    # Create a dictionary to store the changes that need to be made to reconcile any drift
-    changes = []
-
-    # Loop through the configuration file and compare it to the state file to determine what changes need to be made
-    for logical_name, config_resource in config["resources"].items():
-        # changes[config_resource['type']] = []
-        # for resource in resources:
-        #     logical_name = resource["logical_name"]
-        resource_id = state.get_id(logical_name, config_resource["type"])
-        if resource_id:
-            # Resource exists, check for updates
-            state_resource = next(
-                (r for r in state_resources if r["name"] == logical_name), None
+    state = open_state()
+    plan, state_resources = plan_changes(config, state, targets)
+    if not remote:
+        return plan
+
+    # Check for synapse drift. The remote fetches are independent of each other so they
+    # run concurrently; gather preserves the state order so the output is stable.
+    syn = Synapse.get_client(synapse_client=synapse_client)
+    scheduler = scheduler or RequestScheduler(max_concurrency=parallelism)
+    acl_cache = AclCache(syn, scheduler)
+    if remote_cache is not None:
+        await remote_cache.revalidate_async(syn, state_resources, scheduler)
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    observed = {}
+
+    async def detect_drift(state_resource):
+        async with semaphore:
+            return await _detect_drift(
+                state_resource, acl_cache, remote_cache, observed
             )
-            if (
-                state_resource
-                and state_resource["properties"] != config_resource["properties"]
-            ):
-                changes.append(
-                    {
-                        "type": config_resource["type"],
-                        "name": logical_name,
-                        "action": "update",
-                        "properties": config_resource["properties"],
-                    }
-                )
+
+    drifts = await asyncio.gather(
+        *(detect_drift(state_resource) for state_resource in state_resources)
+    )
+    plan["drift"] = [drift for drift in drifts if drift is not None]
+    plan["etags"] = _plan_etags(plan["changes"], state, observed)
+    if remote_cache is not None:
+        remote_cache.save()
+
+    return plan
+
+
+def _run_sync(
+    function, session: Session = None, synapse_client: Synapse = None, **kwargs
+):
+    """
+    Runs an async operation from synchronous code.
+
+    Args:
+        function: The async function of the operation.
+        session (Session, optional): When given, the operation runs on the session's event loop
+            with its scheduler, and with its logged in client unless `synapse_client` is given.
+        synapse_client (Synapse, optional): The Synapse client to pass to the operation.
+        **kwargs: The other arguments of the operation.
+
+    Returns:
+        The result of the operation.
+    """
+    if session is None:
+        return wrap_async_to_sync(function(synapse_client=synapse_client, **kwargs))
+    return session.run(
+        function(
+            synapse_client=synapse_client or session.client(),
+            scheduler=session.scheduler,
+            **kwargs,
+        )
+    )
+
+
+def plan_config(
+    config: dict,
+    syn: Synapse = None,
+    parallelism: int = DEFAULT_PARALLELISM,
+    remote_cache: RemoteCache = None,
+    remote: bool = True,
+    session: Session = None,
+    targets: list = None,
+):
+    """Synchronous version of `plan_config_async`, run through `session` if given"""
+    if not remote:
+        # Nothing is sent to Synapse, so there is no need to log in through the session
+        session = None
+    return _run_sync(
+        plan_config_async,
+        session,
+        synapse_client=syn,
+        config=config,
+        parallelism=parallelism,
+        remote_cache=remote_cache,
+        remote=remote,
+        targets=targets,
+    )
+
+
+def _group_acls(graph: dict, resource_config: dict) -> tuple:
+    """
+    Collapse the ACL nodes of a dependency graph that target the same resource.
+
+    Args:
+        graph (dict): A dictionary mapping every logical name to the set of logical names it depends on.
+        resource_config (dict): The "resources" mapping of a configuration.
+
+    Returns:
+        tuple: The new graph, where each group of ACLs is a single ("acl", resource) node,
+            and a dictionary mapping each of those nodes to the ACL logical names in it.
+    """
+    grouped = {}
+    groups = defaultdict(list)
+    for name, dependencies in graph.items():
+        resource = resource_config[name]
+        if resource["type"] == "acl":
+            node = ("acl", resource["properties"].get("resource"))
+            groups[node].append(name)
+            grouped.setdefault(node, set()).update(dependencies)
         else:
-            # Resource does not exist, mark for creation
-            changes.append(
-                {
-                    "type": config_resource["type"],
-                    "name": logical_name,
-                    "action": "create",
-                    "properties": config_resource["properties"],
-                }
+            grouped[name] = dependencies
+    return grouped, groups
+
+
+async def _apply_resource(
+    logical_name: str,
+    resource: dict,
+    state: State,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+    children: ChildFolders = None,
+):
+    """Dispatch a single configuration resource to its apply_*_async function"""
+    props = resource["properties"]
+    if resource["type"] == "team":
+        await apply_team_async(
+            logical_name=logical_name,
+            props=props,
+            state=state,
+            synapse_client=synapse_client,
+            scheduler=scheduler,
+        )
+    elif resource["type"] == "project":
+        await apply_project_async(
+            logical_name=logical_name,
+            props=props,
+            state=state,
+            synapse_client=synapse_client,
+            scheduler=scheduler,
+        )
+    elif resource["type"] == "folder":
+        await apply_folder_async(
+            logical_name=logical_name,
+            props=props,
+            state=state,
+            synapse_client=synapse_client,
+            scheduler=scheduler,
+            children=children,
+        )
+
+
+async def apply_config_async(
+    config: dict,
+    parallelism: int = DEFAULT_PARALLELISM,
+    targets: list = None,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+):
+    """Executes API calls to reconcile drift.
+    Updates the state.json file with the new resource IDs and metadata.
+
+    Resources are applied as soon as the resources they reference exist, so sibling
+    folders, unrelated projects and teams are created concurrently.  All ACLs targeting
+    the same resource are applied together with a single ACL write.
+
+    Folders missing from the state are matched by name against a single listing of
+    their parent's folders, so existing folders are adopted rather than created again.
+
+    Args:
+        config (dict): The configuration
+        parallelism (int): The maximum number of resources to apply at once.
+        targets (list, optional): `type.name` references of the resources to apply. Only they and
+            their `dependency_closure` are applied. Defaults to every resource.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+            Defaults to one allowing `parallelism` requests in flight.
+    """
+    scheduler = scheduler or RequestScheduler(max_concurrency=parallelism)
+    state = open_state()
+    resource_config = config["resources"]
+    analysis = analyze_config(config)
+    graph = analysis[0]
+    if targets is not None:
+        selected = dependency_closure(resource_config, targets, graph)
+        graph = {name: graph[name] & selected for name in selected}
+    with state.transaction():
+        await _apply_graph(
+            resource_config,
+            graph,
+            state,
+            parallelism,
+            synapse_client=synapse_client,
+            scheduler=scheduler,
+        )
+        record_subtree_hashes(resource_config, state, analysis)
+
+
+async def _apply_graph(
+    resource_config: dict,
+    graph: dict,
+    state: State,
+    parallelism: int,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+):
+    """Apply the resources of a dependency graph, with one ACL write per resource"""
+    children = ChildFolders(synapse_client, scheduler)
+    graph, acl_groups = _group_acls(graph, resource_config)
+
+    async def apply_node(node):
+        if node in acl_groups:
+            acls = [
+                {"name": name, "properties": resource_config[name]["properties"]}
+                for name in acl_groups[node]
+            ]
+            await apply_acls_async(
+                acls=acls,
+                state=state,
+                synapse_client=synapse_client,
+                scheduler=scheduler,
             )
-    drift_detection = []
-    # Loop through the resources in the state file and compare them to the configuration file to determine if any need to be deleted
-    for state_resource in state_resources:
-        # Check for resources deleted from the config file
-        if state_resource["name"] not in config["resources"]:
-            changes.append(
-                {
-                    "type": state_resource["type"],
-                    "name": state_resource["name"],
-                    "action": "delete",
-                }
+        else:
+            await _apply_resource(
+                node,
+                resource_config[node],
+                state,
+                synapse_client=synapse_client,
+                scheduler=scheduler,
+                children=children,
             )
-        # Check for synapse drift
-        if state_resource["type"] == "team":
-            state_synapse_resource = Team(id=state_resource["id"]).get()
-        elif state_resource["type"] == "acl":
-            acls_drifted = []
-            for grants in state_resource["properties"]["grants"]:
-                acl = syn.get_acl(
-                    entity=state_resource["id"], principal_id=grants["principal"]
-                )
-                if set(acl) != set(grants["access_type"]):
-                    acls_drifted.append(
-                        {
-                            "principal": grants["principal"],
-                            "access_type": acl,
-                        }
-                    )
-            if acls_drifted:
-                drift_detection.append(
-                    {
-                        "type": state_resource["type"],
-                        "name": state_resource["name"],
-                        "synapse_properties": acls_drifted,
-                        "properties": state_resource["properties"],
-                    }
+
+    await run_graph_async(graph, apply_node, parallelism=parallelism)
+
+
+def apply_config(
+    config: dict,
+    parallelism: int = DEFAULT_PARALLELISM,
+    session: Session = None,
+    syn: Synapse = None,
+    targets: list = None,
+):
+    """Synchronous version of `apply_config_async`, run through `session` if given"""
+    return _run_sync(
+        apply_config_async,
+        session,
+        synapse_client=syn,
+        config=config,
+        parallelism=parallelism,
+        targets=targets,
+    )
+
+
+async def _current_etag(uri: str, acl_cache: AclCache) -> str:
+    """The etag a `_etag_uri` currently has on Synapse, or None if it was deleted"""
+    try:
+        if uri.endswith("/acl"):
+            return await acl_cache.etag(uri.split("/")[2])
+        resource = await acl_cache.scheduler.run(
+            lambda: acl_cache.syn.rest_get_async(uri)
+        )
+    except SynapseNotFoundError:
+        return None
+    except SynapseHTTPError as e:
+        if getattr(e.response, "status_code", None) == 404:
+            return None
+        raise
+    return resource.get("etag")
+
+
+async def apply_plan_async(
+    plan: dict,
+    parallelism: int = DEFAULT_PARALLELISM,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+):
+    """Executes the changes of a plan without planning again.
+
+    The etags the plan observed are compared with Synapse first, and nothing is applied
+    if any resource changed since the plan was made.  Only the resources the plan
+    creates or updates are then applied, in the order of the plan's dependency graph.
+    Like `apply_config`, deletions are left to `destroy_resources`.
+
+    Args:
+        plan (dict): The plan returned by `plan_config` or `plan_file.load_plan`.
+        parallelism (int): The maximum number of resources to check or apply at once.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+            Defaults to one allowing `parallelism` requests in flight.
+
+    Raises:
+        ValueError: If a resource changed on Synapse since the plan was made.
+    """
+    syn = Synapse.get_client(synapse_client=synapse_client)
+    scheduler = scheduler or RequestScheduler(max_concurrency=parallelism)
+    acl_cache = AclCache(syn, scheduler)
+    uris = sorted(plan["etags"])
+    current = await asyncio.gather(*(_current_etag(uri, acl_cache) for uri in uris))
+    stale = [uri for uri, etag in zip(uris, current) if etag != plan["etags"][uri]]
+    if stale:
+        raise ValueError(
+            f"Synapse changed since the plan was made: {', '.join(stale)}. "
+            "Run plan again"
+        )
+
+    resource_config = {
+        change["name"]: {"type": change["type"], "properties": change["properties"]}
+        for change in plan["changes"]
+        if change["action"] != "delete"
+    }
+    graph = {name: set(dependencies) for name, dependencies in plan["graph"].items()}
+    state = open_state()
+    with state.transaction():
+        await _apply_graph(
+            resource_config,
+            graph,
+            state,
+            parallelism,
+            synapse_client=synapse_client,
+            scheduler=scheduler,
+        )
+        # Like `record_subtree_hashes`, a subtree is only recorded as in sync if the
+        # state holds what the plan expects for every resource in it
+        subtrees = plan["subtrees"]
+        clean = clean_subtrees(
+            subtrees["hashes"], subtrees["children"], subtrees["order"], state
+        )
+        state.set_subtree_hashes(
+            {
+                (resource_type, name): subtree_hash if clean[name] else None
+                for name, (resource_type, subtree_hash) in plan[
+                    "subtree_hashes"
+                ].items()
+            }
+        )
+
+
+def apply_plan(
+    plan: dict,
+    parallelism: int = DEFAULT_PARALLELISM,
+    session: Session = None,
+    syn: Synapse = None,
+):
+    """Synchronous version of `apply_plan_async`, run through `session` if given"""
+    return _run_sync(
+        apply_plan_async,
+        session,
+        synapse_client=syn,
+        plan=plan,
+        parallelism=parallelism,
+    )
+
+
+def _state_project(resource: dict, state: State) -> str:
+    """The logical name of the project a state folder is in, or None"""
+    while resource is not None and resource["type"] == "folder":
+        parent_type, parent_name = resource["properties"]["parent"].split(".")
+        resource = state.get(parent_name, parent_type)
+    return resource["name"] if resource is not None else None
+
+
+def build_destroy_graph(state: State) -> tuple:
+    """
+    Builds the graph of destroy operations for the resources in a state file.
+
+    Each project and team is a node, and the ACLs on each entity are revoked together
+    as one ("acl", entity ID) node.  Folders are deleted with their project.  A node
+    depends on the nodes that must be destroyed before it: a project on the ACLs of
+    the entities in it, and a team on the ACLs granting it access.
+
+    Args:
+        state (State): The state to destroy.
+
+    Returns:
+        tuple: The graph, and the state resources each node destroys.
+    """
+    graph = {}
+    members = defaultdict(list)
+    folders = defaultdict(list)
+    for resource in state.resources:
+        if resource["type"] in ("project", "team"):
+            node = (resource["type"], resource["name"])
+            graph.setdefault(node, set())
+            members[node].append(resource)
+        elif resource["type"] == "acl":
+            node = ("acl", resource["id"])
+            graph.setdefault(node, set())
+            members[node].append(resource)
+        elif resource["type"] == "folder":
+            project = _state_project(resource, state)
+            if project is not None:
+                folders[("project", project)].append(resource)
+
+    for node, resources in list(members.items()):
+        if node[0] != "acl":
+            continue
+        for acl in resources:
+            for entity in state.get_by_id(acl["id"]):
+                project = (
+                    entity["name"]
+                    if entity["type"] == "project"
+                    else _state_project(entity, state)
                 )
-            state_synapse_resource = None
-        elif state_resource["type"] == "project":
-            state_synapse_resource = Project(id=state_resource["id"]).get()
-        elif state_resource["type"] == "folder":
-            state_synapse_resource = Folder(id=state_resource["id"]).get()
+                if ("project", project) in graph:
+                    graph[("project", project)].add(node)
+            for grant in acl["properties"]["grants"]:
+                for principal in state.get_by_id(grant["principal"]):
+                    if principal["type"] == "team":
+                        graph[("team", principal["name"])].add(node)
+
+    for node, resources in folders.items():
+        if node in members:
+            members[node].extend(resources)
+    return graph, dict(members)
+
+
+async def _delete_async(model, synapse_client: Synapse, scheduler: RequestScheduler):
+    """Delete a resource, treating one that no longer exists as deleted"""
+    try:
+        await scheduler.run(lambda: model.delete_async(synapse_client=synapse_client))
+    except SynapseNotFoundError:
+        pass
+    except SynapseHTTPError as e:
+        if getattr(e.response, "status_code", None) != 404:
+            raise
+
+
+async def destroy_resources_async(
+    parallelism: int = DEFAULT_PARALLELISM,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> dict:
+    """Deletes Synapse resources created by synapseformation through the state file.
+
+    Resources are destroyed in reverse dependency order, with independent resources
+    destroyed concurrently.  Every destroyed resource is removed from the state as soon
+    as it is gone, so an interrupted destroy resumes where it stopped.  A failure only
+    stops the resources that depend on the failed one, and the state is cleared only if
+    everything was destroyed.
+
+    Args:
+        parallelism (int): The maximum number of resources to delete at once.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+            Defaults to one allowing `parallelism` requests in flight.
+
+    Returns:
+        dict: A summary with the "destroyed", "failed" and "skipped" resources, each
+            identified as "type.logical_name". Failed resources map to their error.
+    """
+    scheduler = scheduler or RequestScheduler(max_concurrency=parallelism)
+    state = open_state()
+    graph, members = build_destroy_graph(state)
+    destroyed = []
+
+    async def destroy_node(node):
+        resources = members[node]
+        if node[0] == "acl":
+            # ACLs are revoked first so that teams granted access can be deleted
+            await revoke_acls_async(
+                resources, synapse_client=synapse_client, scheduler=scheduler
+            )
+        elif node[0] == "project":
+            await _delete_async(
+                Project(id=resources[0]["id"]), synapse_client, scheduler
+            )
         else:
-            state_synapse_resource = None
-        if (
-            state_synapse_resource is not None
-            and state_synapse_resource.name != state_resource["properties"]["name"]
-        ):
-            drift_detection.append(
-                {
-                    "type": state_resource["type"],
-                    "name": state_resource["name"],
-                    "synapse_properties": {"name": state_synapse_resource.name},
-                    "properties": state_resource["properties"],
-                }
+            await _delete_async(Team(id=resources[0]["id"]), synapse_client, scheduler)
+        state.remove([(resource["type"], resource["name"]) for resource in resources])
+        destroyed.extend(f"{r['type']}.{r['name']}" for r in resources)
+
+    with state.transaction():
+        errors = await run_graph_async(
+            graph, destroy_node, parallelism=parallelism, fail_fast=False
+        )
+        if not errors:
+            state.clear()
+
+    failed = {}
+    for node, error in errors.items():
+        for resource in members[node]:
+            failed[f"{resource['type']}.{resource['name']}"] = str(error)
+    skipped = [
+        f"{resource['type']}.{resource['name']}"
+        for resource in state.resources
+        if f"{resource['type']}.{resource['name']}" not in failed
+    ]
+    return {"destroyed": destroyed, "failed": failed, "skipped": skipped}
+
+
+def destroy_resources(
+    syn: Synapse = None,
+    parallelism: int = DEFAULT_PARALLELISM,
+    session: Session = None,
+) -> dict:
+    """Synchronous version of `destroy_resources_async`, run through `session` if given"""
+    return _run_sync(
+        destroy_resources_async, session, synapse_client=syn, parallelism=parallelism
+    )
+
+
+def _export_name(name: str, entity_id: str) -> str:
+    """A unique logical name for an exported entity, e.g. "raw_data_123" for syn123"""
+    slug = re.sub(r"\W+", "_", name.lower()).strip("_")
+    digits = entity_id[3:] if entity_id.startswith("syn") else entity_id
+    return f"{slug}_{digits}" if slug else f"entity_{digits}"
+
+
+async def _list_child_folders(
+    syn: Synapse, parent_id: str, scheduler: RequestScheduler
+) -> list:
+    """The (id, name, has local ACL) of every folder inside a container"""
+
+    async def list_children():
+        return [
+            (
+                child["id"],
+                child["name"],
+                str(child.get("benefactorId")) == child["id"][3:],
+            )
+            async for child in get_children(
+                parent=parent_id, include_types=["folder"], synapse_client=syn
             )
+        ]
 
-    return {"changes": changes, "drift": drift_detection}
+    return await scheduler.run(list_children)
 
 
-def apply_config(config: dict):
-    """Executes API calls to reconcile drift.
-    Updates the state.json file with the new resource IDs and metadata.
+async def export_async(
+    project_id: str,
+    template_path: str,
+    state_path: str = DEFAULT_STATE,
+    parallelism: int = DEFAULT_PARALLELISM,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> dict:
     """
-    state = State()
-    resources = get_resources(resource_config=config["resources"])
+    Exports a Synapse project, its folders and their sharing settings as a template.
+
+    The project is crawled breadth first by `parallelism` workers, each listing the
+    children of one container at a time.  Access control lists are only fetched for
+    entities that are their own benefactor, as the folder listing reports each
+    folder's benefactor.  Resources are written to the template and recorded in the
+    state as soon as they are found, so only the crawl frontier is held in memory.
+    Use a SQLite state to keep the state out of memory as well.
+
+    Grants are exported with the principal ID of the user or team, which ACLs accept
+    in place of a `team.name` reference.
+
+    Args:
+        project_id (str): The Synapse ID of the project.
+        template_path (str): Path of the yaml template to write.
+        state_path (str, optional): Path of the new state that the exported resources are recorded in.
+            A SQLite state is used for paths ending in ".db".
+        parallelism (int): The maximum number of containers to list at once.
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+            Defaults to one allowing `parallelism` requests in flight.
 
-    # 1. Teams
-    for team in resources.get("team", []):
-        apply_team(logical_name=team["name"], props=team["properties"], state=state)
+    Returns:
+        dict: The number of exported resources of each type.
 
-    # 2. Projects
-    for project in resources.get("project", []):
-        apply_project(
-            logical_name=project["name"], props=project["properties"], state=state
+    Raises:
+        ValueError: If the state already exists.
+    """
+    if Path(state_path).exists():
+        raise ValueError(f"{state_path} already exists, export to a new state")
+    syn = Synapse.get_client(synapse_client=synapse_client)
+    scheduler = scheduler or RequestScheduler(max_concurrency=parallelism)
+    project = await scheduler.run(lambda: syn.rest_get_async(f"/entity/{project_id}"))
+    project_name = _export_name(project["name"], project_id)
+    counts = defaultdict(int)
+    queue = asyncio.Queue()
+    failed = asyncio.get_running_loop().create_future()
+    state = open_state(state_path)
+
+    def write(f, resource_type: str, name: str, entity_id: str, properties: dict):
+        resource = {"type": resource_type, "properties": properties}
+        f.write(dump_yaml({name: resource}, indent=2))
+        state.add(resource_type, name, entity_id, properties)
+        counts[resource_type] += 1
+
+    async def export_acl(f, resource_type: str, name: str, entity_id: str):
+        acl = await scheduler.run(
+            lambda: syn.rest_get_async(f"/entity/{entity_id}/acl")
         )
+        grants = [
+            {
+                "principal": int(access["principalId"]),
+                "access_type": sorted(access["accessType"]),
+            }
+            for access in acl.get("resourceAccess", [])
+        ]
+        properties = {"resource": f"{resource_type}.{name}", "grants": grants}
+        write(f, "acl", f"{name}_acl", entity_id, properties)
+
+    async def worker(f):
+        while True:
+            parent_id, parent_ref = await queue.get()
+            try:
+                acls = []
+                for folder_id, folder_name, is_local in await _list_child_folders(
+                    syn, parent_id, scheduler
+                ):
+                    name = _export_name(folder_name, folder_id)
+                    properties = {"name": folder_name, "parent": parent_ref}
+                    write(f, "folder", name, folder_id, properties)
+                    queue.put_nowait((folder_id, f"folder.{name}"))
+                    if is_local:
+                        acls.append(export_acl(f, "folder", name, folder_id))
+                await asyncio.gather(*acls)
+            except Exception as e:
+                if not failed.done():
+                    failed.set_exception(e)
+            finally:
+                queue.task_done()
+
+    try:
+        with open_atomic(template_path) as f, state.transaction(checkpoint_every=1000):
+            f.write(dump_yaml({"version": 1, "name": project["name"]}))
+            f.write("resources:\n")
+            write(f, "project", project_name, project_id, {"name": project["name"]})
+            await export_acl(f, "project", project_name, project_id)
+
+            queue.put_nowait((project_id, f"project.{project_name}"))
+            workers = [
+                asyncio.create_task(worker(f)) for _ in range(max(1, parallelism))
+            ]
+            joined = asyncio.ensure_future(queue.join())
+            try:
+                await asyncio.wait(
+                    [joined, failed], return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                for task in (*workers, joined):
+                    task.cancel()
+            if failed.done():
+                failed.result()
+    except BaseException:
+        # The template is not written, so discard the state describing it
+        if hasattr(state, "close"):
+            state.close()
+        for suffix in ("", ".journal", "-journal", "-wal", "-shm"):
+            Path(f"{state_path}{suffix}").unlink(missing_ok=True)
+        raise
+    return dict(counts)
+
+
+def export(
+    project_id: str,
+    template_path: str,
+    state_path: str = DEFAULT_STATE,
+    parallelism: int = DEFAULT_PARALLELISM,
+    syn: Synapse = None,
+    session: Session = None,
+) -> dict:
+    """Synchronous version of `export_async`, run through `session` if given"""
+    return _run_sync(
+        export_async,
+        session,
+        synapse_client=syn,
+        project_id=project_id,
+        template_path=template_path,
+        state_path=state_path,
+        parallelism=parallelism,
+    )
+
+
+async def _fetch_synapse_properties(
+    entries: list, state: State, syn: Synapse, scheduler: RequestScheduler
+):
+    """
+    Fetch what is on Synapse for drift entries without "synapse_properties".
 
-    # 3. Folders (topologically sorted). Projects must be created first, then the ordering of
-    # folders being stored matters, so get the correct ordering of folders.
-    folder_order = sort_folders(resources.get("folder", []))
-    for folder_logical_name in folder_order:
-        props = config["resources"][folder_logical_name]["properties"]
-        apply_folder(logical_name=folder_logical_name, props=props, state=state)
+    Names of projects and folders are read through bulk entity header requests and
+    names of teams through bulk team list requests.  ACLs are read once per benefactor.
 
-    # 4. Access Controls have to come last since they depend on other resources
-    for acl in resources.get("acl", []):
-        apply_acl(acl=acl, state=state)
+    Args:
+        entries (list): Drift entries, updated in place.
+        state (State): The state the drifted resources are tracked in.
+        syn (Synapse): A logged in Synapse client.
+        scheduler (RequestScheduler): The scheduler Synapse requests are sent through.
+    """
+    by_id = defaultdict(list)
+    acls = []
+    for entry in entries:
+        state_resource = state.get(entry["name"], entry["type"])
+        if state_resource is None:
+            continue
+        if entry["type"] == "acl":
+            acls.append((entry, state_resource))
+        else:
+            by_id[(entry["type"] == "team", str(state_resource["id"]))].append(entry)
 
+    def found(resource_id: str, is_team: bool, name: str):
+        for entry in by_id.get((is_team, str(resource_id)), []):
+            entry["synapse_properties"] = {"name": name}
 
-def destroy_resources(syn: Synapse):
-    """Deletes Synapse resources created by synapseformation through the state file."""
-    state = State()
-    resources = defaultdict(list)
-    for resource in state.resources:
-        resources[resource["type"]].append(resource)
-    # Must delete ACLs first to be able to delete teams (in case there are ACLs provided to teams)
-    resources_acl = resources.get("acl", [])
-    for resource in resources_acl:
-        id = resource["id"]
-        for grants in resource["properties"]["grants"]:
-            principal_id = grants["principal"]
-            syn.setPermissions(entity=id, principalId=principal_id, accessType=[])
-
-    projects = resources.get("project", [])
-    for resource in projects:
-        Project(id=resource["id"]).delete()
-
-    teams = resources.get("team", [])
-    for resource in teams:
-        Team(id=resource["id"]).delete()
-    state.clear()
-
-
-def export():
-    """Reads Synapse resources and dumps them into YAML."""
-    pass
+    entity_ids = [resource_id for is_team, resource_id in by_id if not is_team]
+    for batch in batches(entity_ids):
+        body = {"references": [{"targetId": entity_id} for entity_id in batch]}
+        headers = await scheduler.run(
+            lambda: syn.rest_post_async("/entity/header", json.dumps(body))
+        )
+        for header in headers.get("results", []):
+            found(header["id"], False, header["name"])
+    team_ids = [resource_id for is_team, resource_id in by_id if is_team]
+    for batch in batches(team_ids):
+        body = {"list": [int(team_id) for team_id in batch]}
+        teams = await scheduler.run(
+            lambda: syn.rest_post_async("/teamList", json.dumps(body))
+        )
+        for team in teams.get("list") or []:
+            found(team["id"], True, team["name"])
 
+    acl_cache = AclCache(syn, scheduler)
 
-def sync_drift():
-    """Sync the drift detected and align the state file with what is on Synapse"""
-    pass
+    async def fetch_acl(entry: dict, state_resource: dict):
+        acl = await acl_cache.get(state_resource["id"])
+        entry["synapse_properties"] = [
+            {
+                "principal": grant["principal"],
+                "access_type": sorted(acl.get(str(grant["principal"]), set())),
+            }
+            for grant in state_resource["properties"]["grants"]
+        ]
+
+    await asyncio.gather(*(fetch_acl(*acl) for acl in acls))
+
+
+def _synced_properties(state_resource: dict, synapse_properties) -> dict:
+    """The properties of a state entry updated with what is on Synapse"""
+    properties = dict(state_resource["properties"])
+    if state_resource["type"] != "acl":
+        properties.update(synapse_properties)
+        return properties
+    remote = {
+        str(grant["principal"]): grant["access_type"] for grant in synapse_properties
+    }
+    grants = []
+    for grant in properties["grants"]:
+        access_type = remote.get(str(grant["principal"]), grant["access_type"])
+        # Principals that lost all access on Synapse are no longer granted anything
+        if access_type:
+            grants.append({**grant, "access_type": access_type})
+    properties["grants"] = grants
+    return properties
+
+
+def _containers(state_resource: dict, state: State):
+    """Yield the state entries of the folders and project containing a resource"""
+    seen = set()
+    ref = get_container(state_resource)
+    while isinstance(ref, str) and ref.count(".") == 1 and ref not in seen:
+        seen.add(ref)
+        ref_type, ref_name = ref.split(".")
+        container = state.get(ref_name, ref_type)
+        if container is None:
+            return
+        yield container
+        ref = get_container(container)
+
+
+async def sync_drift_async(
+    drift,
+    *,
+    synapse_client: Synapse = None,
+    scheduler: RequestScheduler = None,
+) -> list:
+    """
+    Aligns the state with what is on Synapse for the resources that drifted.
+
+    Drift entries from `plan_config` already hold what was read from Synapse under
+    "synapse_properties", so they are applied without fetching anything again.  Only
+    entries without them are fetched, in bulk.  Every affected state entry is then
+    rewritten in a single transaction, and the subtree hashes of the containers of
+    those resources are forgotten so the next plan compares them with the template.
+
+    Args:
+        drift (dict or list): The plan returned by `plan_config`, or its list of drift entries.
+            Each entry has the "type" and "name" of a resource and optionally its "synapse_properties".
+        synapse_client (Synapse, optional): A logged in Synapse client. Defaults to the cached client.
+            Only needed when some entries have no "synapse_properties".
+        scheduler (RequestScheduler, optional): The scheduler Synapse requests are sent through.
+
+    Returns:
+        list: The logical names of the state entries that were updated.
+    """
+    if isinstance(drift, dict):
+        drift = drift["drift"]
+    entries = [dict(entry) for entry in drift]
+    state = open_state()
+    missing = [entry for entry in entries if "synapse_properties" not in entry]
+    if missing:
+        syn = Synapse.get_client(synapse_client=synapse_client)
+        await _fetch_synapse_properties(
+            missing, state, syn, scheduler or RequestScheduler()
+        )
+
+    synced = []
+    with state.transaction():
+        stale = {}
+        for entry in entries:
+            state_resource = state.get(entry["name"], entry["type"])
+            if state_resource is None or "synapse_properties" not in entry:
+                continue
+            properties = _synced_properties(state_resource, entry["synapse_properties"])
+            state.update_properties(entry["name"], entry["type"], properties)
+            synced.append(entry["name"])
+            for container in _containers(state_resource, state):
+                stale[(container["type"], container["name"])] = None
+            if entry["type"] in ("project", "folder"):
+                stale[(entry["type"], entry["name"])] = None
+        if stale:
+            state.set_subtree_hashes(stale)
+    return synced
+
+
+def sync_drift(drift, syn: Synapse = None, session: Session = None) -> list:
+    """Synchronous version of `sync_drift_async`, run through `session` if given"""
+    return _run_sync(sync_drift_async, session, synapse_client=syn, drift=drift)
@@ -0,0 +1,179 @@
+"""Validate templates and cache their compiled form"""
+import hashlib
+import marshal
+import sys
+from pathlib import Path
+
+from .planner import analyze_resources
+from .utils import expand_resources, file_hash, read_config, write_bytes_atomic
+
+DEFAULT_CACHE_DIR = ".synapseformation/compiled"
+# Bump whenever the layout of the compiled form changes
+FORMAT_VERSION = 2
+RESOURCE_TYPES = ("project", "folder", "team", "acl")
+# The resource types each kind of reference may point to
+REFERENCE_TYPES = {
+    "parent": ("project", "folder"),
+    "resource": ("project", "folder"),
+    "principal": ("team",),
+}
+
+
+def _check_reference(name: str, key: str, ref, resource_config: dict) -> list:
+    """Validate a `type.name` reference, returning the errors found"""
+    if not isinstance(ref, str) or ref.count(".") != 1:
+        return [f"{name}: {key} must be a 'type.name' reference, got {ref!r}"]
+    ref_type, ref_name = ref.split(".")
+    if ref_type not in REFERENCE_TYPES[key]:
+        return [f"{name}: {key} cannot reference a {ref_type}"]
+    target = resource_config.get(ref_name)
+    # References to resources outside the template are expected to already exist
+    if target is not None and target.get("type") != ref_type:
+        return [f"{name}: {key} references {ref} but {ref_name} is a {target['type']}"]
+    return []
+
+
+def validate_config(config: dict):
+    """Check that a configuration is well formed
+
+    Args:
+        config: The configuration
+
+    Raises:
+        ValueError: Listing every problem found in the configuration
+    """
+    resource_config = config.get("resources") if isinstance(config, dict) else None
+    if not isinstance(resource_config, dict):
+        raise ValueError("Invalid template: 'resources' must be a mapping")
+    errors = []
+    for name, resource in resource_config.items():
+        if not isinstance(resource, dict) or resource.get("type") not in RESOURCE_TYPES:
+            errors.append(f"{name}: type must be one of {', '.join(RESOURCE_TYPES)}")
+            continue
+        properties = resource.get("properties")
+        if not isinstance(properties, dict):
+            errors.append(f"{name}: properties must be a mapping")
+            continue
+        if resource["type"] != "acl" and "name" not in properties:
+            errors.append(f"{name}: properties must include a name")
+        if resource["type"] == "folder":
+            errors.extend(
+                _check_reference(
+                    name, "parent", properties.get("parent"), resource_config
+                )
+            )
+        elif resource["type"] == "acl":
+            errors.extend(
+                _check_reference(
+                    name, "resource", properties.get("resource"), resource_config
+                )
+            )
+            grants = properties.get("grants")
+            if not isinstance(grants, list):
+                errors.append(f"{name}: grants must be a list")
+                continue
+            for grant in grants:
+                # Users and groups outside the template are granted by principal ID
+                if not isinstance(grant.get("principal"), int):
+                    errors.extend(
+                        _check_reference(
+                            name, "principal", grant.get("principal"), resource_config
+                        )
+                    )
+                if not isinstance(grant.get("access_type"), list):
+                    errors.append(f"{name}: access_type must be a list")
+    if errors:
+        raise ValueError("Invalid template:\n  " + "\n  ".join(errors))
+
+
+def expand_config(config: dict, base_dir=".", included: list = None) -> dict:
+    """Expand the modules, loops and includes of a configuration
+
+    Args:
+        config: The configuration
+        base_dir: Directory that includes are relative to
+        included: If given, the path of every included template is appended to it
+
+    Returns:
+        The configuration with only plain resources
+
+    Raises:
+        ValueError: If two resources expand to the same logical name
+    """
+    resources = {}
+    for name, resource in expand_resources(
+        config.get("resources") or {},
+        config.get("modules"),
+        base_dir,
+        included=included,
+    ):
+        if name in resources:
+            raise ValueError(f"Invalid template: {name} is defined more than once")
+        resources[name] = resource
+    expanded = {key: value for key, value in config.items() if key != "modules"}
+    expanded["resources"] = resources
+    return expanded
+
+
+def compile_config(config: dict, base_dir=".", included: list = None) -> dict:
+    """Validate a configuration and resolve its dependency graph
+
+    Args:
+        config: The configuration
+        base_dir: Directory that includes are relative to
+        included: If given, the path of every included template is appended to it
+
+    Returns:
+        The expanded configuration with a "compiled" entry holding its dependency
+        graph, topological order and subtree hashes, which plan and apply use instead
+        of computing them again.
+
+    Raises:
+        ValueError: If the configuration is invalid or its dependencies have a cycle
+    """
+    config = expand_config(config, base_dir, included)
+    validate_config(config)
+    return {**config, "compiled": analyze_resources(config["resources"])}
+
+
+def load_template(template_path: str, cache_dir: str = DEFAULT_CACHE_DIR) -> dict:
+    """Read and compile a template, reusing the compiled form of identical templates
+
+    Compiled templates are stored in `cache_dir` in marshal format, keyed by the
+    SHA-256 hash of the template's resolved path and content, since includes are
+    relative to the template's directory.  The hashes of included templates are
+    stored alongside and checked, since they can change without the template changing.
+
+    Args:
+        template_path: Path to yaml or json configuration
+        cache_dir: Directory of the compiled templates
+
+    Returns:
+        The compiled configuration
+    """
+    key = f"{Path(template_path).resolve()}\n{file_hash(template_path)}"
+    cache_path = Path(cache_dir) / f"{hashlib.sha256(key.encode()).hexdigest()}.bin"
+    # marshal's format can change between Python versions
+    header = (FORMAT_VERSION, sys.version_info[:2])
+    if cache_path.exists():
+        try:
+            cached_header, includes, compiled = marshal.loads(cache_path.read_bytes())
+        except (EOFError, ValueError, TypeError):
+            cached_header = None
+        if cached_header == header and all(
+            Path(path).exists() and file_hash(path) == digest
+            for path, digest in includes.items()
+        ):
+            return compiled
+    included = []
+    compiled = compile_config(
+        read_config(template_path), Path(template_path).parent, included
+    )
+    includes = {str(path): file_hash(path) for path in included}
+    try:
+        data = marshal.dumps((header, includes, compiled))
+    except ValueError:
+        # Values such as yaml timestamps cannot be marshalled, so skip the cache
+        return compiled
+    write_bytes_atomic(cache_path, data)
+    return compiled
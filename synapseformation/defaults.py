@@ -0,0 +1,5 @@
+"""Default settings, kept free of imports so the command line starts quickly"""
+
+DEFAULT_PARALLELISM = 10
+DEFAULT_STATE = ".synapseformation/state.json"
+DEFAULT_SQLITE_STATE = ".synapseformation/state.db"
@@ -0,0 +1,59 @@
+"""Saved plans, so that apply executes exactly the changes a reviewed plan computed"""
+import gzip
+import json
+from pathlib import Path
+
+from .utils import write_bytes_atomic
+
+PLAN_VERSION = 3
+PLAN_KEYS = ("changes", "drift", "graph", "subtree_hashes", "subtrees", "etags")
+# Every plan file starts with the gzip magic number, which no yaml or json template does
+_MAGIC = b"\x1f\x8b"
+
+
+def save_plan(plan: dict, path: Path):
+    """Atomically write a plan returned by `client.plan_config` to a file
+
+    The changes, the dependency graph between them, the subtree hashes to record once
+    they are applied along with the resources of those subtrees, and the etags observed
+    on Synapse are stored as gzipped JSON.  The drift is stored too, so that
+    `client.sync_drift` can act on it without reading Synapse again.
+
+    Args:
+        plan: The plan returned by `client.plan_config`
+        path: Path of the plan file
+    """
+    data = {"version": PLAN_VERSION, **{key: plan[key] for key in PLAN_KEYS}}
+    write_bytes_atomic(
+        path, gzip.compress(json.dumps(data, separators=(",", ":")).encode(), mtime=0)
+    )
+
+
+def load_plan(path: Path) -> dict:
+    """Read a plan file written by `save_plan`
+
+    Args:
+        path: Path of the plan file
+
+    Returns:
+        The saved plan
+
+    Raises:
+        ValueError: If the file is not a plan file or was written by another version
+    """
+    if not is_plan_file(path):
+        raise ValueError(f"{path} is not a saved plan")
+    with gzip.open(path, "rb") as f:
+        data = json.load(f)
+    if data.get("version") != PLAN_VERSION:
+        raise ValueError(
+            f"{path} is a version {data.get('version')} plan, "
+            f"expected version {PLAN_VERSION}. Run plan again"
+        )
+    return data
+
+
+def is_plan_file(path: Path) -> bool:
+    """Whether a file is a plan written by `save_plan` rather than a template"""
+    with open(path, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
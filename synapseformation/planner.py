@@ -0,0 +1,488 @@
+"""Planning the changes that reconcile a configuration with the state
+
+Nothing here talks to Synapse, so `plan --offline` runs without importing synapseclient.
+"""
+import hashlib
+from collections import defaultdict, deque
+
+from .state import State, open_state
+from .utils import hash_resource
+
+
+def get_container(resource: dict) -> str:
+    """
+    Returns the `type.name` reference of the resource that contains a resource.
+
+    A folder is contained by its parent and an ACL by the resource it is applied to.
+
+    Args:
+        resource (dict): A resource from the configuration with "type" and "properties".
+
+    Returns:
+        str: The reference to the container, or None if the resource has none.
+    """
+    properties = resource.get("properties") or {}
+    if resource["type"] == "folder":
+        return properties.get("parent")
+    elif resource["type"] == "acl":
+        return properties.get("resource")
+    return None
+
+
+def subtree_hashes(resource_config: dict, graph: dict = None) -> tuple:
+    """
+    Computes a Merkle hash of every resource's subtree in a configuration.
+
+    The subtree hash of a resource combines its own content hash with the subtree
+    hashes of the folders and ACLs it contains, so it changes whenever anything below
+    it changes.
+
+    Args:
+        resource_config (dict): The "resources" mapping of a configuration.
+        graph (dict, optional): The dependency graph of the configuration, if already built.
+
+    Returns:
+        tuple: A dictionary mapping logical names to subtree hashes, a dictionary mapping
+            logical names to their contained logical names, and the logical names ordered
+            so that containers come before what they contain.
+    """
+    children = defaultdict(list)
+    for name, resource in resource_config.items():
+        container = get_container(resource)
+        if isinstance(container, str) and "." in container:
+            container_type, container_name = container.split(".", 1)
+            parent = resource_config.get(container_name)
+            if parent is not None and parent["type"] == container_type:
+                children[container_name].append(name)
+
+    if graph is None:
+        graph = build_dependency_graph(resource_config)
+    order = topological_sort(graph)
+    merkle = {}
+    for name in reversed(order):
+        resource = resource_config[name]
+        digest = hashlib.sha256(
+            hash_resource(resource["type"], resource["properties"]).encode()
+        )
+        for child in sorted(children[name]):
+            digest.update(f"{child}:{merkle[child]}".encode())
+        merkle[name] = digest.hexdigest()
+    return merkle, children, order
+
+
+def analyze_resources(resource_config: dict) -> dict:
+    """
+    Computes what plan and apply derive from the resources of a configuration.
+
+    Args:
+        resource_config (dict): The "resources" mapping of a configuration.
+
+    Returns:
+        dict: The dependency "graph" (logical name to the sorted logical names it depends
+            on), the topological "order", the "children" of each container, and the
+            "subtree_hashes" of every resource.
+    """
+    graph = build_dependency_graph(resource_config)
+    merkle, children, order = subtree_hashes(resource_config, graph)
+    return {
+        "graph": {name: sorted(dependencies) for name, dependencies in graph.items()},
+        "order": order,
+        "children": {name: children[name] for name in order if children[name]},
+        "subtree_hashes": merkle,
+    }
+
+
+def analyze_config(config: dict) -> tuple:
+    """
+    The graph, subtree hashes, children and order of a configuration, taken from its
+    compiled form when it was loaded with `compiler.load_template`.
+    """
+    analysis = config.get("compiled") or analyze_resources(config["resources"])
+    graph = {name: set(deps) for name, deps in analysis["graph"].items()}
+    children = defaultdict(list, analysis["children"])
+    return graph, analysis["subtree_hashes"], children, analysis["order"]
+
+
+def clean_subtrees(
+    content_hashes: dict, children: dict, order: list, state: State
+) -> dict:
+    """
+    Whether the subtree of every resource is in sync with the state, that is whether
+    the resource and everything it contains were applied with their current content.
+
+    Args:
+        content_hashes (dict): The type and `hash_resource` of every resource by logical name.
+        children (dict): The logical names of the resources every resource contains.
+        order (list): The logical names, ordered so that containers come before what they contain.
+        state (State): The state to compare with.
+    """
+    clean = {}
+    for name in reversed(order):
+        resource_type, content_hash = content_hashes[name]
+        entry = state.get(name, resource_type)
+        clean[name] = (
+            entry is not None
+            and entry.get("hash") == content_hash
+            and all(clean[child] for child in children.get(name, ()))
+        )
+    return clean
+
+
+def record_subtree_hashes(resource_config: dict, state: State, analysis: tuple = None):
+    """
+    Record the subtree hash of every project and folder whose whole subtree is in sync
+    with the configuration, and forget it for every other one.
+    """
+    if analysis is None:
+        analysis = analyze_config({"resources": resource_config})
+    _, merkle, children, order = analysis
+    content_hashes = {
+        name: (
+            resource["type"],
+            hash_resource(resource["type"], resource["properties"]),
+        )
+        for name, resource in resource_config.items()
+    }
+    clean = clean_subtrees(content_hashes, children, order, state)
+    state.set_subtree_hashes(
+        {
+            (resource_type, name): merkle[name] if clean[name] else None
+            for name, (resource_type, _) in content_hashes.items()
+            if resource_type in ("project", "folder")
+        }
+    )
+
+
+def get_dependencies(resource: dict) -> list:
+    """
+    Returns the `type.name` references a resource depends on.
+
+    Folders depend on their parent, and ACLs depend on the resource they are applied to
+    as well as every principal they grant access to.
+
+    Args:
+        resource (dict): A resource from the configuration with "type" and "properties".
+
+    Returns:
+        list: The `type.name` references of the dependencies.
+    """
+    properties = resource.get("properties") or {}
+    if resource["type"] == "folder":
+        refs = [properties.get("parent")]
+    elif resource["type"] == "acl":
+        refs = [properties.get("resource")]
+        refs.extend(grant.get("principal") for grant in properties.get("grants", []))
+    else:
+        refs = []
+    return [ref for ref in refs if isinstance(ref, str) and "." in ref]
+
+
+def build_dependency_graph(resource_config: dict) -> dict:
+    """
+    Builds the dependency graph of the resources in a configuration.
+
+    References to resources that are not part of the configuration are ignored as they
+    are expected to already exist.
+
+    Args:
+        resource_config (dict): The "resources" mapping of a configuration.
+
+    Returns:
+        dict: A dictionary mapping every logical name to the set of logical names it depends on.
+    """
+    graph = {}
+    for name, resource in resource_config.items():
+        graph[name] = set()
+        for ref in get_dependencies(resource):
+            ref_type, ref_name = ref.split(".", 1)
+            dependency = resource_config.get(ref_name)
+            if dependency is not None and dependency["type"] == ref_type:
+                graph[name].add(ref_name)
+    return graph
+
+
+def dependency_closure(resource_config: dict, targets: list, graph: dict = None) -> set:
+    """
+    Selects resources and everything they depend on.
+
+    A folder depends on its parents up to the project, and an ACL on the resource it is
+    applied to and the teams it grants access to, so applying only the selection
+    cannot reference a resource that was not applied.
+
+    Args:
+        resource_config (dict): The "resources" mapping of a configuration.
+        targets (list): The `type.name` references of the resources to select.
+        graph (dict, optional): The dependency graph of the configuration, if already built.
+
+    Raises:
+        ValueError: If a target is not a resource of the configuration.
+
+    Returns:
+        set: The logical names of the targets and their dependencies.
+    """
+    if graph is None:
+        graph = build_dependency_graph(resource_config)
+    queue = deque()
+    for target in targets:
+        target_type, _, target_name = target.partition(".")
+        resource = resource_config.get(target_name)
+        if resource is None or resource["type"] != target_type:
+            raise ValueError(f"Target {target} is not a resource of the configuration")
+        queue.append(target_name)
+    selected = set(queue)
+    while queue:
+        for dependency in graph[queue.popleft()]:
+            if dependency not in selected:
+                selected.add(dependency)
+                queue.append(dependency)
+    return selected
+
+
+def invert_graph(graph: dict) -> tuple:
+    """Returns the dependents of every node and the number of dependencies of every node"""
+    dependents = defaultdict(list)
+    in_degree = {}
+    for node, dependencies in graph.items():
+        in_degree[node] = len(dependencies)
+        for dependency in dependencies:
+            dependents[dependency].append(node)
+    return dependents, in_degree
+
+
+def topological_sort(graph: dict) -> list:
+    """
+    Perform a topological sort of a dependency graph.
+
+    Args:
+        graph (dict): A dictionary mapping every node to the set of nodes it depends on.
+
+    Returns:
+        list: The nodes in an order where every node comes after its dependencies.
+    """
+    dependents, in_degree = invert_graph(graph)
+
+    queue = deque([node for node, deg in in_degree.items() if deg == 0])
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for child in dependents[node]:
+            in_degree[child] -= 1
+            if in_degree[child] == 0:
+                queue.append(child)
+
+    if len(order) != len(graph):
+        raise ValueError("Cycle detected in resource dependencies!")
+    return order
+
+
+def diff_properties(old: dict, new: dict) -> dict:
+    """
+    Returns the fields that differ between two sets of properties.
+
+    Args:
+        old (dict): The properties that were last applied.
+        new (dict): The properties from the configuration.
+
+    Returns:
+        dict: The new value of every changed field, or None for fields that were removed.
+    """
+    return {
+        key: new.get(key)
+        for key in sorted(old.keys() | new.keys())
+        if old.get(key) != new.get(key)
+    }
+
+
+def _has_changed(state_resource: dict, config_resource: dict) -> bool:
+    """Whether a configuration resource differs from what was last applied"""
+    if state_resource.get("hash"):
+        return state_resource["hash"] != hash_resource(
+            config_resource["type"], config_resource["properties"]
+        )
+    # State files written before hashes were recorded
+    return state_resource["properties"] != config_resource["properties"]
+
+
+def _plan_graph(
+    resource_config: dict, changes: list, analysis: tuple, state: State
+) -> dict:
+    """
+    The dependency graph between the resources a plan creates or updates, and the
+    subtree hashes of the projects and folders containing them.
+
+    Only the subtrees that are in sync once the plan is applied are given a hash, that
+    is those whose every resource is applied by the plan or already in sync in the
+    state.  A targeted plan can leave part of a subtree to a later plan.  The content
+    hashes and children of the resources in those subtrees are kept as well, so that
+    applying the plan checks them against the state with `clean_subtrees`.
+    """
+    graph, merkle, children, order = analysis
+    applied = {change["name"] for change in changes if change["action"] != "delete"}
+    content_hashes = {
+        name: (
+            resource["type"],
+            hash_resource(resource["type"], resource["properties"]),
+        )
+        for name, resource in resource_config.items()
+    }
+    in_sync = {}
+    for name in reversed(order):
+        resource_type, content_hash = content_hashes[name]
+        entry = state.get(name, resource_type)
+        applied_or_tracked = name in applied or (
+            entry is not None and entry.get("hash") == content_hash
+        )
+        in_sync[name] = applied_or_tracked and all(
+            in_sync[child] for child in children[name]
+        )
+    hashes = {}
+    for name in applied:
+        seen = set()
+        while name in resource_config and name not in seen:
+            seen.add(name)
+            resource = resource_config[name]
+            if resource["type"] in ("project", "folder") and in_sync[name]:
+                hashes[name] = [resource["type"], merkle[name]]
+            container = get_container(resource)
+            if not (isinstance(container, str) and "." in container):
+                break
+            container_type, name = container.split(".", 1)
+            if resource_config.get(name, {}).get("type") != container_type:
+                break
+    members = set()
+    queue = deque(hashes)
+    while queue:
+        name = queue.popleft()
+        if name not in members:
+            members.add(name)
+            queue.extend(children[name])
+    return {
+        "graph": {name: sorted(graph[name] & applied) for name in sorted(applied)},
+        "subtree_hashes": hashes,
+        "subtrees": {
+            "order": [name for name in order if name in members],
+            "hashes": {name: list(content_hashes[name]) for name in sorted(members)},
+            "children": {
+                name: sorted(children[name])
+                for name in sorted(members)
+                if children[name]
+            },
+        },
+        "etags": {},
+    }
+
+
+def plan_changes(config: dict, state: State = None, targets: list = None) -> tuple:
+    """
+    Compares a configuration with the state to determine the changes that reconcile them.
+
+    Args:
+        config (dict): The configuration
+        state (State, optional): The state to compare with. Defaults to `open_state()`.
+        targets (list, optional): `type.name` references of the resources to plan. Only they and
+            their `dependency_closure` are compared, and no deletions are planned.
+            Defaults to every resource.
+
+    Returns:
+        tuple: The plan, as returned by `client.plan_config_async` without any drift or
+            etags, and the state entries of the planned resources, which are the ones
+            to check for drift.
+    """
+    if state is None:
+        state = open_state()
+    analysis = analyze_config(config)
+    graph, merkle, children, order = analysis
+    if targets is None:
+        selected = config["resources"]
+        # Get the resources from the state file
+        state_resources = state.resources
+    else:
+        closure = dependency_closure(config["resources"], targets, graph)
+        selected = [name for name in config["resources"] if name in closure]
+        order = [logical_name for logical_name in order if logical_name in closure]
+        state_resources = [
+            state_resource
+            for state_resource in (
+                state.get(logical_name, config["resources"][logical_name]["type"])
+                for logical_name in order
+            )
+            if state_resource is not None
+        ]
+
+    # Create a dictionary to store the changes that need to be made to reconcile any drift
+    changes = []
+
+    # Whether every resource in a subtree is still tracked.  Resources removed from the
+    # state, for example by an interrupted destroy, leave their containers' hashes.
+    tracked = {}
+    for logical_name in reversed(analysis[3]):
+        config_resource = config["resources"][logical_name]
+        tracked[logical_name] = state.get(
+            logical_name, config_resource["type"]
+        ) is not None and all(tracked[child] for child in children[logical_name])
+
+    # Subtrees whose hash matches the one recorded by the last apply are unchanged, so
+    # none of the resources in them need to be compared
+    unchanged = set()
+    for logical_name in order:
+        config_resource = config["resources"][logical_name]
+        state_resource = state.get(logical_name, config_resource["type"])
+        if (
+            tracked[logical_name]
+            and state_resource.get("subtree_hash") == merkle[logical_name]
+        ):
+            unchanged.add(logical_name)
+        if logical_name in unchanged:
+            unchanged.update(children[logical_name])
+
+    # Loop through the configuration file and compare it to the state file to determine what changes need to be made
+    for logical_name in selected:
+        config_resource = config["resources"][logical_name]
+        if logical_name in unchanged:
+            continue
+        resource_id = state.get_id(logical_name, config_resource["type"])
+        if resource_id:
+            # Resource exists, check for updates
+            state_resource = state.get(logical_name, config_resource["type"])
+            if state_resource and _has_changed(state_resource, config_resource):
+                change = {
+                    "type": config_resource["type"],
+                    "name": logical_name,
+                    "action": "update",
+                    "properties": config_resource["properties"],
+                }
+                if state_resource.get("properties"):
+                    # Only these fields are written when the change is applied
+                    change["fields"] = sorted(
+                        diff_properties(
+                            state_resource["properties"], config_resource["properties"]
+                        )
+                    )
+                changes.append(change)
+        else:
+            # Resource does not exist, mark for creation
+            changes.append(
+                {
+                    "type": config_resource["type"],
+                    "name": logical_name,
+                    "action": "create",
+                    "properties": config_resource["properties"],
+                }
+            )
+    # Loop through the resources in the state file and compare them to the configuration file to determine if any need to be deleted
+    for state_resource in state_resources:
+        # Check for resources deleted from the config file. They cannot be targeted,
+        # so targeted plans only hold resources from the config file.
+        if state_resource["name"] not in config["resources"]:
+            changes.append(
+                {
+                    "type": state_resource["type"],
+                    "name": state_resource["name"],
+                    "action": "delete",
+                }
+            )
+
+    plan = {"changes": changes, "drift": []}
+    plan.update(_plan_graph(config["resources"], changes, analysis, state))
+    return plan, state_resources
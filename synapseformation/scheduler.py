@@ -0,0 +1,208 @@
+"""Central scheduler for the requests synapseformation sends to Synapse"""
+import asyncio
+import contextvars
+import random
+import time
+
+from synapseclient.core.exceptions import SynapseHTTPError
+
+# HTTP status codes Synapse uses when it is throttling or briefly unavailable
+THROTTLE_STATUS_CODES = (429, 503)
+CONFLICT_STATUS_CODE = 409
+# Requests are not rate limited by default, leaving AIMD to follow the service limit
+DEFAULT_RATE = None
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+# Set while a `recover` lookup runs, whose requests do not take a concurrency slot
+_recovering = contextvars.ContextVar("recovering", default=False)
+
+
+def _status_code(exception: Exception) -> int:
+    """The HTTP status code of a failed request, or None"""
+    if not isinstance(exception, SynapseHTTPError):
+        return None
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(exception: Exception) -> float:
+    """The delay requested by a Retry-After header, or None"""
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Limits the rate at which requests are started
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`, and every
+    request takes one token.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RequestScheduler:
+    """Runs Synapse requests under a shared rate limit and retry policy
+
+    If `rate` is given, requests are started at most `rate` times per second.  By
+    default only the concurrency limits them.  The number of requests in
+    flight follows AIMD: it grows by one after a full window of successful requests and
+    is halved whenever Synapse throttles a request (HTTP 429 or 503).  Throttled requests
+    are retried with jittered exponential backoff, honouring Retry-After.
+
+    Requests that are not idempotent, such as creates, are only retried if a `recover`
+    callable is given.  Before such a request is retried, `recover` is awaited to look
+    for the result of an earlier attempt that succeeded even though its response was
+    lost, so the resource is never created twice.  The requests `recover` sends, even
+    through this scheduler, are rate limited but do not take a concurrency slot, so a
+    lookup can never wait on slots held by the requests it recovers.
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = None
+
+    def _on_success(self):
+        self._successes += 1
+        if self._successes >= self.concurrency:
+            self._successes = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def _on_throttle(self):
+        self._successes = 0
+        self.concurrency = max(1, self.concurrency // 2)
+
+    def backoff(self, attempt: int, exception: Exception = None) -> float:
+        """The delay before retrying a request
+
+        Args:
+            attempt: The number of attempts made so far
+            exception: The error the last attempt failed with
+
+        Returns:
+            The number of seconds to wait
+        """
+        retry_after = _retry_after(exception)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def _acquire(self) -> bool:
+        """Wait for a concurrency slot and a token, returning whether a slot was taken"""
+        if _recovering.get():
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            return False
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.concurrency)
+            self._in_flight += 1
+        if self.bucket is not None:
+            await self.bucket.acquire()
+        return True
+
+    async def _release(self):
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def _recover(self, recover):
+        """Look up the result of an earlier attempt outside of the concurrency slots"""
+        token = _recovering.set(True)
+        try:
+            return await self.run(recover)
+        finally:
+            _recovering.reset(token)
+
+    async def run(self, request, idempotent: bool = True, recover=None):
+        """Run a request, retrying it while Synapse is throttling
+
+        Args:
+            request: A callable returning a new awaitable for every attempt
+            idempotent: Whether repeating the request is harmless
+            recover: For requests that are not idempotent, a callable returning an
+                awaitable that resolves to the result of an earlier successful attempt,
+                or None if there was none
+
+        Returns:
+            The result of the request
+        """
+        attempt = 0
+        while True:
+            slot = await self._acquire()
+            try:
+                result = await request()
+            except SynapseHTTPError as e:
+                status_code = _status_code(e)
+                throttled = status_code in THROTTLE_STATUS_CODES
+                # A conflict on a retried create means an earlier attempt succeeded
+                conflict = (
+                    not idempotent
+                    and attempt > 0
+                    and status_code == CONFLICT_STATUS_CODE
+                )
+                if throttled:
+                    self._on_throttle()
+                if not (throttled or conflict) or attempt >= self.max_retries:
+                    raise
+                if not idempotent and recover is None:
+                    raise
+                error = e
+            else:
+                self._on_success()
+                return result
+            finally:
+                if slot:
+                    await self._release()
+
+            if not idempotent:
+                # Looking up the result of an earlier attempt is itself a request
+                existing = await self._recover(recover)
+                if existing is not None:
+                    return existing
+                if conflict:
+                    raise error
+            await asyncio.sleep(self.backoff(attempt, error))
+            attempt += 1
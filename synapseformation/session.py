@@ -0,0 +1,112 @@
+"""Share authenticated Synapse clients and HTTP connections across operations"""
+import asyncio
+import threading
+
+import httpx
+import requests
+from synapseclient import Synapse
+
+from .defaults import DEFAULT_PARALLELISM
+from .scheduler import RequestScheduler
+
+USER_AGENT = "synapseformation/0.0.0"
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = 70
+
+
+class Session:
+    """Caches logged in Synapse clients that share pooled keep-alive connections
+
+    A client is created and logged in once per profile or auth token.  Every client
+    shares one requests session, one httpx client for storage and one httpx async
+    client, so connections and their TLS handshakes are reused by every operation run
+    through the session.  httpx can only pool connections within one event loop, so
+    the session owns a loop and `run` executes every coroutine on it.  Requests are
+    sent through a single `RequestScheduler`, which applies its concurrency and
+    optional `rate` limit to the whole run rather than to each operation.
+
+    Use it as a context manager, or call `close`, to release the connections.
+    """
+
+    def __init__(
+        self,
+        user_agent: str = USER_AGENT,
+        max_connections: int = DEFAULT_PARALLELISM,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        scheduler: RequestScheduler = None,
+        rate: float = None,
+    ):
+        self.user_agent = user_agent
+        self.scheduler = scheduler or RequestScheduler(
+            rate=rate, max_concurrency=max_connections
+        )
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        timeout = httpx.Timeout(DEFAULT_TIMEOUT, pool=None)
+        self._requests_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self._requests_session.mount("https://", adapter)
+        self._http = httpx.Client(limits=limits, timeout=timeout)
+        self._async_http = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    def client(self, profile: str = "default", auth_token: str = None) -> Synapse:
+        """The logged in client for a profile or auth token, logging in the first time
+
+        Args:
+            profile: Profile of the Synapse configuration file to log in with
+            auth_token: Personal access token to log in with instead of a profile
+
+        Returns:
+            The logged in Synapse client
+        """
+        key = auth_token or f"profile:{profile}"
+        with self._lock:
+            if key not in self._clients:
+                syn = Synapse(
+                    user_agent=self.user_agent,
+                    requests_session=self._requests_session,
+                    requests_session_storage=self._http,
+                    requests_session_async_synapse=self._async_http,
+                    asyncio_event_loop=self._loop,
+                )
+                if auth_token:
+                    syn.login(authToken=auth_token, silent=True)
+                else:
+                    syn.login(profile=profile, silent=True)
+                self._clients[key] = syn
+            return self._clients[key]
+
+    def run(self, coroutine):
+        """Run a coroutine on the session's event loop
+
+        Args:
+            coroutine: The coroutine to run
+
+        Returns:
+            The result of the coroutine
+        """
+        return self._loop.run_until_complete(coroutine)
+
+    def close(self):
+        """Close the pooled connections and the event loop"""
+        if self._loop.is_closed():
+            return
+        self._loop.run_until_complete(self._async_http.aclose())
+        self._loop.close()
+        self._http.close()
+        self._requests_session.close()
+        self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
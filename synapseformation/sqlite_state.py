@@ -0,0 +1,315 @@
+"""SQLite state backend for deployments tracking many resources"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from .state import State
+from .utils import hash_resource
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS resources (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id,
+    properties TEXT NOT NULL,
+    hash TEXT,
+    subtree_hash TEXT,
+    PRIMARY KEY (type, name)
+);
+CREATE INDEX IF NOT EXISTS resources_id ON resources (id);
+"""
+COLUMNS = "type, name, id, properties, hash, subtree_hash"
+
+
+def _to_row(resource: dict) -> tuple:
+    return (
+        resource["type"],
+        resource["name"],
+        resource.get("id"),
+        json.dumps(resource.get("properties") or {}),
+        resource.get("hash"),
+        resource.get("subtree_hash"),
+    )
+
+
+def _from_row(row: tuple) -> dict:
+    resource = {
+        "type": row[0],
+        "name": row[1],
+        "id": row[2],
+        "properties": json.loads(row[3]),
+        "hash": row[4],
+    }
+    if row[5] is not None:
+        resource["subtree_hash"] = row[5]
+    return resource
+
+
+class SqliteState:
+    """Stores the synapseformation state in a SQLite database
+
+    Has the same interface as `State`, but lookups by logical name or Synapse ID are
+    indexed queries and every mutation only writes the affected rows, so the state is
+    never loaded or rewritten as a whole.  Mutations inside `transaction()` are
+    committed together at the end, or every `checkpoint_every` mutations.
+    """
+
+    def __init__(self, path=".synapseformation/state.db"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._pending = 0
+        self._checkpoint_every = None
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('version', ?)", (str(SCHEMA_VERSION),)
+        )
+
+    def close(self):
+        """Close the database connection"""
+        self._conn.close()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            if self._in_transaction:
+                self._pending += 1
+                if self._checkpoint_every and self._pending >= self._checkpoint_every:
+                    self.checkpoint()
+            return cursor
+
+    @property
+    def resources(self) -> list:
+        """The list of tracked resources, read from the database"""
+        return list(self.iter_resources())
+
+    @resources.setter
+    def resources(self, resources: list):
+        with self.transaction():
+            self._execute("DELETE FROM resources")
+            for resource in resources:
+                self._upsert(resource)
+
+    def iter_resources(self, resource_type: str = None):
+        """Iterate over the tracked resources without loading them all at once.
+
+        Args:
+            resource_type (str, optional): Only iterate over resources of this type.
+
+        Yields:
+            dict: The state entry of each resource.
+        """
+        with self._lock:
+            if resource_type is None:
+                rows = self._conn.execute(f"SELECT {COLUMNS} FROM resources").fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {COLUMNS} FROM resources WHERE type = ?", (resource_type,)
+                ).fetchall()
+        for row in rows:
+            yield _from_row(row)
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM resources").fetchone()[0]
+
+    @contextmanager
+    def transaction(self, checkpoint_every: int = None):
+        """Commit the mutations made inside the block together.
+
+        Args:
+            checkpoint_every (int, optional): Also commit after this many mutations.
+                Defaults to only committing when the transaction ends.
+
+        Yields:
+            SqliteState: This state object.
+        """
+        with self._lock:
+            if self._in_transaction:
+                # Nested transactions are folded into the outer one
+                yield self
+                return
+            self._conn.execute("BEGIN")
+            self._in_transaction = True
+            self._checkpoint_every = checkpoint_every
+        try:
+            yield self
+        finally:
+            # Commit whatever was applied, even if the transaction failed midway,
+            # since those resources already exist in Synapse.
+            with self._lock:
+                self._conn.execute("COMMIT")
+                self._in_transaction = False
+                self._checkpoint_every = None
+                self._pending = 0
+
+    def checkpoint(self):
+        """Commit the mutations made so far in the current transaction"""
+        with self._lock:
+            if self._in_transaction:
+                self._conn.execute("COMMIT")
+                self._conn.execute("BEGIN")
+            self._pending = 0
+
+    def save(self):
+        """Every mutation is already written, so this only commits a transaction"""
+        self.checkpoint()
+
+    def get(self, logical_name: str, resource_type: str) -> dict:
+        """Retrieve the state entry for a given logical name and resource type.
+
+        Args:
+            logical_name (str): The logical name of the resource as defined in the configuration.
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+
+        Returns:
+            dict: The state entry of the resource if found, otherwise None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {COLUMNS} FROM resources WHERE type = ? AND name = ?",
+                (resource_type, logical_name),
+            ).fetchone()
+        return _from_row(row) if row else None
+
+    def get_by_id(self, resource_id: str) -> list:
+        """Retrieve all state entries tracking a Synapse ID.
+
+        Args:
+            resource_id (str): The Synapse ID of the resource. An int team ID and its
+                string form match the same entries.
+
+        Returns:
+            list: The state entries with that Synapse ID.
+        """
+        # The id column is untyped, so team IDs may have been stored as ints or strings
+        resource_id = str(resource_id)
+        ids = (resource_id, int(resource_id) if resource_id.isdigit() else resource_id)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS} FROM resources WHERE id IN (?, ?)", ids
+            ).fetchall()
+        return [_from_row(row) for row in rows]
+
+    get_id = State.get_id
+
+    def _upsert(self, resource: dict):
+        self._execute(
+            f"INSERT OR REPLACE INTO resources ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            _to_row(resource),
+        )
+
+    def add(
+        self,
+        resource_type: str,
+        logical_name: str,
+        resource_id: str,
+        properties: dict = None,
+        content_hash: str = None,
+    ):
+        """
+        Adds a resource to the state, replacing any entry with the same logical name and type.
+
+        Args:
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+            logical_name (str): A unique logical name to identify the resource.
+            resource_id (str): The unique identifier of the resource.
+            properties (dict, optional): Additional properties for the resource. Defaults to an empty dictionary if not provided.
+            content_hash (str, optional): The hash of the configuration the resource was created from.
+                Defaults to the hash of the properties.
+        """
+        properties = properties or {}
+        self._upsert(
+            {
+                "type": resource_type,
+                "name": logical_name,
+                "id": resource_id,
+                "properties": properties,
+                "hash": content_hash or hash_resource(resource_type, properties),
+            }
+        )
+
+    def update_properties(
+        self,
+        logical_name: str,
+        resource_type: str,
+        properties: dict = None,
+        content_hash: str = None,
+    ):
+        """
+        Updates the properties of a resource identified by logical name and resource type.
+
+        Args:
+            logical_name (str): The logical name of the resource as defined in the configuration.
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+            properties (dict, optional): The new properties to set for the resource. Defaults to None.
+            content_hash (str, optional): The hash of the configuration the properties came from.
+                Defaults to the hash of the properties.
+        """
+        self._execute(
+            "UPDATE resources SET properties = ?, hash = ? WHERE type = ? AND name = ?",
+            (
+                json.dumps(properties),
+                content_hash or hash_resource(resource_type, properties),
+                resource_type,
+                logical_name,
+            ),
+        )
+
+    def set_subtree_hashes(self, subtree_hashes: dict):
+        """
+        Records the hash of the configuration subtree rooted at each resource.
+
+        Args:
+            subtree_hashes (dict): A dictionary mapping (type, logical name) to the subtree
+                hash, or to None to forget a previously recorded hash.
+        """
+        with self.transaction():
+            for (resource_type, logical_name), subtree_hash in subtree_hashes.items():
+                self._execute(
+                    "UPDATE resources SET subtree_hash = ? WHERE type = ? AND name = ?",
+                    (subtree_hash, resource_type, logical_name),
+                )
+
+    def remove(self, resources: list):
+        """
+        Removes resources from the state.
+
+        Args:
+            resources (list): The (type, logical name) of each resource to remove.
+        """
+        with self.transaction():
+            for resource_type, logical_name in resources:
+                self._execute(
+                    "DELETE FROM resources WHERE type = ? AND name = ?",
+                    (resource_type, logical_name),
+                )
+
+    def clear(self):
+        """Clear the state"""
+        self._execute("DELETE FROM resources")
+
+
+def migrate_json_state(json_path, sqlite_path) -> SqliteState:
+    """Copy a version 1 JSON state file, and its journal, into a SQLite state.
+
+    Args:
+        json_path: Path of the JSON state file.
+        sqlite_path: Path of the SQLite database to create.
+
+    Returns:
+        SqliteState: The migrated state.
+    """
+    source = State(json_path)
+    state = SqliteState(sqlite_path)
+    state.resources = source.resources
+    return state
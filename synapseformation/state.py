@@ -0,0 +1,450 @@
+"""The state of the resources applied from a configuration"""
+import importlib
+import json
+import sys
+import threading
+from collections import defaultdict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from pathlib import Path
+
+from .defaults import DEFAULT_SQLITE_STATE, DEFAULT_STATE
+from .utils import hash_resource, write_json_atomic
+
+
+def _intern(value):
+    """Intern the strings of a JSON value so repeated values share one object"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    if isinstance(value, dict):
+        return {_intern(key): _intern(item) for key, item in value.items()}
+    return value
+
+
+class Resource(MutableMapping):
+    """A state entry
+
+    Behaves like the dictionary stored in the state file but keeps its fields in slots
+    instead of a per-entry dictionary.  Strings, including those nested in the
+    properties, are interned so the type names, parent references and access types
+    repeated across resources are stored once.
+    """
+
+    __slots__ = ("type", "name", "id", "properties", "hash", "subtree_hash", "extra")
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, type: str, name: str, **fields):
+        self.type = sys.intern(type)
+        self.name = sys.intern(name)
+        # Fields unknown to this version are kept so they are written back
+        self.extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a state entry from its JSON representation"""
+        return data if isinstance(data, cls) else cls(**data)
+
+    def to_dict(self) -> dict:
+        """The JSON representation of the state entry"""
+        return dict(self.items())
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value if key.endswith("hash") else _intern(value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS[2:] and hasattr(self, key):
+            delattr(self, key)
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Resource({self.to_dict()!r})"
+
+
+class State:
+    """Saves the synapseformation state per configuration file
+
+    Outside of a transaction every mutation rewrites the state file.  Inside of
+    `State.transaction()` mutations are appended to a journal next to the state file
+    and the state file is only rewritten at checkpoints.  A journal left behind by a
+    crash is replayed the next time the state is loaded.
+    """
+
+    def __init__(self, path=DEFAULT_STATE):
+        self.path = Path(path)
+        self.journal_path = self.path.with_name(self.path.name + ".journal")
+        self._journal = None
+        self._pending = 0
+        self._lock = threading.RLock()
+        self._checkpoint_every = None
+        self.resources = []
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                resources = json.load(f).get("resources", [])
+            # Convert in place so each dictionary is freed as soon as it is replaced
+            for i, resource in enumerate(resources):
+                resources[i] = Resource.from_dict(resource)
+            self.resources = resources
+        else:
+            self.resources = []
+        if self.journal_path.exists():
+            self._replay()
+            # Persist the replayed mutations so the journal is not replayed again
+            self.checkpoint()
+            self.journal_path.unlink()
+
+    @property
+    def resources(self) -> list:
+        """The list of tracked resources"""
+        if self._removed:
+            # Removed entries are only dropped from the list once it is read, so
+            # removing resources one at a time does not rebuild it every time
+            self._resources = [r for r in self._resources if id(r) not in self._removed]
+            self._removed = set()
+        return self._resources
+
+    @resources.setter
+    def resources(self, resources: list):
+        self._resources = [Resource.from_dict(r) for r in resources]
+        self._removed = set()
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the (type, name) and Synapse ID lookup indexes"""
+        # Nested by type rather than keyed by tuples, and mapping a Synapse ID to a
+        # list only when it is shared, so the indexes hold no per-resource containers
+        self._by_name = defaultdict(dict)
+        self._by_id = {}
+        for r in self._resources:
+            self._index(r)
+
+    def _index(self, resource: dict):
+        self._by_name[resource["type"]][resource["name"]] = resource
+        # Team IDs are ints while entity IDs are strings, so IDs are indexed as strings
+        resource_id = str(resource["id"])
+        existing = self._by_id.setdefault(resource_id, resource)
+        if isinstance(existing, list):
+            existing.append(resource)
+        elif existing is not resource:
+            self._by_id[resource_id] = [existing, resource]
+
+    def _unindex(self, resource_type: str, logical_name: str):
+        """Drop a resource from the indexes, to be dropped from the list when it is read"""
+        resource = self._by_name[resource_type].pop(logical_name, None)
+        if resource is None:
+            return
+        self._removed.add(id(resource))
+        resource_id = str(resource["id"])
+        existing = self._by_id.get(resource_id)
+        if existing is resource:
+            del self._by_id[resource_id]
+        elif isinstance(existing, list):
+            existing.remove(resource)
+            if len(existing) == 1:
+                self._by_id[resource_id] = existing[0]
+
+    def _replay(self):
+        """Apply the mutations recorded in the journal on top of the loaded state"""
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a partial last line
+                    break
+                if entry["op"] == "add":
+                    resource = Resource.from_dict(entry["resource"])
+                    existing = self.get(resource["name"], resource["type"])
+                    if existing is None:
+                        self._resources.append(resource)
+                        self._index(resource)
+                    else:
+                        existing.update(resource)
+                elif entry["op"] == "update":
+                    resource = self.get(entry["name"], entry["type"])
+                    if resource is not None:
+                        resource["properties"] = entry["properties"]
+                        resource["hash"] = entry.get("hash")
+                elif entry["op"] == "subtree_hashes":
+                    for resource_type, logical_name, subtree_hash in entry["hashes"]:
+                        resource = self.get(logical_name, resource_type)
+                        if resource is not None:
+                            resource["subtree_hash"] = subtree_hash
+                elif entry["op"] == "remove":
+                    for resource_type, logical_name in entry["resources"]:
+                        self._unindex(resource_type, logical_name)
+                elif entry["op"] == "clear":
+                    self.resources = []
+
+    def _record(self, entry: dict):
+        """Persist a single mutation, either to the journal or by saving the state"""
+        if self._journal is None:
+            self.save()
+            return
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        self._pending += 1
+        if self._checkpoint_every and self._pending >= self._checkpoint_every:
+            self.checkpoint()
+
+    @contextmanager
+    def transaction(self, checkpoint_every: int = None):
+        """Buffer mutations in the journal and save the state once at the end.
+
+        Args:
+            checkpoint_every (int, optional): Also save the state after this many
+                mutations. Defaults to only saving when the transaction ends.
+
+        Yields:
+            State: This state object.
+        """
+        if self._journal is not None:
+            # Nested transactions are folded into the outer one
+            yield self
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._checkpoint_every = checkpoint_every
+        self._journal = open(self.journal_path, "a")
+        try:
+            yield self
+        finally:
+            # Persist whatever was applied, even if the transaction failed midway,
+            # since those resources already exist in Synapse.
+            try:
+                self.checkpoint()
+            finally:
+                self._journal.close()
+                self._journal = None
+                self._checkpoint_every = None
+                self.journal_path.unlink(missing_ok=True)
+
+    def checkpoint(self):
+        """Save the state and truncate the journal"""
+        with self._lock:
+            self.save()
+            if self._journal is not None:
+                self._journal.seek(0)
+                self._journal.truncate()
+            self._pending = 0
+
+    def save(self):
+        """Atomically write the state file"""
+        data = {"version": 1, "resources": [r.to_dict() for r in self.resources]}
+        write_json_atomic(self.path, data, indent=2)
+
+    def get(self, logical_name: str, resource_type: str) -> dict:
+        """Retrieve the state entry for a given logical name and resource type.
+
+        Args:
+            logical_name (str): The logical name of the resource as defined in the configuration.
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+
+        Returns:
+            dict: The state entry of the resource if found, otherwise None.
+        """
+        resources = self._by_name.get(resource_type)
+        return resources.get(logical_name) if resources else None
+
+    def get_by_id(self, resource_id: str) -> list:
+        """Retrieve all state entries tracking a Synapse ID.
+
+        An ACL shares the Synapse ID of the entity it is applied to, so more than one
+        entry can be returned.
+
+        Args:
+            resource_id (str): The Synapse ID of the resource. An int team ID and its
+                string form match the same entries.
+
+        Returns:
+            list: The state entries with that Synapse ID.
+        """
+        entries = self._by_id.get(str(resource_id))
+        if entries is None:
+            return []
+        return list(entries) if isinstance(entries, list) else [entries]
+
+    def get_id(self, logical_name: str, resource_type: str) -> str:
+        """Retrieve the Synapse resource ID for a given logical name and resource type.
+
+        Args:
+            logical_name (str): The logical name of the resource as defined in the configuration.
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+
+        Returns:
+            str: The Synapse ID of the resource if found, otherwise None.
+        """
+        resource = self.get(logical_name, resource_type)
+        return resource["id"] if resource else None
+
+    def add(
+        self,
+        resource_type: str,
+        logical_name: str,
+        resource_id: str,
+        properties: dict = None,
+        content_hash: str = None,
+    ):
+        """
+        Adds a new resource to the internal resources list and saves the updated list.
+
+        Args:
+            resource_type (str): The type of the resource (e.g., 'database', 'storage').
+            logical_name (str): A unique logical name to identify the resource.
+            resource_id (str): The unique identifier of the resource.
+            properties (dict, optional): Additional properties for the resource. Defaults to an empty dictionary if not provided.
+            content_hash (str, optional): The hash of the configuration the resource was created from.
+                Defaults to the hash of the properties.
+        """
+        properties = properties or {}
+        resource = Resource(
+            type=resource_type,
+            name=logical_name,
+            id=resource_id,
+            properties=properties,
+            hash=content_hash or hash_resource(resource_type, properties),
+        )
+        with self._lock:
+            self._resources.append(resource)
+            self._index(resource)
+            self._record({"op": "add", "resource": resource.to_dict()})
+
+    def update_properties(
+        self,
+        logical_name: str,
+        resource_type: str,
+        properties: dict = None,
+        content_hash: str = None,
+    ):
+        """
+        Updates the properties of a resource identified by logical name and resource type.
+
+        Args:
+            logical_name (str): The logical name of the resource as defined in the configuration.
+            resource_type (str): The type of the resource (e.g., 'project', 'folder', 'team', 'acl').
+            properties (dict, optional): The new properties to set for the resource. Defaults to None.
+            content_hash (str, optional): The hash of the configuration the properties came from.
+                Defaults to the hash of the properties.
+        """
+        content_hash = content_hash or hash_resource(resource_type, properties)
+        with self._lock:
+            resource = self.get(logical_name, resource_type)
+            if resource is not None:
+                resource["properties"] = properties
+                resource["hash"] = content_hash
+            self._record(
+                {
+                    "op": "update",
+                    "type": resource_type,
+                    "name": logical_name,
+                    "properties": properties,
+                    "hash": content_hash,
+                }
+            )
+
+    def set_subtree_hashes(self, subtree_hashes: dict):
+        """
+        Records the hash of the configuration subtree rooted at each resource.
+
+        Args:
+            subtree_hashes (dict): A dictionary mapping (type, logical name) to the subtree
+                hash, or to None to forget a previously recorded hash.
+        """
+        with self._lock:
+            for (resource_type, logical_name), subtree_hash in subtree_hashes.items():
+                resource = self.get(logical_name, resource_type)
+                if resource is not None:
+                    resource["subtree_hash"] = subtree_hash
+            self._record(
+                {
+                    "op": "subtree_hashes",
+                    "hashes": [
+                        [resource_type, logical_name, subtree_hash]
+                        for (
+                            resource_type,
+                            logical_name,
+                        ), subtree_hash in subtree_hashes.items()
+                    ],
+                }
+            )
+
+    def remove(self, resources: list):
+        """
+        Removes resources from the state.
+
+        Args:
+            resources (list): The (type, logical name) of each resource to remove.
+        """
+        with self._lock:
+            for resource_type, logical_name in resources:
+                self._unindex(resource_type, logical_name)
+            self._record(
+                {"op": "remove", "resources": [list(key) for key in resources]}
+            )
+
+    def clear(self) -> str:
+        """Clear the state"""
+        with self._lock:
+            self.resources = []
+            self._record({"op": "clear"})
+
+
+# State backends by file suffix.  A backend takes the path of the state and provides
+# the same methods as `State`.
+STATE_BACKENDS = {
+    ".json": "synapseformation.state:State",
+    ".db": "synapseformation.sqlite_state:SqliteState",
+    ".sqlite": "synapseformation.sqlite_state:SqliteState",
+}
+
+
+def open_state(path: str = None):
+    """
+    Opens the state with the backend registered for its file suffix.
+
+    Args:
+        path (str, optional): Path of the state. Defaults to the SQLite state if one
+            exists in the working directory, otherwise the JSON state.
+
+    Returns:
+        State: The state, or another backend providing the same methods.
+    """
+    if path is None:
+        if not Path(DEFAULT_SQLITE_STATE).exists():
+            return State()
+        path = DEFAULT_SQLITE_STATE
+    backend = STATE_BACKENDS.get(Path(path).suffix)
+    if backend is None:
+        raise ValueError(f"No state backend for {path}")
+    module_name, class_name = backend.split(":")
+    return getattr(importlib.import_module(module_name), class_name)(path)
@@ -1,5 +1,43 @@
 """Utility functions"""
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
 import yaml
+from yaml.events import (
+    AliasEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+# libyaml is used when PyYAML was built with it and orjson when it is installed
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeDumper, SafeLoader
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# mkstemp creates files only readable by their owner, so atomically written files are
+# given the permissions a plain open() would, read once while the process starts
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _load_json(template_f) -> dict:
+    if orjson is not None:
+        return orjson.loads(template_f.read())
+    return json.load(template_f)
 
 
 def read_config(template_path: str) -> dict:
@@ -11,8 +49,345 @@ def read_config(template_path: str) -> dict:
     Returns:
         Configuration
     """
+    if str(template_path).endswith(".json"):
+        with open(template_path, "rb") as template_f:
+            return _load_json(template_f)
     # JSON is technically yaml but not the other way around.
-    # yaml.safe_load can actually read in json files.
-    with open(template_path, "r") as template_f:
-        config = yaml.safe_load(template_f)
+    # The resources are streamed so that the yaml nodes of the whole document are
+    # never held in memory at once, only the configuration built from them.
+    config = {}
+    for name, resource in iter_resources(template_path, config):
+        config["resources"][name] = resource
     return config
+
+
+def _compose_node(loader, anchors: dict):
+    """Build the node starting at the next event, like yaml.composer.Composer"""
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        return anchors[event.anchor]
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(MappingEndEvent):
+            key = _compose_node(loader, anchors)
+            node.value.append((key, _compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def iter_resources(template_path: str, config: dict = None):
+    """Stream the resources of a yaml or json configuration
+
+    The template is parsed event by event, so only one resource is held in memory at
+    a time instead of the whole document.  The result can be passed to
+    `get_resources` or `dict`.
+
+    Args:
+        template_path: Path to yaml or json configuration
+        config: If given, the other top-level entries of the template are stored in
+            it, and a "resources" mapping is stored as an empty dictionary for the
+            caller to add the streamed resources to
+
+    Yields:
+        The logical name and definition of each resource
+    """
+    with open(template_path, "r") as template_f:
+        loader = SafeLoader(template_f)
+        try:
+            # Stream and document start, then the top-level mapping
+            loader.get_event()
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()
+            if not loader.check_event(MappingStartEvent):
+                raise ValueError("The template must be a mapping")
+            loader.get_event()
+            anchors = {}
+            while not loader.check_event(MappingEndEvent):
+                key = loader.construct_document(_compose_node(loader, anchors))
+                if key != "resources" or not loader.check_event(MappingStartEvent):
+                    # An empty "resources:" has no entries to stream
+                    value = _compose_node(loader, anchors)
+                    if config is not None:
+                        config[key] = loader.construct_document(value)
+                    continue
+                if config is not None:
+                    config[key] = {}
+                loader.get_event()
+                while not loader.check_event(MappingEndEvent):
+                    name = loader.construct_document(_compose_node(loader, anchors))
+                    resource = loader.construct_document(_compose_node(loader, anchors))
+                    yield name, resource
+                loader.get_event()
+        finally:
+            loader.dispose()
+
+
+def _substitute(value, variables: dict):
+    """Replace the {placeholders} in every string of a value"""
+    if isinstance(value, str):
+        if "{" not in value:
+            return value
+        try:
+            return value.format_map(variables)
+        except KeyError as e:
+            raise ValueError(f"Unknown template variable {e} in {value!r}") from None
+    if isinstance(value, list):
+        return [_substitute(item, variables) for item in value]
+    if isinstance(value, dict):
+        return {
+            _substitute(key, variables): _substitute(item, variables)
+            for key, item in value.items()
+        }
+    return value
+
+
+def _for_each_bindings(for_each):
+    """The variables bound by each iteration of a for_each"""
+    if isinstance(for_each, int):
+        for index in range(for_each):
+            yield {"each": index}
+    elif isinstance(for_each, dict):
+        for key, value in for_each.items():
+            fields = value if isinstance(value, dict) else {}
+            yield {**fields, "key": key, "each": value}
+    else:
+        for value in for_each:
+            fields = value if isinstance(value, dict) else {}
+            yield {**fields, "each": value}
+
+
+def expand_resources(
+    resource_config: dict,
+    modules: dict = None,
+    base_dir=".",
+    variables: dict = None,
+    included: list = None,
+):
+    """Lazily expand the modules, loops and includes of a template's resources
+
+    Besides plain resources, the "resources" mapping can contain:
+
+    - `module: <name>` with optional `vars:`, expanding to the resources of the module
+      defined under the template's top-level `modules:` mapping.
+    - `for_each:` on any entry, repeating it for every item of a list, every entry of
+      a mapping (bound to `{key}`), or every number below an integer. Each item is
+      bound to `{each}`, and the fields of mapping items to their own names.
+    - `include: <path>`, expanding to the resources and modules of another template,
+      relative to the including one.
+
+    Inside a module or a `for_each`, strings in logical names and properties can use
+    `{variable}` placeholders for the variables in scope, and literal braces are
+    written `{{` and `}}`.  Resources outside of them are left unchanged.  Resources
+    are generated one at a time, so the expanded template is never built in memory.
+
+    Args:
+        resource_config: The "resources" mapping of a template
+        modules: The "modules" mapping of the template
+        base_dir: Directory that includes are relative to
+        variables: The variables in scope, or None outside of any module or loop
+        included: If given, the path of every included template is appended to it
+
+    Yields:
+        The logical name and definition of each resource
+    """
+    modules = modules or {}
+    scoped = variables is not None
+    variables = variables or {}
+    for name, resource in resource_config.items():
+        if "for_each" in resource:
+            body = {key: value for key, value in resource.items() if key != "for_each"}
+            for_each = _substitute(resource["for_each"], variables)
+            for bindings in _for_each_bindings(for_each):
+                yield from expand_resources(
+                    {name: body},
+                    modules,
+                    base_dir,
+                    {**variables, **bindings},
+                    included,
+                )
+        elif "module" in resource:
+            module_name = _substitute(resource["module"], variables)
+            if module_name not in modules:
+                raise ValueError(f"{name}: unknown module {module_name!r}")
+            module_vars = _substitute(resource.get("vars") or {}, variables)
+            yield from expand_resources(
+                modules[module_name].get("resources") or {},
+                modules,
+                base_dir,
+                {**variables, **module_vars},
+                included,
+            )
+        elif "include" in resource:
+            path = Path(base_dir) / _substitute(resource["include"], variables)
+            if included is not None:
+                included.append(path)
+            template = read_config(path) or {}
+            yield from expand_resources(
+                template.get("resources") or {},
+                {**modules, **(template.get("modules") or {})},
+                path.parent,
+                variables if scoped else None,
+                included,
+            )
+        elif scoped:
+            yield _substitute(name, variables), _substitute(resource, variables)
+        else:
+            yield name, resource
+
+
+# Number of IDs sent per bulk entity header or team list request
+BATCH_SIZE = 100
+
+
+def batches(items: list, size: int = BATCH_SIZE):
+    """Split a list into lists of at most `size` items
+
+    Args:
+        items: The list to split
+        size: The maximum number of items per batch
+    """
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def dump_yaml(data: dict, indent: int = 0) -> str:
+    """Render a mapping as block style yaml, keeping the order of its keys
+
+    Args:
+        data: The mapping to render
+        indent: Number of spaces to indent every line by
+
+    Returns:
+        The yaml, which can be appended to a file being streamed
+    """
+    text = yaml.dump(data, Dumper=SafeDumper, sort_keys=False, allow_unicode=True)
+    return "".join(" " * indent + line for line in text.splitlines(keepends=True))
+
+
+@contextmanager
+def open_atomic(path: Path, mode: str = "w"):
+    """Open a temporary file in the same directory that replaces `path` on success
+
+    Args:
+        path: Path of the file to write
+        mode: Mode to open the temporary file with
+
+    Yields:
+        The open temporary file
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def _write_atomic(path: Path, write, mode: str):
+    """Write a file through a temporary file in the same directory and rename it"""
+    with open_atomic(path, mode) as f:
+        write(f)
+
+
+def write_json_atomic(path: Path, data, indent: int = None):
+    """Write JSON to a file so that readers only ever see the old or the new content
+
+    Args:
+        path: Path of the file to write
+        data: JSON serializable data
+        indent: Indentation passed to json.dump
+    """
+    _write_atomic(path, lambda f: json.dump(data, f, indent=indent), "w")
+
+
+def write_bytes_atomic(path: Path, data: bytes):
+    """Write bytes to a file so that readers only ever see the old or the new content
+
+    Args:
+        path: Path of the file to write
+        data: The content of the file
+    """
+    _write_atomic(path, lambda f: f.write(data), "wb")
+
+
+def file_hash(path: Path) -> str:
+    """The SHA-256 hex digest of a file's content
+
+    Args:
+        path: Path of the file to hash
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _json_key(key) -> str:
+    """The string a mapping key is written as in JSON"""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    return str(key)
+
+
+def _string_keys(value):
+    """Convert the mapping keys nested in a value to the strings JSON writes them as"""
+    if isinstance(value, dict):
+        return {_json_key(key): _string_keys(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_string_keys(item) for item in value]
+    return value
+
+
+def hash_resource(resource_type: str, properties: dict) -> str:
+    """
+    Returns a stable content hash of a resource's type and properties.
+
+    Keys are hashed as the strings JSON writes them as, since yaml allows mixing int
+    and string keys, which cannot be sorted, and a state file reads them back as
+    strings.
+
+    Args:
+        resource_type (str): The type of the resource.
+        properties (dict): The properties of the resource as defined in the configuration.
+
+    Returns:
+        str: The hex digest of the hash.
+    """
+    data = json.dumps(
+        {"type": resource_type, "properties": _string_keys(properties)},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
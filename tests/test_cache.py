@@ -0,0 +1,119 @@
+"""Test the on-disk remote cache"""
+
+import json
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock, patch
+
+from synapseformation.cache import RemoteCache
+from synapseformation.client import State, plan_config
+
+
+def test_cache_round_trip():
+    """Test that cached entries are saved and loaded"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = Path(tmpdir) / "cache.json"
+        cache = RemoteCache(path=cache_path)
+        cache.put("syn1", {"type": "folder", "name": "F", "modifiedOn": "t1"})
+        cache.save()
+
+        reloaded = RemoteCache(path=cache_path)
+        assert reloaded.get("syn1")["name"] == "F"
+        # Entries loaded from disk must be revalidated before they are trusted
+        assert not reloaded.is_fresh("syn1")
+
+
+def test_cache_evicts_least_recently_used():
+    """Test that the cache stays bounded"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = RemoteCache(path=Path(tmpdir) / "cache.json", max_entries=2)
+        cache.put("syn1", {"name": "1"})
+        cache.put("syn2", {"name": "2"})
+        cache.get("syn1")
+        cache.put("syn3", {"name": "3"})
+
+        assert len(cache) == 2
+        assert cache.get("syn2") is None
+        assert not cache.is_fresh("syn2")
+        assert cache.get("syn1") is not None
+
+
+def test_cache_revalidate():
+    """Test that only entities with an unchanged modifiedOn are fresh"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = RemoteCache(path=Path(tmpdir) / "cache.json")
+        cache.put("syn1", {"name": "1", "modifiedOn": "t1"}, fresh=False)
+        cache.put("syn2", {"name": "2", "modifiedOn": "t1"}, fresh=False)
+        syn = Mock()
+        syn.rest_post_async = AsyncMock(
+            side_effect=lambda uri, body: {
+                "/entity/header": {
+                    "results": [
+                        {"id": "syn1", "modifiedOn": "t1"},
+                        {"id": "syn2", "modifiedOn": "t2"},
+                    ]
+                },
+                "/teamList": {"list": [{"id": "789", "name": "Team", "etag": "e"}]},
+            }[uri]
+        )
+
+        cache.revalidate(
+            syn,
+            [
+                {"type": "folder", "id": "syn1"},
+                {"type": "project", "id": "syn2"},
+                {"type": "acl", "id": "syn2"},
+                {"type": "team", "id": "789"},
+            ],
+        )
+
+        assert cache.is_fresh("syn1")
+        assert not cache.is_fresh("syn2")
+        assert cache.is_fresh("789")
+        assert cache.get("789")["name"] == "Team"
+        headers_body = json.loads(syn.rest_post_async.call_args_list[0].args[1])
+        assert headers_body == {
+            "references": [{"targetId": "syn1"}, {"targetId": "syn2"}]
+        }
+
+
+@patch("synapseformation.client.Folder")
+def test_plan_config_fetches_only_changed(mock_folder_class, tmp_path, monkeypatch):
+    """Test that plan only fetches entities that changed since they were cached"""
+    remote_folder = Mock()
+    remote_folder.name = "Renamed"
+    remote_folder.etag = "etag2"
+    remote_folder.modified_on = "t2"
+    mock_folder_class.return_value.get_async = AsyncMock(return_value=remote_folder)
+
+    monkeypatch.chdir(tmp_path)
+    state = State()
+    state.resources = [
+        {"type": "folder", "name": "f1", "id": "syn1", "properties": {"name": "F1"}},
+        {"type": "folder", "name": "f2", "id": "syn2", "properties": {"name": "F2"}},
+    ]
+    state.save()
+    syn = Mock()
+    syn.rest_post_async = AsyncMock(
+        return_value={
+            "results": [
+                {"id": "syn1", "modifiedOn": "t1"},
+                {"id": "syn2", "modifiedOn": "t2"},
+            ]
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = Path(tmpdir) / "cache.json"
+        cache = RemoteCache(path=cache_path)
+        cache.put("syn1", {"type": "folder", "name": "F1", "modifiedOn": "t1"})
+        cache.put("syn2", {"type": "folder", "name": "F2", "modifiedOn": "t1"})
+        cache.save()
+
+        result = plan_config(
+            {"resources": {}}, syn, remote_cache=RemoteCache(path=cache_path)
+        )
+
+        mock_folder_class.assert_called_once_with(id="syn2")
+        assert result["drift"][0]["name"] == "f2"
+        assert RemoteCache(path=cache_path).get("syn2")["name"] == "Renamed"
@@ -2,26 +2,48 @@ import pytest
 import json
 import tempfile
 from pathlib import Path
-from unittest.mock import Mock, patch, MagicMock, mock_open
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch, MagicMock, mock_open
 from collections import defaultdict
+from functools import partial
 
+from synapseformation import planner
+from synapseformation.planner import record_subtree_hashes
 from synapseformation.client import (
     State,
+    Resource,
     apply_project,
     apply_folder,
+    apply_folder_async,
+    ChildFolders,
     apply_team,
+    apply_team_async,
     apply_acl,
+    apply_acls,
+    revoke_acls,
     sort_folders,
+    get_dependencies,
+    build_dependency_graph,
+    dependency_closure,
+    topological_sort,
+    run_graph_async,
     get_resources,
+    hash_resource,
+    subtree_hashes,
     plan_config,
+    diff_properties,
     apply_config,
+    apply_plan,
     destroy_resources,
+    build_destroy_graph,
     initialize,
     export,
     sync_drift,
+    AclCache,
 )
 from synapseclient.models import Project, Folder, Team
 from synapseclient import Synapse
+from synapseclient.core.exceptions import SynapseHTTPError
 
 
 class TestState:
@@ -86,6 +108,55 @@ class TestState:
             result = state.get_id("nonexistent", "project")
             assert result is None
 
+    def test_state_get_by_name_and_id(self):
+        """Test the (type, name) and Synapse ID indexes"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+            state.resources = [
+                {"type": "folder", "name": "raw", "id": "syn456"},
+                {"type": "acl", "name": "raw_acl", "id": "syn456"},
+            ]
+
+            assert state.get("raw", "folder")["id"] == "syn456"
+            assert state.get("raw", "acl") is None
+            assert [r["type"] for r in state.get_by_id("syn456")] == ["folder", "acl"]
+            assert state.get_by_id("syn999") == []
+
+    @patch.object(State, "save")
+    def test_state_index_consistent(self, mock_save):
+        """Test that add, update_properties and clear keep the indexes consistent"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+
+            state.add("project", "test_project", "syn123", {"name": "Test Project"})
+            assert state.get_id("test_project", "project") == "syn123"
+            assert state.get_by_id("syn123")[0]["name"] == "test_project"
+
+            state.update_properties("test_project", "project", {"name": "New"})
+            assert state.get("test_project", "project")["properties"] == {"name": "New"}
+
+            state.clear()
+            assert state.get_id("test_project", "project") is None
+            assert state.get_by_id("syn123") == []
+
+    def test_state_remove(self, tmp_path):
+        """Test that remove keeps the list, the indexes and the state file consistent"""
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("project", "p", "syn1", {"name": "P"})
+        state.add("acl", "p_acl", "syn1", {"resource": "project.p", "grants": []})
+        state.add("team", "t", 3, {"name": "T"})
+
+        state.remove([("acl", "p_acl"), ("folder", "missing")])
+
+        assert state.get("p_acl", "acl") is None
+        assert [entry["name"] for entry in state.get_by_id("syn1")] == ["p"]
+        assert [entry["name"] for entry in state.resources] == ["p", "t"]
+        state.remove([("project", "p")])
+        assert state.get_by_id("syn1") == []
+        assert [entry["name"] for entry in State(state.path).resources] == ["t"]
+
     @patch.object(State, "save")
     def test_state_add(self, mock_save):
         """Test adding a resource to state"""
@@ -148,6 +219,115 @@ class TestState:
             assert state.resources == []
             mock_save.assert_called_once()
 
+    def test_state_transaction_saves_once(self):
+        """Test that a transaction buffers mutations and saves at the end"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+
+            with patch.object(State, "save") as mock_save:
+                with state.transaction():
+                    state.add("project", "p1", "syn1", {"name": "P1"})
+                    state.add("folder", "f1", "syn2", {"name": "F1"})
+                    state.update_properties("p1", "project", {"name": "P2"})
+                    mock_save.assert_not_called()
+                mock_save.assert_called_once()
+            assert not state.journal_path.exists()
+
+    def test_state_transaction_checkpoint_every(self):
+        """Test saving at checkpoints inside a transaction"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+
+            with patch.object(State, "save") as mock_save:
+                with state.transaction(checkpoint_every=2):
+                    for i in range(5):
+                        state.add("folder", f"f{i}", f"syn{i}")
+                # Two checkpoints plus the final save
+                assert mock_save.call_count == 3
+
+    def test_state_journal_replayed_on_load(self):
+        """Test that mutations journaled before a crash are replayed"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+            state.add("project", "p1", "syn1", {"name": "P1"})
+
+            # Simulate a crash inside of a transaction: the journal is written
+            # but the state file is never checkpointed
+            state._journal = open(state.journal_path, "a")
+            state.add("folder", "f1", "syn2", {"name": "F1"})
+            state.update_properties("p1", "project", {"name": "P2"})
+            state._journal.write('{"op": "add", "reso')
+            state._journal.close()
+
+            reloaded = State(path=str(state_path))
+            assert reloaded.get_id("f1", "folder") == "syn2"
+            assert reloaded.get("p1", "project")["properties"] == {"name": "P2"}
+            # The replayed mutations are saved and the journal is not replayed again
+            assert not reloaded.journal_path.exists()
+            with open(state_path, "r") as f:
+                assert len(json.load(f)["resources"]) == 2
+            reloaded.remove([("folder", "f1")])
+            assert State(path=str(state_path)).get("f1", "folder") is None
+
+    def test_state_save_atomic(self):
+        """Test that a failed save leaves the previous state file intact"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+            state.add("project", "p1", "syn1")
+
+            state.resources[0]["properties"] = {"bad": object()}
+            with pytest.raises(TypeError):
+                state.save()
+
+            with open(state_path, "r") as f:
+                assert json.load(f)["resources"][0]["properties"] == {}
+            assert list(Path(tmpdir).iterdir()) == [state_path]
+
+    def test_state_resources_round_trip(self):
+        """Test compact state entries are written back exactly as they were read"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            resources = [
+                {"type": "project", "name": "p1", "id": "syn1"},
+                {
+                    "type": "folder",
+                    "name": "f1",
+                    "id": "syn2",
+                    "properties": {"name": "F1", "parent": "project.p1"},
+                    "hash": "abc",
+                    "subtree_hash": "def",
+                    "future_field": [1],
+                },
+            ]
+            with open(state_path, "w") as f:
+                json.dump({"version": 1, "resources": resources}, f)
+
+            state = State(path=str(state_path))
+            assert state.resources == resources
+            assert isinstance(state.resources[0], Resource)
+            state.save()
+            with open(state_path, "r") as f:
+                assert json.load(f)["resources"] == resources
+
+    def test_resource_interns_strings(self):
+        """Test repeated strings of state entries share one object"""
+        first = Resource(type="folder", name="f1", properties={"parent": "".join("p1")})
+        second = Resource(
+            type="folder", name="f2", properties={"parent": "".join("p1")}
+        )
+
+        assert first["properties"]["parent"] is second["properties"]["parent"]
+        assert not hasattr(first, "__dict__")
+        first["hash"] = "abc"
+        del first["hash"]
+        assert first.get("hash") is None
+        with pytest.raises(KeyError):
+            first["id"]
+
 
 class TestApplyFunctions:
     """Test cases for apply_* functions"""
@@ -157,7 +337,9 @@ class TestApplyFunctions:
         """Test applying a new project"""
         mock_project_instance = Mock()
         mock_project_instance.id = "syn123"
-        mock_project_instance.store.return_value = mock_project_instance
+        mock_project_instance.store_async = AsyncMock(
+            return_value=mock_project_instance
+        )
         mock_project_class.return_value = mock_project_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -169,14 +351,14 @@ class TestApplyFunctions:
 
             assert result == mock_project_instance
             mock_project_class.assert_called_with(name="Test Project")
-            mock_project_instance.store.assert_called_once()
+            mock_project_instance.store_async.assert_called_once()
             assert len(state.resources) == 1
 
     @patch("synapseformation.client.Project")
     def test_apply_project_existing(self, mock_project_class):
         """Test applying an existing project"""
         mock_project_instance = Mock()
-        mock_project_instance.get.return_value = mock_project_instance
+        mock_project_instance.get_async = AsyncMock(return_value=mock_project_instance)
         mock_project_class.return_value = mock_project_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -191,14 +373,14 @@ class TestApplyFunctions:
 
             assert result == mock_project_instance
             mock_project_class.assert_called_with(id="syn123")
-            mock_project_instance.get.assert_called_once()
+            mock_project_instance.get_async.assert_called_once()
 
     @patch("synapseformation.client.Folder")
     def test_apply_folder_new(self, mock_folder_class):
         """Test applying a new folder"""
         mock_folder_instance = Mock()
         mock_folder_instance.id = "syn456"
-        mock_folder_instance.store.return_value = mock_folder_instance
+        mock_folder_instance.store_async = AsyncMock(return_value=mock_folder_instance)
         mock_folder_class.return_value = mock_folder_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -213,13 +395,13 @@ class TestApplyFunctions:
 
             assert result == mock_folder_instance
             mock_folder_class.assert_called_with(name="Test Folder", parent_id="syn123")
-            mock_folder_instance.store.assert_called_once()
+            mock_folder_instance.store_async.assert_called_once()
 
     @patch("synapseformation.client.Folder")
     def test_apply_folder_existing(self, mock_folder_class):
         """Test applying an existing folder"""
         mock_folder_instance = Mock()
-        mock_folder_instance.get.return_value = mock_folder_instance
+        mock_folder_instance.get_async = AsyncMock(return_value=mock_folder_instance)
         mock_folder_class.return_value = mock_folder_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -234,14 +416,54 @@ class TestApplyFunctions:
 
             assert result == mock_folder_instance
             mock_folder_class.assert_called_with(id="syn456")
-            mock_folder_instance.get.assert_called_once()
+            mock_folder_instance.get_async.assert_called_once()
+
+    @patch("synapseformation.client.get_children")
+    @patch("synapseformation.client.Folder")
+    def test_apply_folder_adopts_existing(self, mock_folder_class, mock_get_children):
+        """Test existing folders are adopted from one listing of their parent"""
+        listed = []
+
+        async def get_children(parent, include_types, synapse_client):
+            listed.append(parent)
+            yield {"name": "Raw", "id": "syn1"}
+
+        mock_get_children.side_effect = get_children
+        created = Mock()
+        created.id = "syn2"
+        mock_folder_class.return_value.store_async = AsyncMock(return_value=created)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state = State(path=str(Path(tmpdir) / "state.json"))
+            state.resources = [{"type": "project", "name": "project1", "id": "syn123"}]
+
+            async def apply_folders():
+                children = ChildFolders()
+                await asyncio.gather(
+                    *(
+                        apply_folder_async(
+                            name,
+                            {"name": remote_name, "parent": "project.project1"},
+                            state,
+                            children=children,
+                        )
+                        for name, remote_name in [("raw", "Raw"), ("docs", "Docs")]
+                    )
+                )
+
+            asyncio.run(apply_folders())
+
+            assert listed == ["syn123"]
+            assert state.get_id("raw", "folder") == "syn1"
+            assert state.get_id("docs", "folder") == "syn2"
+            mock_folder_class.return_value.store_async.assert_called_once()
 
     @patch("synapseformation.client.Team")
     def test_apply_team_new(self, mock_team_class):
         """Test applying a new team"""
         mock_team_instance = Mock()
         mock_team_instance.id = "789"
-        mock_team_instance.create.return_value = mock_team_instance
+        mock_team_instance.create_async = AsyncMock(return_value=mock_team_instance)
         mock_team_class.return_value = mock_team_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -253,13 +475,13 @@ class TestApplyFunctions:
 
             assert result == mock_team_instance
             mock_team_class.assert_called_with(name="Test Team")
-            mock_team_instance.create.assert_called_once()
+            mock_team_instance.create_async.assert_called_once()
 
     @patch("synapseformation.client.Team")
     def test_apply_team_existing(self, mock_team_class):
         """Test applying an existing team"""
         mock_team_instance = Mock()
-        mock_team_instance.get.return_value = mock_team_instance
+        mock_team_instance.get_async = AsyncMock(return_value=mock_team_instance)
         mock_team_class.return_value = mock_team_instance
 
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -272,13 +494,16 @@ class TestApplyFunctions:
 
             assert result == mock_team_instance
             mock_team_class.assert_called_with(id="789")
-            mock_team_instance.get.assert_called_once()
+            mock_team_instance.get_async.assert_called_once()
 
     @patch("synapseformation.client.Folder")
     def test_apply_acl_new(self, mock_folder_class):
         """Test applying ACL to a resource"""
         mock_folder_instance = Mock()
-        mock_folder_class.return_value.get.return_value = mock_folder_instance
+        mock_folder_instance.set_permissions_async = AsyncMock()
+        mock_folder_class.return_value.get_async = AsyncMock(
+            return_value=mock_folder_instance
+        )
 
         with tempfile.TemporaryDirectory() as tmpdir:
             state_path = Path(tmpdir) / "state.json"
@@ -304,10 +529,81 @@ class TestApplyFunctions:
             result = apply_acl(acl, state)
 
             assert result == "syn456"
-            mock_folder_instance.set_permissions.assert_called_once_with(
-                principal_id="789", access_type=["READ", "DOWNLOAD"]
+            mock_folder_instance.set_permissions_async.assert_called_once_with(
+                principal_id="789",
+                access_type=["READ", "DOWNLOAD"],
+                synapse_client=None,
             )
 
+    def test_apply_acls_one_write_per_entity(self):
+        """Test that ACLs targeting the same entity are merged into one write"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = Path(tmpdir) / "state.json"
+            state = State(path=str(state_path))
+            state.resources = [
+                {"type": "folder", "name": "test_folder", "id": "syn456"},
+                {"type": "team", "name": "team1", "id": "111"},
+                {"type": "team", "name": "team2", "id": "222"},
+            ]
+            acls = [
+                {
+                    "name": "acl1",
+                    "properties": {
+                        "resource": "folder.test_folder",
+                        "grants": [
+                            {"principal": "team.team1", "access_type": ["READ"]},
+                            {"principal": "team.team2", "access_type": ["READ"]},
+                        ],
+                    },
+                },
+                {
+                    "name": "acl2",
+                    "properties": {
+                        "resource": "folder.test_folder",
+                        "grants": [
+                            {"principal": "team.team1", "access_type": ["DOWNLOAD"]}
+                        ],
+                    },
+                },
+            ]
+            syn = Mock()
+            syn.rest_put_async = AsyncMock()
+            syn.rest_post_async = AsyncMock()
+            syn.rest_get_async = AsyncMock(
+                side_effect=lambda uri: {
+                    "/entity/syn456/benefactor": {"id": "syn123"},
+                    "/entity/syn123/acl": {
+                        "id": "syn123",
+                        "etag": "etag",
+                        "resourceAccess": [
+                            {"principalId": 333, "accessType": ["READ"]}
+                        ],
+                    },
+                }[uri]
+            )
+
+            result = apply_acls(acls, state, syn=syn)
+
+            assert result == {"acl1": "syn456", "acl2": "syn456"}
+            syn.rest_put_async.assert_not_called()
+            syn.rest_post_async.assert_called_once()
+            uri, body = syn.rest_post_async.call_args.args
+            assert uri == "/entity/syn456/acl"
+            assert json.loads(body) == {
+                "id": "syn456",
+                "resourceAccess": [
+                    {"principalId": 333, "accessType": ["READ"]},
+                    {"principalId": 111, "accessType": ["DOWNLOAD", "READ"]},
+                    {"principalId": 222, "accessType": ["READ"]},
+                ],
+            }
+            assert (
+                state.get("acl1", "acl")["properties"]["grants"][0]["principal"]
+                == "111"
+            )
+            # The configuration is left untouched
+            assert acls[0]["properties"]["grants"][0]["principal"] == "team.team1"
+
     @patch("synapseformation.client.Project")
     def test_apply_acl_existing(self, mock_project_class):
         """Test applying ACL that already exists"""
@@ -364,6 +660,125 @@ class TestUtilityFunctions:
         with pytest.raises(ValueError, match="Cycle detected"):
             sort_folders(folders)
 
+    def test_get_dependencies(self):
+        """Test references a resource depends on"""
+        folder = {"type": "folder", "properties": {"parent": "project.root"}}
+        acl = {
+            "type": "acl",
+            "properties": {
+                "resource": "folder.raw",
+                "grants": [{"principal": "team.t1"}, {"principal": "team.t2"}],
+            },
+        }
+        project = {"type": "project", "properties": {"name": "Project"}}
+
+        assert get_dependencies(folder) == ["project.root"]
+        assert get_dependencies(acl) == ["folder.raw", "team.t1", "team.t2"]
+        assert get_dependencies(project) == []
+
+    def test_build_dependency_graph(self):
+        """Test building the dependency graph of a configuration"""
+        config = {
+            "team1": {"type": "team", "properties": {"name": "Team 1"}},
+            "project1": {"type": "project", "properties": {"name": "Project 1"}},
+            "folder1": {
+                "type": "folder",
+                "properties": {"name": "Folder 1", "parent": "project.project1"},
+            },
+            "folder2": {
+                "type": "folder",
+                "properties": {"name": "Folder 2", "parent": "project.external"},
+            },
+            "acl1": {
+                "type": "acl",
+                "properties": {
+                    "resource": "folder.folder1",
+                    "grants": [{"principal": "team.team1"}],
+                },
+            },
+        }
+
+        result = build_dependency_graph(config)
+
+        assert result == {
+            "team1": set(),
+            "project1": set(),
+            "folder1": {"project1"},
+            "folder2": set(),
+            "acl1": {"folder1", "team1"},
+        }
+
+    def test_topological_sort_cycle_detection(self):
+        """Test cycle detection in the dependency graph"""
+        with pytest.raises(ValueError, match="Cycle detected"):
+            topological_sort({"a": {"b"}, "b": {"a"}})
+
+    def test_run_graph_respects_dependencies(self):
+        """Test that nodes only run after their dependencies complete"""
+        graph = {
+            "project": set(),
+            "parent": {"project"},
+            "child1": {"parent"},
+            "child2": {"parent"},
+            "team": set(),
+            "acl": {"child1", "team"},
+        }
+        completed = []
+
+        async def func(node):
+            completed.append(node)
+
+        asyncio.run(run_graph_async(graph, func, parallelism=4))
+
+        assert sorted(completed) == sorted(graph)
+        for node, dependencies in graph.items():
+            for dependency in dependencies:
+                assert completed.index(dependency) < completed.index(node)
+
+    def test_run_graph_runs_siblings_concurrently(self):
+        """Test that independent nodes run at the same time"""
+        started = []
+        all_started = asyncio.Event()
+        graph = {"a": set(), "b": set(), "c": set()}
+
+        async def func(node):
+            started.append(node)
+            if len(started) == len(graph):
+                all_started.set()
+            await asyncio.wait_for(all_started.wait(), timeout=5)
+
+        asyncio.run(run_graph_async(graph, func, parallelism=3))
+
+    def test_run_graph_stops_on_error(self):
+        """Test that dependents of a failed node are not run"""
+        graph = {"parent": set(), "child": {"parent"}}
+        completed = []
+
+        async def func(node):
+            if node == "parent":
+                raise RuntimeError("failed")
+            completed.append(node)
+
+        with pytest.raises(RuntimeError, match="failed"):
+            asyncio.run(run_graph_async(graph, func))
+        assert completed == []
+
+    def test_run_graph_async_limits_concurrency(self):
+        """Test that no more than `parallelism` nodes run at once"""
+        graph = {f"node{i}": set() for i in range(6)}
+        running = []
+        peak = []
+
+        async def func(node):
+            running.append(node)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(node)
+
+        asyncio.run(run_graph_async(graph, func, parallelism=2))
+        assert len(peak) == 6
+        assert max(peak) == 2
+
     def test_get_resources(self):
         """Test getting resources organized by type"""
         config = {
@@ -379,22 +794,30 @@ class TestUtilityFunctions:
         assert result["project"][0]["name"] == "project1"
         assert result["project"][0]["properties"]["name"] == "Project 1"
 
+    def test_get_resources_streamed(self):
+        """Test resources and folders can be consumed from a generator"""
+        streamed = (
+            (name, {"type": "folder", "properties": {"parent": parent}})
+            for name, parent in [("child", "folder.root"), ("root", "project.p")]
+        )
+
+        folders = get_resources(streamed)["folder"]
+
+        assert sort_folders(iter(folders)) == ["root", "child"]
+
 
 class TestPlanConfig:
     """Test cases for plan_config function"""
 
-    @patch("synapseformation.client.State")
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
     @patch("synapseformation.client.Team")
     @patch("synapseformation.client.Project")
     @patch("synapseformation.client.Folder")
-    def test_plan_config_new_resources(
-        self, mock_folder, mock_project, mock_team, mock_state_class
-    ):
+    def test_plan_config_new_resources(self, mock_folder, mock_project, mock_team):
         """Test planning config with new resources"""
-        mock_state = Mock()
-        mock_state.resources = []
-        mock_state.get_id.return_value = None
-        mock_state_class.return_value = mock_state
 
         syn = Mock()
         config = {
@@ -410,24 +833,25 @@ class TestPlanConfig:
         assert result["changes"][0]["type"] == "project"
         assert result["changes"][0]["name"] == "project1"
 
-    @patch("synapseformation.client.State")
     @patch("synapseformation.client.Project")
-    def test_plan_config_deleted_resources(self, mock_project_class, mock_state_class):
+    def test_plan_config_deleted_resources(self, mock_project_class):
         """Test planning config with deleted resources"""
         mock_project_instance = Mock()
         mock_project_instance.name = "Deleted Project"
-        mock_project_class.return_value.get.return_value = mock_project_instance
+        mock_project_class.return_value.get_async = AsyncMock(
+            return_value=mock_project_instance
+        )
 
-        mock_state = Mock()
-        mock_state.resources = [
-            {
-                "type": "project",
-                "name": "deleted_project",
-                "id": "syn123",
-                "properties": {"name": "Deleted Project"},
-            }
-        ]
-        mock_state_class.return_value = mock_state
+        _saved_state(
+            [
+                {
+                    "type": "project",
+                    "name": "deleted_project",
+                    "id": "syn123",
+                    "properties": {"name": "Deleted Project"},
+                }
+            ]
+        )
 
         syn = Mock()
         config = {"resources": {}}
@@ -438,25 +862,25 @@ class TestPlanConfig:
         assert result["changes"][0]["action"] == "delete"
         assert result["changes"][0]["name"] == "deleted_project"
 
-    @patch("synapseformation.client.State")
     @patch("synapseformation.client.Team")
-    def test_plan_config_drift_detection(self, mock_team_class, mock_state_class):
+    def test_plan_config_drift_detection(self, mock_team_class):
         """Test drift detection in plan_config"""
         mock_team_instance = Mock()
         mock_team_instance.name = "Different Name"
-        mock_team_class.return_value.get.return_value = mock_team_instance
+        mock_team_class.return_value.get_async = AsyncMock(
+            return_value=mock_team_instance
+        )
 
-        mock_state = Mock()
-        mock_state.resources = [
-            {
-                "type": "team",
-                "name": "test_team",
-                "id": "789",
-                "properties": {"name": "Original Name"},
-            }
-        ]
-        mock_state.get_id.return_value = None
-        mock_state_class.return_value = mock_state
+        _saved_state(
+            [
+                {
+                    "type": "team",
+                    "name": "test_team",
+                    "id": "789",
+                    "properties": {"name": "Original Name"},
+                }
+            ]
+        )
 
         syn = Mock()
         config = {"resources": {}}
@@ -467,29 +891,295 @@ class TestPlanConfig:
         assert result["drift"][0]["type"] == "team"
         assert result["drift"][0]["synapse_properties"]["name"] == "Different Name"
 
+    @patch("synapseformation.client.Synapse")
+    @patch("synapseformation.client.Team")
+    def test_plan_config_offline(self, mock_team_class, mock_syn):
+        """Test an offline plan diffs the state without any Synapse calls"""
+        _saved_state(
+            [
+                {
+                    "type": "team",
+                    "name": "old_team",
+                    "id": "789",
+                    "properties": {"name": "Old"},
+                }
+            ]
+        )
+        config = {"resources": {"team1": {"type": "team", "properties": {"name": "T"}}}}
+
+        result = plan_config(config, remote=False)
+
+        assert [(c["name"], c["action"]) for c in result["changes"]] == [
+            ("team1", "create"),
+            ("old_team", "delete"),
+        ]
+        assert result["drift"] == []
+        mock_syn.get_client.assert_not_called()
+        mock_team_class.assert_not_called()
+
+    @patch("synapseformation.client.Folder")
+    def test_plan_config_drift_order_is_stable(self, mock_folder_class):
+        """Test drift is reported in state order regardless of fetch completion order"""
+        delays = {"syn0": 0.03, "syn1": 0.02, "syn2": 0.01}
+
+        def get_folder(id):
+            async def get_async(synapse_client=None):
+                # Later folders finish first
+                await asyncio.sleep(delays[id])
+                return folder
+
+            folder = Mock()
+            folder.name = f"Remote {id}"
+            folder.get_async = get_async
+            return folder
+
+        mock_folder_class.side_effect = get_folder
+
+        _saved_state(
+            [
+                {
+                    "type": "folder",
+                    "name": f"folder{i}",
+                    "id": f"syn{i}",
+                    "properties": {"name": f"Folder {i}"},
+                }
+                for i in range(3)
+            ]
+        )
+
+        result = plan_config({"resources": {}}, Mock(), parallelism=3)
+
+        assert [drift["name"] for drift in result["drift"]] == [
+            "folder0",
+            "folder1",
+            "folder2",
+        ]
+
+    def test_plan_config_acl_fetched_once_per_entity(self):
+        """Test that ACL drift fetches each entity's ACL once and compares grants locally"""
+        state = _saved_state(
+            [
+                {
+                    "type": "acl",
+                    "name": "acl1",
+                    "id": "syn456",
+                    "properties": {
+                        "grants": [
+                            {"principal": "111", "access_type": ["READ"]},
+                            {"principal": "222", "access_type": ["READ", "DOWNLOAD"]},
+                        ]
+                    },
+                },
+                {
+                    "type": "acl",
+                    "name": "acl2",
+                    "id": "syn456",
+                    "properties": {
+                        "grants": [{"principal": "333", "access_type": ["READ"]}]
+                    },
+                },
+            ]
+        )
+
+        responses = {
+            "/entity/syn456/benefactor": {"id": "syn456"},
+            "/entity/syn456/acl": {
+                "resourceAccess": [
+                    {"principalId": 111, "accessType": ["READ"]},
+                    {"principalId": 222, "accessType": ["READ"]},
+                ]
+            },
+        }
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(side_effect=lambda uri: responses[uri])
+
+        result = plan_config({"resources": {}}, syn)
+
+        assert syn.rest_get_async.call_count == 2
+        syn.get_acl.assert_not_called()
+        assert result["drift"] == [
+            {
+                "type": "acl",
+                "name": "acl1",
+                "synapse_properties": [{"principal": "222", "access_type": ["READ"]}],
+                "properties": state.resources[0]["properties"],
+            },
+            {
+                "type": "acl",
+                "name": "acl2",
+                "synapse_properties": [{"principal": "333", "access_type": []}],
+                "properties": state.resources[1]["properties"],
+            },
+        ]
+
+
+class TestAclCache:
+    """Test cases for the AclCache class"""
+
+    def test_acl_cache_shares_benefactor(self):
+        """Test entities inheriting from the same benefactor share one ACL fetch"""
+        responses = {
+            "/entity/syn1/benefactor": {"id": "syn100"},
+            "/entity/syn2/benefactor": {"id": "syn100"},
+            "/entity/syn100/acl": {
+                "resourceAccess": [{"principalId": 1, "accessType": ["READ"]}]
+            },
+        }
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(side_effect=lambda uri: responses[uri])
+        cache = AclCache(syn)
+
+        async def fetch_all():
+            return await asyncio.gather(
+                cache.get("syn1"), cache.get("syn2"), cache.get("syn1")
+            )
+
+        assert asyncio.run(fetch_all()) == [{"1": {"READ"}}] * 3
+        assert syn.rest_get_async.call_count == 3
+
+
+class TestIncrementalPlan:
+    """Test cases for content and subtree hashes"""
+
+    config = {
+        "project1": {"type": "project", "properties": {"name": "Project 1"}},
+        "raw": {
+            "type": "folder",
+            "properties": {"name": "Raw", "parent": "project.project1"},
+        },
+        "mri": {
+            "type": "folder",
+            "properties": {"name": "MRI", "parent": "folder.raw"},
+        },
+        "docs": {
+            "type": "folder",
+            "properties": {"name": "Docs", "parent": "project.project1"},
+        },
+        "mri_acl": {
+            "type": "acl",
+            "properties": {"resource": "folder.mri", "grants": []},
+        },
+    }
+
+    def test_hash_resource_is_stable(self):
+        """Test that key order does not change the content hash"""
+        assert hash_resource("folder", {"name": "A", "parent": "p.b"}) == hash_resource(
+            "folder", {"parent": "p.b", "name": "A"}
+        )
+        assert hash_resource("folder", {"name": "A"}) != hash_resource(
+            "project", {"name": "A"}
+        )
+
+    def test_hash_resource_mixed_keys(self, tmp_path):
+        """Test that yaml mappings mixing int and string keys can be hashed and saved"""
+        properties = {"name": "A", "annotations": {2020: "y", "phase": 1}}
+
+        content_hash = hash_resource("folder", properties)
+
+        assert content_hash == hash_resource(
+            "folder", {"name": "A", "annotations": {"2020": "y", "phase": 1}}
+        )
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("folder", "f", "syn1", properties)
+        reloaded = State(path=str(tmp_path / "state.json")).get("f", "folder")
+        assert reloaded["hash"] == hash_resource("folder", reloaded["properties"])
+
+    def test_subtree_hashes(self):
+        """Test that a change only affects the hashes of its ancestors"""
+        before, children, _ = subtree_hashes(self.config)
+        changed = json.loads(json.dumps(self.config))
+        changed["mri_acl"]["properties"]["grants"] = [{"principal": "team.t"}]
+        after, _, _ = subtree_hashes(changed)
+
+        assert sorted(children["project1"]) == ["docs", "raw"]
+        for name in ["project1", "raw", "mri", "mri_acl"]:
+            assert before[name] != after[name]
+        assert before["docs"] == after["docs"]
+
+    def test_plan_config_skips_unchanged_subtrees(self, tmp_path, monkeypatch):
+        """Test that plan only compares resources in changed subtrees"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        for i, (name, resource) in enumerate(self.config.items()):
+            state.add(resource["type"], name, f"syn{i}", resource["properties"])
+        record_subtree_hashes(self.config, state)
+
+        changed = json.loads(json.dumps(self.config))
+        changed["mri"]["properties"]["name"] = "MRI scans"
+
+        with patch(
+            "synapseformation.planner._has_changed",
+            wraps=planner._has_changed,
+        ) as mock_has_changed, patch(
+            "synapseformation.client._detect_drift", return_value=None
+        ):
+            result = plan_config({"resources": changed}, Mock())
+
+        assert result["changes"] == [
+            {
+                "type": "folder",
+                "name": "mri",
+                "action": "update",
+                "properties": changed["mri"]["properties"],
+                "fields": ["name"],
+            }
+        ]
+        compared = sorted(
+            call.args[1]["properties"].get("name", "acl")
+            for call in mock_has_changed.call_args_list
+        )
+        assert compared == ["MRI scans", "Project 1", "Raw", "acl"]
+
+    def test_record_subtree_hashes_skips_out_of_sync(self, tmp_path, monkeypatch):
+        """Test that subtrees with resources that were not applied get no hash"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        for i, (name, resource) in enumerate(self.config.items()):
+            if name != "mri_acl":
+                state.add(resource["type"], name, f"syn{i}", resource["properties"])
+
+        record_subtree_hashes(self.config, state)
+
+        assert state.get("docs", "folder")["subtree_hash"] is not None
+        assert state.get("mri", "folder")["subtree_hash"] is None
+        assert state.get("project1", "project")["subtree_hash"] is None
+
+    def test_plan_config_recreates_removed_resources(self, tmp_path, monkeypatch):
+        """Test a clean subtree is compared again once a resource in it is removed"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        for i, (name, resource) in enumerate(self.config.items()):
+            state.add(resource["type"], name, f"syn{i}", resource["properties"])
+        record_subtree_hashes(self.config, state)
+        # What an interrupted destroy leaves behind
+        state.remove([("acl", "mri_acl")])
+
+        result = plan_config({"resources": self.config}, remote=False)
+
+        assert [(change["action"], change["name"]) for change in result["changes"]] == [
+            ("create", "mri_acl")
+        ]
+
 
 class TestApplyConfig:
     """Test cases for apply_config function"""
 
-    @patch("synapseformation.client.apply_team")
-    @patch("synapseformation.client.apply_project")
-    @patch("synapseformation.client.apply_folder")
-    @patch("synapseformation.client.apply_acl")
-    @patch("synapseformation.client.sort_folders")
-    @patch("synapseformation.client.State")
+    @patch("synapseformation.client.apply_team_async")
+    @patch("synapseformation.client.apply_project_async")
+    @patch("synapseformation.client.apply_folder_async")
+    @patch("synapseformation.client.apply_acls_async")
+    @patch("synapseformation.state.State")
     def test_apply_config(
         self,
         mock_state_class,
-        mock_sort_folders,
-        mock_apply_acl,
+        mock_apply_acls,
         mock_apply_folder,
         mock_apply_project,
         mock_apply_team,
     ):
         """Test applying configuration"""
-        mock_state = Mock()
+        mock_state = MagicMock()
         mock_state_class.return_value = mock_state
-        mock_sort_folders.return_value = ["folder1"]
 
         config = {
             "resources": {
@@ -505,25 +1195,473 @@ class TestApplyConfig:
         mock_apply_team.assert_called_once()
         mock_apply_project.assert_called_once()
         mock_apply_folder.assert_called_once()
-        mock_apply_acl.assert_called_once()
+        mock_apply_acls.assert_called_once()
+
+
+class TestUpdates:
+    """Test cases for updating resources that are already applied"""
+
+    @staticmethod
+    def _syn(resource):
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(return_value=resource)
+        syn.rest_put_async = AsyncMock(side_effect=lambda uri, body: json.loads(body))
+        return syn
+
+    def test_diff_properties(self):
+        """Test only changed and removed fields are returned"""
+        old = {"name": "A", "description": "old", "parent": "project.p"}
+        new = {"name": "A", "parent": "folder.f"}
+        assert diff_properties(old, new) == {"description": None, "parent": "folder.f"}
+        assert diff_properties(new, new) == {}
+
+    def test_apply_folder_moves_parent(self, tmp_path):
+        """Test a folder moved to a new parent is updated in place"""
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("project", "project1", "syn1", {"name": "P"})
+        state.add(
+            "folder", "other", "syn5", {"name": "O", "parent": "project.project1"}
+        )
+        state.add(
+            "folder", "raw", "syn2", {"name": "Raw", "parent": "project.project1"}
+        )
+        syn = self._syn({"id": "syn2", "name": "Raw", "parentId": "syn1", "etag": "e1"})
+        props = {"name": "Raw", "parent": "folder.other"}
+
+        folder = asyncio.run(
+            apply_folder_async("raw", props, state, synapse_client=syn)
+        )
+
+        syn.rest_get_async.assert_awaited_once_with("/entity/syn2")
+        uri, body = syn.rest_put_async.await_args.args
+        assert uri == "/entity/syn2"
+        assert json.loads(body) == {
+            "id": "syn2",
+            "name": "Raw",
+            "parentId": "syn5",
+            "etag": "e1",
+        }
+        assert folder.parent_id == "syn5"
+        assert state.get("raw", "folder")["properties"] == props
+        assert len(state.resources) == 3
+
+    def test_apply_team_updates_description(self, tmp_path):
+        """Test a changed description is written to the team"""
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("team", "team1", "3", {"name": "T"})
+        syn = self._syn({"id": "3", "name": "T", "etag": "e1"})
+
+        asyncio.run(
+            apply_team_async(
+                "team1", {"name": "T", "description": "New"}, state, synapse_client=syn
+            )
+        )
+
+        syn.rest_get_async.assert_awaited_once_with("/team/3")
+        uri, body = syn.rest_put_async.await_args.args
+        assert uri == "/team"
+        assert json.loads(body)["description"] == "New"
+
+    def test_apply_acls_updates_grants(self, tmp_path):
+        """Test principals dropped from an ACL lose access and others are kept"""
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("folder", "raw", "syn2", {"name": "Raw", "parent": "project.p"})
+        state.add(
+            "acl",
+            "raw_acl",
+            "syn2",
+            {
+                "resource": "folder.raw",
+                "grants": [
+                    {"principal": 3, "access_type": ["READ"]},
+                    {"principal": 273948, "access_type": ["READ"]},
+                ],
+            },
+        )
+        syn = Mock()
+
+        async def rest_get_async(uri):
+            if uri.endswith("/benefactor"):
+                return {"id": "syn2"}
+            return {
+                "id": "syn2",
+                "etag": "e1",
+                "resourceAccess": [
+                    {"principalId": 3, "accessType": ["READ"]},
+                    {"principalId": 273948, "accessType": ["READ"]},
+                    {"principalId": 999, "accessType": ["ADMIN"]},
+                ],
+            }
+
+        syn.rest_get_async = AsyncMock(side_effect=rest_get_async)
+        syn.rest_put_async = AsyncMock(return_value={})
+        acl = {
+            "name": "raw_acl",
+            "properties": {
+                "resource": "folder.raw",
+                "grants": [{"principal": 273948, "access_type": ["READ", "DOWNLOAD"]}],
+            },
+        }
+
+        apply_acls([acl], state, syn=syn)
+
+        body = json.loads(syn.rest_put_async.await_args.args[1])
+        assert body["etag"] == "e1"
+        assert sorted(
+            body["resourceAccess"], key=lambda access: access["principalId"]
+        ) == [
+            {"principalId": 999, "accessType": ["ADMIN"]},
+            {"principalId": 273948, "accessType": ["DOWNLOAD", "READ"]},
+        ]
+        assert len(state.get_by_id("syn2")) == 2
+        assert state.get("raw_acl", "acl")["properties"] == acl["properties"]
+
+    def test_apply_acls_moves_acl(self, tmp_path):
+        """Test an ACL moved to another resource is revoked from the old entity"""
+        state = State(path=str(tmp_path / "state.json"))
+        state.add("project", "p", "syn1", {"name": "P"})
+        state.add("folder", "f", "syn2", {"name": "F", "parent": "project.p"})
+        state.add(
+            "acl",
+            "shared",
+            "syn1",
+            {
+                "resource": "project.p",
+                "grants": [{"principal": 111, "access_type": ["READ"]}],
+            },
+        )
+        syn = Mock()
+        current = {
+            "syn1": [
+                {"principalId": 111, "accessType": ["READ"]},
+                {"principalId": 999, "accessType": ["ADMIN"]},
+            ],
+            "syn2": [{"principalId": 999, "accessType": ["ADMIN"]}],
+        }
+
+        async def rest_get_async(uri):
+            entity_id = uri.split("/")[2]
+            if uri.endswith("/benefactor"):
+                return {"id": entity_id}
+            return {"id": entity_id, "resourceAccess": current[entity_id]}
+
+        syn.rest_get_async = AsyncMock(side_effect=rest_get_async)
+        syn.rest_put_async = AsyncMock(return_value={})
+        acl = {
+            "name": "shared",
+            "properties": {
+                "resource": "folder.f",
+                "grants": [{"principal": 111, "access_type": ["READ"]}],
+            },
+        }
+
+        assert apply_acls([acl], state, syn=syn) == {"shared": "syn2"}
+
+        written = {
+            call.args[0]: sorted(
+                json.loads(call.args[1])["resourceAccess"],
+                key=lambda access: access["principalId"],
+            )
+            for call in syn.rest_put_async.await_args_list
+        }
+        assert written == {
+            "/entity/syn1/acl": [{"principalId": 999, "accessType": ["ADMIN"]}],
+            "/entity/syn2/acl": [
+                {"principalId": 111, "accessType": ["READ"]},
+                {"principalId": 999, "accessType": ["ADMIN"]},
+            ],
+        }
+        assert state.get("shared", "acl")["id"] == "syn2"
+        assert [entry["name"] for entry in state.get_by_id("syn1")] == ["p"]
+
+
+class TestSavedPlan:
+    """Test cases for applying a saved plan"""
+
+    config = {
+        "resources": {
+            "project1": {"type": "project", "properties": {"name": "Project 1"}},
+            "raw": {
+                "type": "folder",
+                "properties": {"name": "Raw", "parent": "project.project1"},
+            },
+            "mri": {
+                "type": "folder",
+                "properties": {"name": "MRI", "parent": "folder.raw"},
+            },
+            "mri_acl": {
+                "type": "acl",
+                "properties": {
+                    "resource": "folder.mri",
+                    "grants": [{"principal": 273948, "access_type": ["READ"]}],
+                },
+            },
+        }
+    }
+
+    def _plan(self, tmp_path):
+        """Plan with the applied project and folder cached on disk"""
+        from synapseformation.cache import RemoteCache
+
+        state = State()
+        state.add("project", "project1", "syn1", {"name": "Project 1"})
+        state.add(
+            "folder", "raw", "syn2", {"name": "Raw", "parent": "project.project1"}
+        )
+        state.save()
+        cache = RemoteCache(tmp_path / "cache.json")
+        for resource_id, resource_type, name in [
+            ("syn1", "project", "Project 1"),
+            ("syn2", "folder", "Raw"),
+        ]:
+            cache.put(
+                resource_id,
+                {"type": resource_type, "name": name, "etag": f"e{resource_id}"},
+            )
+        syn = Mock()
+        syn.rest_post_async = AsyncMock(return_value={"results": []})
+        return plan_config(self.config, syn, remote_cache=cache)
+
+    @staticmethod
+    async def _apply_folder(logical_name, props, state, **kwargs):
+        state.add("folder", logical_name, "syn3", props)
+
+    @staticmethod
+    async def _apply_acls(acls, state, **kwargs):
+        for acl in acls:
+            state.add("acl", acl["name"], "syn3", acl["properties"])
+
+    def test_plan_records_graph_and_etags(self, tmp_path, monkeypatch):
+        """Test the plan holds what apply needs for the changes only"""
+        monkeypatch.chdir(tmp_path)
+        plan = self._plan(tmp_path)
+
+        assert [change["name"] for change in plan["changes"]] == ["mri", "mri_acl"]
+        assert plan["graph"] == {"mri": [], "mri_acl": ["mri"]}
+        assert plan["etags"] == {"/entity/syn2": "esyn2"}
+        assert sorted(plan["subtree_hashes"]) == ["mri", "project1", "raw"]
+        assert plan["subtrees"]["order"] == ["project1", "raw", "mri", "mri_acl"]
+        assert plan["subtrees"]["children"] == {
+            "project1": ["raw"],
+            "raw": ["mri"],
+            "mri": ["mri_acl"],
+        }
+
+    @patch("synapseformation.client.apply_acls_async")
+    @patch("synapseformation.client.apply_folder_async")
+    @patch("synapseformation.client.apply_project_async")
+    def test_apply_plan(
+        self,
+        mock_apply_project,
+        mock_apply_folder,
+        mock_apply_acls,
+        tmp_path,
+        monkeypatch,
+    ):
+        """Test only the planned changes are applied once the etags are checked"""
+        monkeypatch.chdir(tmp_path)
+        plan = self._plan(tmp_path)
+        mock_apply_folder.side_effect = self._apply_folder
+        mock_apply_acls.side_effect = self._apply_acls
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(return_value={"etag": "esyn2"})
+
+        apply_plan(plan, syn=syn)
+
+        syn.rest_get_async.assert_awaited_once_with("/entity/syn2")
+        mock_apply_project.assert_not_called()
+        assert mock_apply_folder.call_args.kwargs["logical_name"] == "mri"
+        assert [acl["name"] for acl in mock_apply_acls.call_args.kwargs["acls"]] == [
+            "mri_acl"
+        ]
+        # The recorded subtree hashes let the next plan skip the whole project
+        with patch("synapseformation.planner._has_changed") as mock_has_changed:
+            result = plan_config(self.config, remote=False)
+        mock_has_changed.assert_not_called()
+        assert result["changes"] == []
+
+    @patch("synapseformation.client.apply_acls_async")
+    @patch("synapseformation.client.apply_folder_async")
+    def test_apply_plan_checks_subtrees_against_state(
+        self, mock_apply_folder, mock_apply_acls, tmp_path, monkeypatch
+    ):
+        """Test a subtree the state no longer holds in sync is not recorded as clean"""
+        monkeypatch.chdir(tmp_path)
+        plan = self._plan(tmp_path)
+        mock_apply_folder.side_effect = self._apply_folder
+        mock_apply_acls.side_effect = self._apply_acls
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(return_value={"etag": "esyn2"})
+        # Another apply changed a folder of the subtree after the plan was made
+        State().update_properties(
+            "raw", "folder", {"name": "Raw data", "parent": "project.project1"}
+        )
+
+        apply_plan(plan, syn=syn)
+
+        result = plan_config(self.config, remote=False)
+        assert [(change["action"], change["name"]) for change in result["changes"]] == [
+            ("update", "raw")
+        ]
+
+    @patch("synapseformation.client.apply_folder_async")
+    def test_apply_plan_fails_on_stale_etags(
+        self, mock_apply_folder, tmp_path, monkeypatch
+    ):
+        """Test nothing is applied if Synapse changed after the plan"""
+        monkeypatch.chdir(tmp_path)
+        plan = self._plan(tmp_path)
+        syn = Mock()
+        syn.rest_get_async = AsyncMock(return_value={"etag": "changed"})
+
+        with pytest.raises(ValueError, match="/entity/syn2"):
+            apply_plan(plan, syn=syn)
+        mock_apply_folder.assert_not_called()
+
+
+class TestTargets:
+    """Test cases for targeting part of a configuration"""
+
+    resources = {
+        "team1": {"type": "team", "properties": {"name": "Team 1"}},
+        "project1": {"type": "project", "properties": {"name": "Project 1"}},
+        "project2": {"type": "project", "properties": {"name": "Project 2"}},
+        "raw": {
+            "type": "folder",
+            "properties": {"name": "Raw", "parent": "project.project1"},
+        },
+        "imaging": {
+            "type": "folder",
+            "properties": {"name": "Imaging", "parent": "folder.raw"},
+        },
+        "mri": {
+            "type": "folder",
+            "properties": {"name": "MRI", "parent": "folder.imaging"},
+        },
+        "imaging_acl": {
+            "type": "acl",
+            "properties": {
+                "resource": "folder.imaging",
+                "grants": [{"principal": "team.team1", "access_type": ["READ"]}],
+            },
+        },
+    }
+
+    def test_dependency_closure(self):
+        """Test targets select their parents and the principals of ACLs"""
+        assert dependency_closure(self.resources, ["folder.imaging"]) == {
+            "imaging",
+            "raw",
+            "project1",
+        }
+        assert dependency_closure(self.resources, ["acl.imaging_acl"]) == {
+            "imaging_acl",
+            "imaging",
+            "raw",
+            "project1",
+            "team1",
+        }
+
+    @pytest.mark.parametrize("target", ["folder.missing", "project.raw", "raw"])
+    def test_dependency_closure_unknown_target(self, target):
+        """Test targets must name a resource of the configuration"""
+        with pytest.raises(ValueError, match=f"Target {target} "):
+            dependency_closure(self.resources, [target])
+
+    def test_plan_config_targets(self, tmp_path, monkeypatch):
+        """Test a targeted plan only holds the selected resources"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        state.add("project", "project1", "syn1", {"name": "Project 1"})
+        state.add("project", "removed", "syn9", {"name": "Removed"})
+        state.save()
+
+        result = plan_config(
+            {"resources": self.resources}, remote=False, targets=["folder.imaging"]
+        )
+
+        assert [(change["action"], change["name"]) for change in result["changes"]] == [
+            ("create", "raw"),
+            ("create", "imaging"),
+        ]
+
+    @patch("synapseformation.client.apply_team_async")
+    @patch("synapseformation.client.apply_project_async")
+    @patch("synapseformation.client.apply_folder_async")
+    @patch("synapseformation.client.apply_acls_async")
+    def test_apply_config_targets(
+        self,
+        mock_apply_acls,
+        mock_apply_folder,
+        mock_apply_project,
+        mock_apply_team,
+        tmp_path,
+        monkeypatch,
+    ):
+        """Test a targeted apply only applies the dependency closure"""
+        monkeypatch.chdir(tmp_path)
+
+        apply_config({"resources": self.resources}, targets=["folder.imaging"])
+
+        assert [
+            call.kwargs["logical_name"] for call in mock_apply_project.call_args_list
+        ] == ["project1"]
+        assert [
+            call.kwargs["logical_name"] for call in mock_apply_folder.call_args_list
+        ] == [
+            "raw",
+            "imaging",
+        ]
+        mock_apply_team.assert_not_called()
+        mock_apply_acls.assert_not_called()
+
+    @patch("synapseformation.client.apply_project_async")
+    @patch("synapseformation.client.apply_folder_async")
+    def test_apply_targeted_saved_plan(
+        self, mock_apply_folder, mock_apply_project, tmp_path, monkeypatch
+    ):
+        """Test applying a targeted saved plan leaves the rest of its subtrees planned"""
+        from synapseformation.plan_file import load_plan, save_plan
+
+        monkeypatch.chdir(tmp_path)
+
+        async def apply_resource(resource_type, logical_name, props, state, **kwargs):
+            state.add(resource_type, logical_name, f"syn{len(state.resources)}", props)
+
+        mock_apply_project.side_effect = partial(apply_resource, "project")
+        mock_apply_folder.side_effect = partial(apply_resource, "folder")
+        config = {"resources": self.resources}
+        save_plan(plan_config(config, remote=False, targets=["folder.raw"]), "plan.bin")
+
+        apply_plan(load_plan("plan.bin"), syn=Mock())
+
+        result = plan_config(config, remote=False)
+        assert [(change["action"], change["name"]) for change in result["changes"]] == [
+            ("create", "team1"),
+            ("create", "project2"),
+            ("create", "imaging"),
+            ("create", "mri"),
+            ("create", "imaging_acl"),
+        ]
 
 
 class TestDestroyResources:
     """Test cases for destroy_resources function"""
 
-    @patch("synapseformation.client.State")
+    @patch("synapseformation.state.State")
     @patch("synapseformation.client.Project")
     @patch("synapseformation.client.Team")
     def test_destroy_resources(
         self, mock_team_class, mock_project_class, mock_state_class
     ):
         """Test destroying resources"""
-        mock_state = Mock()
+        mock_state = MagicMock()
         mock_state.resources = [
-            {"type": "project", "id": "syn123", "properties": {}},
-            {"type": "team", "id": "789", "properties": {}},
+            {"type": "project", "name": "project1", "id": "syn123", "properties": {}},
+            {"type": "team", "name": "team1", "id": "789", "properties": {}},
             {
                 "type": "acl",
+                "name": "acl1",
                 "id": "syn456",
                 "properties": {"grants": [{"principal": "789"}]},
             },
@@ -531,19 +1669,354 @@ class TestDestroyResources:
         mock_state_class.return_value = mock_state
 
         mock_project_instance = Mock()
+        mock_project_instance.delete_async = AsyncMock()
         mock_team_instance = Mock()
+        mock_team_instance.delete_async = AsyncMock()
         mock_project_class.return_value = mock_project_instance
         mock_team_class.return_value = mock_team_instance
 
         syn = Mock()
+        syn.rest_put_async = AsyncMock()
+        syn.rest_post_async = AsyncMock()
+        syn.rest_get_async = AsyncMock(
+            side_effect=lambda uri: {
+                "/entity/syn456/benefactor": {"id": "syn456"},
+                "/entity/syn456/acl": {
+                    "id": "syn456",
+                    "etag": "etag",
+                    "resourceAccess": [
+                        {"principalId": 789, "accessType": ["READ"]},
+                        {"principalId": 111, "accessType": ["READ"]},
+                    ],
+                },
+            }[uri]
+        )
 
         destroy_resources(syn)
 
-        syn.setPermissions.assert_called_once()
-        mock_project_instance.delete.assert_called_once()
-        mock_team_instance.delete.assert_called_once()
+        syn.rest_put_async.assert_called_once()
+        uri, body = syn.rest_put_async.call_args.args
+        assert uri == "/entity/syn456/acl"
+        assert json.loads(body)["resourceAccess"] == [
+            {"principalId": 111, "accessType": ["READ"]}
+        ]
+        mock_project_instance.delete_async.assert_called_once()
+        mock_team_instance.delete_async.assert_called_once()
         mock_state.clear.assert_called_once()
 
+    state_resources = [
+        {"type": "project", "name": "p1", "id": "syn1", "properties": {}},
+        {"type": "project", "name": "p2", "id": "syn2", "properties": {}},
+        {
+            "type": "folder",
+            "name": "raw",
+            "id": "syn3",
+            "properties": {"parent": "project.p1"},
+        },
+        {"type": "team", "name": "team1", "id": "789", "properties": {}},
+        {
+            "type": "acl",
+            "name": "raw_acl",
+            "id": "syn3",
+            "properties": {"grants": [{"principal": "789", "access_type": ["READ"]}]},
+        },
+    ]
+
+    def test_build_destroy_graph(self, tmp_path, monkeypatch):
+        """Test projects and teams wait for the ACLs that reference them"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        state.resources = self.state_resources
+
+        graph, members = build_destroy_graph(state)
+
+        assert graph == {
+            ("project", "p1"): {("acl", "syn3")},
+            ("project", "p2"): set(),
+            ("team", "team1"): {("acl", "syn3")},
+            ("acl", "syn3"): set(),
+        }
+        assert [r["name"] for r in members[("project", "p1")]] == ["p1", "raw"]
+
+    def test_build_destroy_graph_int_team_id(self, tmp_path, monkeypatch):
+        """Test teams created with int IDs still wait for the ACLs granting them"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        state.add("project", "p1", "syn1", {"name": "P1"})
+        state.add("team", "team1", 3456, {"name": "Team 1"})
+        state.add(
+            "acl",
+            "p1_acl",
+            "syn1",
+            {
+                "resource": "project.p1",
+                "grants": [{"principal": 3456, "access_type": ["READ"]}],
+            },
+        )
+
+        graph, _ = build_destroy_graph(state)
+
+        assert graph[("team", "team1")] == {("acl", "syn1")}
+        assert [r["name"] for r in state.get_by_id("3456")] == ["team1"]
+
+    @patch("synapseformation.client.revoke_acls_async")
+    @patch("synapseformation.client.Team")
+    @patch("synapseformation.client.Project")
+    def test_destroy_resources_resumes_after_failure(
+        self, mock_project_class, mock_team_class, mock_revoke, tmp_path, monkeypatch
+    ):
+        """Test a failure skips dependents, is summarized and can be resumed"""
+        monkeypatch.chdir(tmp_path)
+        state = State()
+        state.resources = self.state_resources
+        state.save()
+
+        deleted = []
+
+        def project(id):
+            async def delete_async(synapse_client=None):
+                if id == "syn2":
+                    raise RuntimeError("boom")
+                deleted.append(id)
+
+            return Mock(delete_async=delete_async)
+
+        mock_project_class.side_effect = project
+        mock_team_class.return_value.delete_async = AsyncMock()
+        mock_revoke.side_effect = [RuntimeError("denied"), None]
+
+        summary = destroy_resources(Mock())
+
+        assert summary["destroyed"] == []
+        assert summary["failed"] == {
+            "acl.raw_acl": "denied",
+            "project.p2": "boom",
+        }
+        assert sorted(summary["skipped"]) == ["folder.raw", "project.p1", "team.team1"]
+        assert len(State().resources) == 5
+
+        mock_project_class.side_effect = None
+        mock_project_class.return_value.delete_async = AsyncMock()
+        summary = destroy_resources(Mock())
+
+        assert summary["failed"] == {}
+        assert sorted(summary["destroyed"]) == [
+            "acl.raw_acl",
+            "folder.raw",
+            "project.p1",
+            "project.p2",
+            "team.team1",
+        ]
+        assert State().resources == []
+
+
+def test_revoke_acls_of_deleted_entity():
+    """Test an entity deleted outside of synapseformation has nothing to revoke"""
+    syn = Mock()
+    syn.rest_get_async = AsyncMock(
+        side_effect=SynapseHTTPError("gone", response=Mock(status_code=404))
+    )
+    syn.rest_put_async = AsyncMock()
+
+    revoke_acls(
+        [
+            {
+                "type": "acl",
+                "name": "raw_acl",
+                "id": "syn2",
+                "properties": {"grants": [{"principal": 3, "access_type": ["READ"]}]},
+            }
+        ],
+        syn,
+    )
+
+    syn.rest_put_async.assert_not_called()
+
+
+class TestExport:
+    """Test cases for export"""
+
+    CHILDREN = {
+        "syn1": [
+            {"id": "syn2", "name": "Raw Data", "benefactorId": 1},
+            {"id": "syn3", "name": "{Processed}", "benefactorId": 3},
+        ],
+        "syn2": [{"id": "syn4", "name": "MRI", "benefactorId": 1}],
+    }
+
+    @staticmethod
+    def _syn():
+        syn = Mock()
+
+        async def rest_get_async(uri):
+            if uri == "/entity/syn1":
+                return {"id": "syn1", "name": "My Project"}
+            return {
+                "resourceAccess": [
+                    {"principalId": 273948, "accessType": ["READ"]},
+                    {"principalId": 3, "accessType": ["UPDATE", "READ"]},
+                ]
+            }
+
+        syn.rest_get_async = AsyncMock(side_effect=rest_get_async)
+        return syn
+
+    @staticmethod
+    async def _get_children(parent, include_types, synapse_client):
+        for child in TestExport.CHILDREN.get(parent, []):
+            yield child
+
+    @patch("synapseformation.client.get_children")
+    def test_export_round_trips(self, mock_get_children, tmp_path, monkeypatch):
+        """Test the exported template and state plan no changes"""
+        from synapseformation.compiler import load_template
+
+        monkeypatch.chdir(tmp_path)
+        mock_get_children.side_effect = self._get_children
+        syn = self._syn()
+
+        counts = export("syn1", "exported.yaml", syn=syn, parallelism=2)
+
+        assert counts == {"project": 1, "folder": 3, "acl": 2}
+        acl_uris = [
+            call.args[0]
+            for call in syn.rest_get_async.call_args_list
+            if call.args[0].endswith("/acl")
+        ]
+        assert sorted(acl_uris) == ["/entity/syn1/acl", "/entity/syn3/acl"]
+        config = load_template("exported.yaml", cache_dir=tmp_path / "compiled")
+        resources = config["resources"]
+        assert resources["mri_4"]["properties"] == {
+            "name": "MRI",
+            "parent": "folder.raw_data_2",
+        }
+        assert resources["processed_3"]["properties"]["name"] == "{Processed}"
+        assert resources["processed_3_acl"]["properties"]["grants"] == [
+            {"principal": 273948, "access_type": ["READ"]},
+            {"principal": 3, "access_type": ["READ", "UPDATE"]},
+        ]
+        assert plan_config(config, remote=False)["changes"] == []
+
+    @patch("synapseformation.client.get_children")
+    def test_export_failure_discards_output(
+        self, mock_get_children, tmp_path, monkeypatch
+    ):
+        """Test a failed export leaves neither a template nor a state behind"""
+        monkeypatch.chdir(tmp_path)
+
+        async def get_children(parent, include_types, synapse_client):
+            raise RuntimeError("listing failed")
+            yield
+
+        mock_get_children.side_effect = get_children
+
+        with pytest.raises(RuntimeError, match="listing failed"):
+            export("syn1", "exported.yaml", syn=self._syn())
+
+        assert not Path("exported.yaml").exists()
+        assert list((tmp_path / ".synapseformation").iterdir()) == []
+
+    def test_export_requires_new_state(self, tmp_path):
+        """Test export refuses to write into an existing state"""
+        state_path = tmp_path / "state.json"
+        state_path.write_text("{}")
+
+        with pytest.raises(ValueError, match="already exists"):
+            export("syn1", tmp_path / "t.yaml", state_path=state_path, syn=Mock())
+
+
+class TestSyncDrift:
+    """Test cases for syncing drift into the state"""
+
+    @staticmethod
+    def _state():
+        state = State()
+        state.add("project", "project1", "syn1", {"name": "Project 1"})
+        state.add(
+            "folder", "raw", "syn2", {"name": "Raw", "parent": "project.project1"}
+        )
+        state.add("team", "team1", "3", {"name": "Team 1"})
+        state.add(
+            "acl",
+            "raw_acl",
+            "syn2",
+            {
+                "resource": "folder.raw",
+                "grants": [
+                    {"principal": "team.team1", "access_type": ["READ"]},
+                    {"principal": 273948, "access_type": ["READ"]},
+                ],
+            },
+        )
+        state.set_subtree_hashes({("project", "project1"): "a", ("folder", "raw"): "b"})
+        state.save()
+        return state
+
+    def test_sync_drift_reuses_plan(self, tmp_path, monkeypatch):
+        """Test that drift from a plan is synced without calling Synapse"""
+        monkeypatch.chdir(tmp_path)
+        self._state()
+        plan = {
+            "changes": [],
+            "drift": [
+                {
+                    "type": "folder",
+                    "name": "raw",
+                    "synapse_properties": {"name": "Raw data"},
+                },
+                {
+                    "type": "acl",
+                    "name": "raw_acl",
+                    "synapse_properties": [
+                        {"principal": "team.team1", "access_type": ["READ", "UPDATE"]},
+                        {"principal": 273948, "access_type": []},
+                    ],
+                },
+            ],
+        }
+
+        with patch.object(Synapse, "get_client") as mock_get_client:
+            synced = sync_drift(plan)
+
+        mock_get_client.assert_not_called()
+        assert synced == ["raw", "raw_acl"]
+        state = State()
+        raw = state.get("raw", "folder")
+        assert raw["properties"] == {"name": "Raw data", "parent": "project.project1"}
+        assert raw["hash"] == hash_resource("folder", raw["properties"])
+        assert raw["subtree_hash"] is None
+        assert state.get("project1", "project")["subtree_hash"] is None
+        assert state.get("raw_acl", "acl")["properties"]["grants"] == [
+            {"principal": "team.team1", "access_type": ["READ", "UPDATE"]}
+        ]
+
+    def test_sync_drift_fetches_in_bulk(self, tmp_path, monkeypatch):
+        """Test that entries without Synapse properties are fetched in bulk"""
+        monkeypatch.chdir(tmp_path)
+        self._state()
+        syn = Mock()
+
+        async def rest_post_async(uri, body):
+            if uri == "/entity/header":
+                return {"results": [{"id": "syn1", "name": "Renamed"}]}
+            return {"list": [{"id": "3", "name": "Team One"}]}
+
+        syn.rest_post_async = AsyncMock(side_effect=rest_post_async)
+        drift = [
+            {"type": "project", "name": "project1"},
+            {"type": "team", "name": "team1"},
+            {"type": "folder", "name": "unknown"},
+        ]
+
+        synced = sync_drift(drift, syn=syn)
+
+        assert synced == ["project1", "team1"]
+        assert syn.rest_post_async.await_count == 2
+        state = State()
+        assert state.get("project1", "project")["properties"]["name"] == "Renamed"
+        assert state.get("team1", "team")["properties"]["name"] == "Team One"
+        assert state.get("raw", "folder")["subtree_hash"] == "b"
+
 
 class TestStubFunctions:
     """Test cases for stub functions that need implementation"""
@@ -554,20 +2027,16 @@ class TestStubFunctions:
         result = initialize()
         assert result is None
 
-    def test_export(self):
-        """Test export function (stub)"""
-        # This should pass without error since it's currently a stub
-        result = export()
-        assert result is None
 
-    def test_sync_drift(self):
-        """Test sync_drift function (stub)"""
-        # This should pass without error since it's currently a stub
-        result = sync_drift()
-        assert result is None
+# Test fixtures
+def _saved_state(resources: list) -> State:
+    """Save a state with the given resources in the working directory"""
+    state = State()
+    state.resources = resources
+    state.save()
+    return state
 
 
-# Test fixtures
 @pytest.fixture
 def state():
     return State()
@@ -0,0 +1,169 @@
+"""Test template validation and the compiled template cache"""
+
+from unittest.mock import Mock, patch
+
+import pytest
+import yaml
+
+from synapseformation import compiler
+from synapseformation.client import plan_config
+
+CONFIG = {
+    "resources": {
+        "team1": {"type": "team", "properties": {"name": "Team 1"}},
+        "project1": {"type": "project", "properties": {"name": "Project 1"}},
+        "raw": {
+            "type": "folder",
+            "properties": {"name": "Raw", "parent": "project.project1"},
+        },
+        "raw_acl": {
+            "type": "acl",
+            "properties": {
+                "resource": "folder.raw",
+                "grants": [{"principal": "team.team1", "access_type": ["READ"]}],
+            },
+        },
+    }
+}
+
+
+def test_compile_config():
+    """Test references are resolved to edges in topological order"""
+    compiled = compiler.compile_config(CONFIG)["compiled"]
+
+    assert compiled["graph"] == {
+        "team1": [],
+        "project1": [],
+        "raw": ["project1"],
+        "raw_acl": ["raw", "team1"],
+    }
+    order = compiled["order"]
+    assert order.index("project1") < order.index("raw") < order.index("raw_acl")
+    assert compiled["children"] == {"project1": ["raw"], "raw": ["raw_acl"]}
+
+
+def test_validate_config_reports_every_error():
+    """Test invalid resources and references are all reported"""
+    config = {
+        "resources": {
+            "bad_type": {"type": "bucket", "properties": {}},
+            "project1": {"type": "project", "properties": {"name": "P"}},
+            "orphan": {"type": "folder", "properties": {"name": "F", "parent": "raw"}},
+            "acl1": {
+                "type": "acl",
+                "properties": {
+                    "resource": "team.project1",
+                    "grants": [{"principal": "team.project1", "access_type": "READ"}],
+                },
+            },
+        }
+    }
+
+    with pytest.raises(ValueError) as error:
+        compiler.validate_config(config)
+
+    message = str(error.value)
+    assert "bad_type: type must be one of" in message
+    assert "orphan: parent must be a 'type.name' reference" in message
+    assert "acl1: resource cannot reference a team" in message
+    assert "acl1: principal references team.project1 but project1 is a project" in (
+        message
+    )
+    assert "acl1: access_type must be a list" in message
+
+
+def test_load_template_uses_cache(tmp_path):
+    """Test an unchanged template is not parsed again and a changed one is"""
+    template = tmp_path / "template.yaml"
+    template.write_text(yaml.safe_dump(CONFIG))
+    cache_dir = tmp_path / "compiled"
+
+    first = compiler.load_template(template, cache_dir=cache_dir)
+    with patch.object(compiler, "read_config") as mock_read_config:
+        assert compiler.load_template(template, cache_dir=cache_dir) == first
+        mock_read_config.assert_not_called()
+
+    template.write_text(yaml.safe_dump({"resources": {}}))
+    assert compiler.load_template(template, cache_dir=cache_dir)["compiled"] == {
+        "graph": {},
+        "order": [],
+        "children": {},
+        "subtree_hashes": {},
+    }
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_plan_uses_compiled_graph(tmp_path, monkeypatch):
+    """Test plan does not rebuild the graph of a compiled template"""
+    monkeypatch.chdir(tmp_path)
+    compiled = compiler.compile_config(CONFIG)
+
+    with patch("synapseformation.planner.build_dependency_graph") as mock_build_graph:
+        result = plan_config(compiled, syn=Mock())
+
+    mock_build_graph.assert_not_called()
+    assert [change["name"] for change in result["changes"]] == list(CONFIG["resources"])
+
+
+def test_compile_config_rejects_duplicates():
+    """Test resources expanding to the same logical name are rejected"""
+    config = {
+        "resources": {
+            "team{each}": {
+                "type": "team",
+                "for_each": [1, 1],
+                "properties": {"name": "T"},
+            }
+        }
+    }
+
+    with pytest.raises(ValueError, match="team1 is defined more than once"):
+        compiler.compile_config(config)
+
+
+def test_load_template_checks_includes(tmp_path):
+    """Test a cached template is recompiled when an included template changes"""
+    template = tmp_path / "template.yaml"
+    template.write_text("resources:\n  shared: {include: teams.yaml}\n")
+    teams = tmp_path / "teams.yaml"
+    teams.write_text("resources:\n  t1: {type: team, properties: {name: T1}}\n")
+    cache_dir = tmp_path / "compiled"
+
+    assert list(compiler.load_template(template, cache_dir)["resources"]) == ["t1"]
+    teams.write_text("resources:\n  t2: {type: team, properties: {name: T2}}\n")
+    assert list(compiler.load_template(template, cache_dir)["resources"]) == ["t2"]
+
+
+def test_load_template_cache_is_per_directory(tmp_path):
+    """Test identical templates in other directories resolve their own includes"""
+    cache_dir = tmp_path / "compiled"
+    for team in ["t1", "t2"]:
+        (tmp_path / team).mkdir()
+        (tmp_path / team / "template.yaml").write_text(
+            "resources:\n  shared: {include: teams.yaml}\n"
+        )
+        (tmp_path / team / "teams.yaml").write_text(
+            f"resources:\n  {team}: {{type: team, properties: {{name: {team}}}}}\n"
+        )
+
+    for team in ["t1", "t2"]:
+        compiled = compiler.load_template(tmp_path / team / "template.yaml", cache_dir)
+        assert list(compiled["resources"]) == [team]
+
+
+def test_validate_config_accepts_principal_ids():
+    """Test grants can name a user or group by principal ID"""
+    config = {
+        "resources": {
+            **CONFIG["resources"],
+            "public_acl": {
+                "type": "acl",
+                "properties": {
+                    "resource": "project.project1",
+                    "grants": [{"principal": 273948, "access_type": ["READ"]}],
+                },
+            },
+        }
+    }
+
+    compiler.validate_config(config)
@@ -0,0 +1,196 @@
+"""Test the command line client"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from synapseformation import __version__
+from synapseformation.__main__ import cli
+
+# Cumulative import time of synapseformation.__main__ allowed, in microseconds.
+# Importing click takes around 30ms and synapseclient takes most of a second.
+IMPORT_BUDGET_US = 250_000
+HEAVY_MODULES = ("synapseclient", "yaml", "httpx", "synapseformation.client")
+
+
+def _import_times(*args: str, cwd: Path = None) -> dict:
+    """
+    Cumulative import time in microseconds of every module imported by running python
+    with `args`, by default `-c "import module"`
+    """
+    if len(args) == 1:
+        args = ("-c", f"import {args[0]}")
+    package_root = Path(__file__).resolve().parents[1]
+    env = {**os.environ, "PYTHONPATH": str(package_root)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        check=True,
+        cwd=cwd,
+        env=env,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def _heavy(times: dict, heavy_modules: tuple = HEAVY_MODULES) -> list:
+    """The modules in `times` that belong to `heavy_modules`"""
+    return [
+        name
+        for name in times
+        if name.split(".")[0] in heavy_modules or name in heavy_modules
+    ]
+
+
+def test_cli_imports_are_lazy():
+    """Test the command line client does not import synapseclient up front"""
+    times = _import_times("synapseformation.__main__")
+
+    assert _heavy(times) == []
+    assert times["synapseformation.__main__"] < IMPORT_BUDGET_US
+
+
+def test_plan_offline_imports_are_light(tmp_path):
+    """Test plan --offline does not import synapseclient or the client module"""
+    template = tmp_path / "template.yaml"
+    template.write_text("resources:\n  t1: {type: team, properties: {name: T1}}\n")
+
+    times = _import_times(
+        "-m", "synapseformation", "plan", "--offline", str(template), cwd=tmp_path
+    )
+
+    # Reading the template needs yaml, but nothing else heavy
+    heavy_modules = tuple(name for name in HEAVY_MODULES if name != "yaml")
+    assert _heavy(times, heavy_modules) == []
+    # An upper bound, as the modules imported by another module are counted twice
+    package_time = sum(
+        cumulative
+        for name, cumulative in times.items()
+        if name.startswith("synapseformation")
+    )
+    assert package_time < IMPORT_BUDGET_US
+
+
+def test_version():
+    """Test --version"""
+    result = CliRunner().invoke(cli, ["--version"])
+
+    assert result.exit_code == 0
+    assert __version__ in result.output
+
+
+def test_plan_offline(tmp_path, monkeypatch):
+    """Test plan --offline neither logs in nor checks for drift"""
+    monkeypatch.chdir(tmp_path)
+    template = tmp_path / "template.yaml"
+    template.write_text("resources:\n  t1: {type: team, properties: {name: T1}}\n")
+
+    with patch("synapseclient.Synapse") as mock_synapse:
+        result = CliRunner().invoke(cli, ["plan", "--offline", str(template)])
+
+    assert result.exit_code == 0, result.output
+    mock_synapse.assert_not_called()
+    assert "There are 1 creations, 0 updates, and 0 deletions" in result.output
+    assert "Drift was not checked" in result.output
+
+
+def test_plan_out(tmp_path, monkeypatch):
+    """Test plan --out saves a plan that apply and sync-drift recognize"""
+    from synapseformation.plan_file import load_plan
+
+    monkeypatch.chdir(tmp_path)
+    template = tmp_path / "template.yaml"
+    template.write_text("resources:\n  t1: {type: team, properties: {name: T1}}\n")
+    drift = [{"type": "team", "name": "t0", "synapse_properties": {"name": "T"}}]
+    planned = {
+        "changes": [{"type": "team", "name": "t1", "action": "create"}],
+        "drift": drift,
+        "graph": {"t1": []},
+        "subtree_hashes": {},
+        "subtrees": {"order": [], "hashes": {}, "children": {}},
+        "etags": {"/entity/syn1": "e1"},
+    }
+
+    with patch("synapseformation.session.Session"), patch(
+        "synapseformation.client.plan_config", return_value=planned
+    ):
+        result = CliRunner().invoke(cli, ["plan", "--out", "plan.bin", str(template)])
+
+    assert result.exit_code == 0, result.output
+    assert "run apply plan.bin" in result.output
+    plan = load_plan(tmp_path / "plan.bin")
+    assert [change["name"] for change in plan["changes"]] == ["t1"]
+    assert plan["etags"] == {"/entity/syn1": "e1"}
+
+    with patch("synapseformation.session.Session"), patch(
+        "synapseformation.client.plan_config"
+    ) as mock_plan_config, patch(
+        "synapseformation.client.sync_drift", return_value=["t0"]
+    ) as mock_sync_drift:
+        result = CliRunner().invoke(cli, ["sync-drift", "plan.bin"])
+
+    assert result.exit_code == 0, result.output
+    mock_plan_config.assert_not_called()
+    assert mock_sync_drift.call_args.args[0]["drift"] == drift
+
+
+def test_plan_out_offline(tmp_path, monkeypatch):
+    """Test an offline plan, which observes no etags, cannot be saved"""
+    monkeypatch.chdir(tmp_path)
+    template = tmp_path / "template.yaml"
+    template.write_text("resources:\n  t1: {type: team, properties: {name: T1}}\n")
+
+    result = CliRunner().invoke(
+        cli, ["plan", "--offline", "--out", "plan.bin", str(template)]
+    )
+
+    assert result.exit_code == 2
+    assert "--out cannot be used with --offline" in result.output
+    assert not (tmp_path / "plan.bin").exists()
+
+
+def test_plan_target(tmp_path, monkeypatch):
+    """Test plan --target only plans the selected resources"""
+    monkeypatch.chdir(tmp_path)
+    template = tmp_path / "template.yaml"
+    template.write_text(
+        "resources:\n"
+        "  t1: {type: team, properties: {name: T1}}\n"
+        "  t2: {type: team, properties: {name: T2}}\n"
+    )
+
+    result = CliRunner().invoke(
+        cli, ["plan", "--offline", "--target", "team.t2", str(template)]
+    )
+    assert result.exit_code == 0, result.output
+    assert "There are 1 creations" in result.output
+
+    result = CliRunner().invoke(
+        cli, ["plan", "--offline", "--target", "team.t3", str(template)]
+    )
+    assert result.exit_code == 1
+    assert "Target team.t3 is not a resource" in result.output
+
+
+def test_rate_option(tmp_path, monkeypatch):
+    """Test --rate limits the requests of the command's session"""
+    monkeypatch.chdir(tmp_path)
+
+    with patch("synapseformation.session.Session") as mock_session, patch(
+        "synapseformation.client.destroy_resources",
+        return_value={"destroyed": [], "failed": {}, "skipped": []},
+    ):
+        result = CliRunner().invoke(cli, ["destroy", "--rate", "5"])
+
+    assert result.exit_code == 0, result.output
+    mock_session.assert_called_once_with(max_connections=10, rate=5.0)
@@ -0,0 +1,70 @@
+"""Test saving and loading plans"""
+
+import gzip
+import json
+
+import pytest
+
+from synapseformation.plan_file import (
+    PLAN_VERSION,
+    is_plan_file,
+    load_plan,
+    save_plan,
+)
+
+PLAN = {
+    "changes": [
+        {
+            "type": "folder",
+            "name": "mri",
+            "action": "create",
+            "properties": {"name": "MRI", "parent": "folder.raw"},
+        }
+    ],
+    "drift": [{"type": "folder", "name": "raw", "synapse_properties": {}}],
+    "graph": {"mri": []},
+    "subtree_hashes": {"mri": ["folder", "abc"]},
+    "subtrees": {
+        "order": ["mri"],
+        "hashes": {"mri": ["folder", "def"]},
+        "children": {},
+    },
+    "etags": {"/entity/syn2": "e2"},
+}
+
+
+def test_round_trip(tmp_path):
+    """Test a saved plan loads back with its drift"""
+    path = tmp_path / "plan.bin"
+    save_plan(PLAN, path)
+
+    assert is_plan_file(path)
+    loaded = load_plan(path)
+    assert loaded.pop("version") == PLAN_VERSION
+    assert loaded == PLAN
+
+
+def test_save_is_reproducible(tmp_path):
+    """Test saving the same plan twice writes the same bytes"""
+    save_plan(PLAN, tmp_path / "a.bin")
+    save_plan(PLAN, tmp_path / "b.bin")
+    assert (tmp_path / "a.bin").read_bytes() == (tmp_path / "b.bin").read_bytes()
+
+
+def test_load_rejects_templates(tmp_path):
+    """Test a template is not mistaken for a plan"""
+    path = tmp_path / "template.yaml"
+    path.write_text("resources: {}\n")
+
+    assert not is_plan_file(path)
+    with pytest.raises(ValueError, match="not a saved plan"):
+        load_plan(path)
+
+
+def test_load_rejects_other_versions(tmp_path):
+    """Test plans written by another version must be planned again"""
+    path = tmp_path / "plan.bin"
+    path.write_bytes(gzip.compress(json.dumps({"version": 0}).encode()))
+
+    with pytest.raises(ValueError, match="Run plan again"):
+        load_plan(path)
@@ -0,0 +1,137 @@
+"""Test the Synapse request scheduler"""
+
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from synapseformation.scheduler import RequestScheduler, TokenBucket
+
+
+def http_error(status_code, headers=None):
+    return SynapseHTTPError(
+        "error", response=Mock(status_code=status_code, headers=headers or {})
+    )
+
+
+def make_scheduler(**kwargs):
+    return RequestScheduler(rate=1000, base_delay=0, **kwargs)
+
+
+def test_retries_throttled_request():
+    """Test that throttled requests are retried until they succeed"""
+    request = AsyncMock(side_effect=[http_error(429), http_error(503), "result"])
+    scheduler = make_scheduler()
+
+    assert asyncio.run(scheduler.run(request)) == "result"
+    assert request.call_count == 3
+
+
+def test_does_not_retry_other_errors():
+    """Test that errors other than throttling are raised immediately"""
+    request = AsyncMock(side_effect=http_error(403))
+
+    with pytest.raises(SynapseHTTPError):
+        asyncio.run(make_scheduler().run(request))
+    assert request.call_count == 1
+
+
+def test_gives_up_after_max_retries():
+    """Test that a request throttled too many times fails"""
+    request = AsyncMock(side_effect=http_error(429))
+
+    with pytest.raises(SynapseHTTPError):
+        asyncio.run(make_scheduler(max_retries=2).run(request))
+    assert request.call_count == 3
+
+
+def test_throttling_halves_concurrency():
+    """Test AIMD: concurrency is halved on throttling and grows back after successes"""
+    scheduler = make_scheduler(max_concurrency=8)
+    request = AsyncMock(side_effect=[http_error(429), "result"])
+
+    asyncio.run(scheduler.run(request))
+    assert scheduler.concurrency == 4
+
+    for _ in range(4):
+        asyncio.run(scheduler.run(AsyncMock(return_value="result")))
+    assert scheduler.concurrency == 5
+
+
+def test_create_is_not_duplicated():
+    """Test that a create which succeeded before being throttled is not repeated"""
+    create = AsyncMock(side_effect=[http_error(503), "duplicate"])
+    recover = AsyncMock(return_value="created")
+
+    result = asyncio.run(
+        make_scheduler().run(create, idempotent=False, recover=recover)
+    )
+
+    assert result == "created"
+    assert create.call_count == 1
+
+
+def test_create_retried_when_nothing_was_created():
+    """Test that a throttled create is retried if the earlier attempt had no effect"""
+    create = AsyncMock(side_effect=[http_error(429), "created"])
+    recover = AsyncMock(return_value=None)
+
+    result = asyncio.run(
+        make_scheduler().run(create, idempotent=False, recover=recover)
+    )
+
+    assert result == "created"
+    assert create.call_count == 2
+
+
+def test_recover_through_scheduler_with_one_slot():
+    """Test a recover lookup sent through the scheduler does not wait for a slot"""
+    scheduler = make_scheduler(max_concurrency=1)
+    create = AsyncMock(side_effect=[http_error(503), "duplicate"])
+    lookup = AsyncMock(return_value="created")
+
+    async def recover():
+        return await scheduler.run(lookup)
+
+    result = asyncio.run(
+        asyncio.wait_for(
+            scheduler.run(create, idempotent=False, recover=recover), timeout=5
+        )
+    )
+
+    assert result == "created"
+    assert scheduler._in_flight == 0
+
+
+def test_create_without_recover_is_not_retried():
+    """Test that requests that are not idempotent are not blindly retried"""
+    create = AsyncMock(side_effect=http_error(429))
+
+    with pytest.raises(SynapseHTTPError):
+        asyncio.run(make_scheduler().run(create, idempotent=False))
+    assert create.call_count == 1
+
+
+def test_backoff_honours_retry_after():
+    """Test the Retry-After header takes precedence over exponential backoff"""
+    scheduler = RequestScheduler(base_delay=1, max_delay=10)
+
+    assert scheduler.backoff(5, http_error(429, {"Retry-After": "3"})) == 3
+    assert 0 <= scheduler.backoff(2) <= 4
+    assert scheduler.backoff(20) <= 10
+
+
+def test_token_bucket_limits_rate():
+    """Test that the token bucket only allows a burst of `capacity` requests"""
+    bucket = TokenBucket(rate=100, capacity=2)
+    loop = asyncio.new_event_loop()
+    try:
+        start = loop.time()
+        for _ in range(4):
+            loop.run_until_complete(bucket.acquire())
+        elapsed = loop.time() - start
+    finally:
+        loop.close()
+
+    assert elapsed >= 0.015
@@ -0,0 +1,79 @@
+"""Test sharing Synapse clients and connections through a session"""
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from synapseformation import client
+from synapseformation.session import Session
+
+
+@pytest.fixture
+def session():
+    with patch("synapseformation.session.Synapse") as mock_synapse:
+        with Session(max_connections=4) as session:
+            session.mock_synapse = mock_synapse
+            yield session
+
+
+def test_client_is_cached(session):
+    """Test each profile or token logs in once and shares the pooled connections"""
+    first = session.client()
+    assert session.client() is first
+    session.client(auth_token="token")
+
+    assert session.mock_synapse.call_count == 2
+    assert [call.kwargs for call in first.login.call_args_list] == [
+        {"profile": "default", "silent": True},
+        {"authToken": "token", "silent": True},
+    ]
+    kwargs = session.mock_synapse.call_args.kwargs
+    assert kwargs["requests_session_async_synapse"] is session._async_http
+    assert kwargs["asyncio_event_loop"] is session._loop
+
+
+def test_operations_share_the_session(session):
+    """Test library calls run with the session's client, scheduler and event loop"""
+    loops = []
+
+    async def record_loop(**kwargs):
+        loops.append(asyncio.get_running_loop())
+        return {"destroyed": [], "failed": {}, "skipped": []}
+
+    with patch.object(
+        client, "apply_config_async", new_callable=AsyncMock
+    ) as mock_apply, patch.object(
+        client, "destroy_resources_async", side_effect=record_loop
+    ) as mock_destroy:
+        client.apply_config({"resources": {}}, parallelism=2, session=session)
+        client.destroy_resources(session=session)
+        client.destroy_resources(session=session)
+
+    mock_apply.assert_awaited_once_with(
+        synapse_client=session.client(),
+        scheduler=session.scheduler,
+        config={"resources": {}},
+        parallelism=2,
+        targets=None,
+    )
+    assert mock_destroy.call_args.kwargs["synapse_client"] is session.client()
+    assert loops == [session._loop, session._loop]
+    assert session.mock_synapse.call_count == 1
+
+
+def test_close_is_idempotent():
+    """Test closing a session twice"""
+    session = Session()
+    session.close()
+    session.close()
+    assert session._loop.is_closed()
+
+
+def test_rate_limit_is_optional():
+    """Test requests are only rate limited when a rate is given"""
+    with Session(max_connections=4) as session:
+        assert session.scheduler.bucket is None
+        assert session.scheduler.max_concurrency == 4
+    with Session(max_connections=4, rate=5) as session:
+        assert session.scheduler.bucket.rate == 5
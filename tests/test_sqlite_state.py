@@ -0,0 +1,115 @@
+"""Test the SQLite state backend"""
+
+import json
+
+import pytest
+
+from synapseformation import client
+from synapseformation.client import State, open_state
+from synapseformation.defaults import DEFAULT_SQLITE_STATE
+from synapseformation.sqlite_state import SqliteState, migrate_json_state
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = SqliteState(tmp_path / "state.db")
+    yield state
+    state.close()
+
+
+def test_add_and_lookup(state):
+    """Test resources can be looked up by logical name and Synapse ID"""
+    state.add("project", "project1", "syn1", {"name": "P"})
+    state.add("acl", "project1_acl", "syn1", {"resource": "project.project1"})
+    state.add("team", "team1", 123, {"name": "T"})
+
+    assert state.get_id("project1", "project") == "syn1"
+    assert state.get("team1", "team")["id"] == 123
+    assert state.get("missing", "team") is None
+    assert {r["name"] for r in state.get_by_id("syn1")} == {"project1", "project1_acl"}
+    assert state.get("project1", "project")["hash"] == client.hash_resource(
+        "project", {"name": "P"}
+    )
+
+
+def test_update_remove_and_clear(state):
+    """Test mutations only touch the affected rows"""
+    state.add("project", "project1", "syn1", {"name": "P"})
+    state.add("folder", "folder1", "syn2", {"name": "F"})
+
+    state.update_properties("folder1", "folder", {"name": "G"})
+    state.set_subtree_hashes({("project", "project1"): "abc"})
+    assert state.get("folder1", "folder")["properties"] == {"name": "G"}
+    assert state.get("project1", "project")["subtree_hash"] == "abc"
+
+    state.remove([("folder", "folder1")])
+    assert [r["name"] for r in state.resources] == ["project1"]
+    state.clear()
+    assert len(state) == 0
+
+
+def test_transaction_persists_on_failure(tmp_path):
+    """Test mutations made before a failure in a transaction are committed"""
+    path = tmp_path / "state.db"
+    state = SqliteState(path)
+    with pytest.raises(RuntimeError):
+        with state.transaction(checkpoint_every=1):
+            state.add("project", "project1", "syn1", {"name": "P"})
+            raise RuntimeError("boom")
+    state.close()
+
+    reopened = SqliteState(path)
+    assert reopened.get_id("project1", "project") == "syn1"
+    assert list(reopened.iter_resources("folder")) == []
+    reopened.close()
+
+
+def test_migrate_json_state(tmp_path):
+    """Test a version 1 JSON state, including its journal, is migrated"""
+    json_path = tmp_path / "state.json"
+    source = State(json_path)
+    source.add("project", "project1", "syn1", {"name": "P"})
+    source.journal_path.write_text(
+        json.dumps(
+            {
+                "op": "add",
+                "resource": {
+                    "type": "team",
+                    "name": "team1",
+                    "id": 5,
+                    "properties": {"name": "T"},
+                    "hash": "h",
+                },
+            }
+        )
+        + "\n"
+    )
+
+    state = migrate_json_state(json_path, tmp_path / "state.db")
+
+    assert state.get_id("project1", "project") == "syn1"
+    assert state.get("team1", "team")["hash"] == "h"
+    state.close()
+
+
+def test_open_state(tmp_path, monkeypatch):
+    """Test the backend is chosen by the state file suffix"""
+    monkeypatch.chdir(tmp_path)
+    assert isinstance(open_state(), State)
+
+    SqliteState(DEFAULT_SQLITE_STATE).close()
+    state = open_state()
+    assert isinstance(state, SqliteState)
+    state.close()
+
+    with pytest.raises(ValueError, match="No state backend"):
+        open_state("state.txt")
+
+
+def test_get_by_id_matches_int_and_str(state):
+    """Test an int team ID is found by its string form and the other way around"""
+    state.add("team", "team1", 3456, {"name": "T"})
+    state.add("team", "team2", "789", {"name": "T2"})
+
+    assert [r["name"] for r in state.get_by_id("3456")] == ["team1"]
+    assert [r["name"] for r in state.get_by_id(789)] == ["team2"]
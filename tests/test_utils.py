@@ -3,6 +3,9 @@
 import json
 from unittest import mock
 
+import pytest
+import yaml
+
 from synapseformation import utils
 
 
@@ -23,3 +26,191 @@ def test_read_config_json():
     with mock.patch("builtins.open", mock_open):
         json_dict = utils.read_config("file")
         assert json_dict == expected
+
+
+def test_read_config_json_file(tmp_path):
+    """Test .json templates are read with the JSON parser"""
+    expected = {"resources": {"p": {"type": "project", "properties": {"name": "P"}}}}
+    template = tmp_path / "template.json"
+    template.write_text(json.dumps(expected))
+
+    assert utils.read_config(template) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "resources:\n  p: {type: project, properties: &p {name: P}}\n"
+        "modules:\n  m: {resources: {f: {type: folder, properties: *p}}}\n",
+        "version: 1\nresources:\n",
+        "{}",
+    ],
+)
+def test_read_config_yaml_file(tmp_path, text):
+    """Test streaming the resources builds the same configuration as loading it"""
+    template = tmp_path / "template.yaml"
+    template.write_text(text)
+
+    assert utils.read_config(template) == yaml.safe_load(text)
+
+
+def test_iter_resources(tmp_path):
+    """Test resources are streamed in order and match the loaded template"""
+    template = tmp_path / "template.yaml"
+    template.write_text(
+        "version: 1\n"
+        "resources:\n"
+        "  project1:\n"
+        "    type: project\n"
+        "    properties: &props\n"
+        "      name: Project 1\n"
+        "  raw:\n"
+        "    type: folder\n"
+        "    properties:\n"
+        "      <<: *props\n"
+        "      parent: project.project1\n"
+        "  count: {type: team, properties: {name: 3}}\n"
+        "name: after the resources\n"
+    )
+
+    streamed = list(utils.iter_resources(template))
+
+    assert [name for name, _ in streamed] == ["project1", "raw", "count"]
+    assert dict(streamed) == yaml.safe_load(template.read_text())["resources"]
+    assert streamed[1][1]["properties"] == {
+        "name": "Project 1",
+        "parent": "project.project1",
+    }
+
+
+def test_iter_resources_without_resources(tmp_path):
+    """Test templates with no resources stream nothing"""
+    template = tmp_path / "template.yaml"
+    template.write_text("version: 1\nresources:\n")
+
+    assert list(utils.iter_resources(template)) == []
+
+
+MODULES = {
+    "site_tree": {
+        "resources": {
+            "{site}_raw": {
+                "type": "folder",
+                "properties": {"name": "Raw {site}", "parent": "project.study"},
+            },
+            "{site}_{each}": {
+                "type": "folder",
+                "for_each": ["imaging", "clinical"],
+                "properties": {"name": "{each}", "parent": "folder.{site}_raw"},
+            },
+        }
+    }
+}
+
+
+def test_expand_resources_modules_and_loops():
+    """Test modules are expanded for every item of a for_each"""
+    resource_config = {
+        "study": {"type": "project", "properties": {"name": "Study"}},
+        "sites": {
+            "module": "site_tree",
+            "for_each": [{"site": "a"}, {"site": "b"}],
+        },
+    }
+
+    expanded = dict(utils.expand_resources(resource_config, MODULES))
+
+    assert list(expanded) == [
+        "study",
+        "a_raw",
+        "a_imaging",
+        "a_clinical",
+        "b_raw",
+        "b_imaging",
+        "b_clinical",
+    ]
+    assert expanded["b_clinical"]["properties"] == {
+        "name": "clinical",
+        "parent": "folder.b_raw",
+    }
+    assert "for_each" not in expanded["a_imaging"]
+
+
+def test_expand_resources_is_lazy():
+    """Test resources are generated on demand"""
+    resource_config = {
+        "team{each}": {
+            "type": "team",
+            "for_each": 10**9,
+            "properties": {"name": "Team {each}"},
+        }
+    }
+
+    expanded = utils.expand_resources(resource_config)
+
+    assert next(expanded) == (
+        "team0",
+        {"type": "team", "properties": {"name": "Team 0"}},
+    )
+    assert next(expanded)[0] == "team1"
+
+
+def test_expand_resources_include(tmp_path):
+    """Test included templates bring their resources and modules"""
+    (tmp_path / "sites.yaml").write_text(
+        "modules:\n"
+        "  one:\n"
+        "    resources:\n"
+        "      '{name}': {type: team, properties: {name: '{name}'}}\n"
+        "resources:\n"
+        "  t: {module: one, vars: {name: included}}\n"
+    )
+    included = []
+
+    expanded = list(
+        utils.expand_resources(
+            {"shared": {"include": "sites.yaml"}}, base_dir=tmp_path, included=included
+        )
+    )
+
+    assert expanded == [
+        ("included", {"type": "team", "properties": {"name": "included"}})
+    ]
+    assert included == [tmp_path / "sites.yaml"]
+
+
+def test_expand_resources_unknown_variable():
+    """Test placeholders without a value are reported"""
+    with pytest.raises(ValueError, match="Unknown template variable 'site'"):
+        list(
+            utils.expand_resources(
+                {
+                    "{site}": {
+                        "type": "team",
+                        "for_each": ["a"],
+                        "properties": {"name": "x"},
+                    }
+                }
+            )
+        )
+
+
+def test_expand_resources_keeps_plain_resources():
+    """Test braces outside of modules and loops are not placeholders"""
+    resource = {
+        "type": "project",
+        "properties": {"name": "P", "description": 'JSON like {"a": 1}'},
+    }
+
+    assert list(utils.expand_resources({"{p}": resource})) == [("{p}", resource)]
+
+
+def test_write_json_atomic_follows_umask(tmp_path):
+    """Test atomically written files get the permissions of a plain open()"""
+    path = tmp_path / "state.json"
+    utils.write_json_atomic(path, {"a": 1})
+
+    plain = tmp_path / "plain.json"
+    plain.write_text("{}")
+    assert path.stat().st_mode == plain.stat().st_mode
+    assert json.loads(path.read_text()) == {"a": 1}